@@ -1,8 +1,12 @@
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
 from fastapi.security import OAuth2PasswordRequestForm
-from app.auth.jwt import create_access_token, verify_password
-from app.dependencies import get_user_repository
+from app.auth.jwt import create_access_token, oauth2_scheme
+from app.auth.password import password_hasher, PasswordHasherBusy
+from app.db.models import UserInDB
+from app.db.services.tokencache import token_cache
+from app.dependencies import get_current_user, get_user_repository
 from app.auth.jwt import Token
 from app.core import config
 
@@ -14,7 +18,13 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     
-    if not verify_password(form_data.password, user.hashed_password):
+    try:
+        # bcrypt is CPU bound, keep it off the event loop
+        password_ok = await password_hasher.verify(form_data.password, user.hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Too many login attempts in progress, retry shortly",
+                            headers={"Retry-After": "1"})
+    if not password_ok:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     
     # Create the access token
@@ -24,3 +34,13 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
 
     return {"access_token": access_token, "token_type": "bearer"}
+
+@router.post("/logout", status_code=204)
+async def logout(token: str = Depends(oauth2_scheme), current_user: UserInDB = Depends(get_current_user)):
+    """Revoke the access token of the request on every worker."""
+    try:
+        await token_cache.revoke(token)
+    except Exception:
+        # Revoked on this worker only; the others would still accept the token
+        raise HTTPException(status_code=503, detail="Could not revoke the token, retry shortly", headers={"Retry-After": "1"})
+    return Response(status_code=204)
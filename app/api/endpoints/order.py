@@ -1,31 +1,162 @@
-from fastapi import APIRouter, Body, Depends
-from fastapi.responses import JSONResponse
-from app.db.models import PlaceOrderBase, OrderStatus, ExchangeCredentials, OrderStructure
-from app.db.repositories.orderrepository import OrderRepository
+import asyncio
+from datetime import datetime
+from typing import List, Literal, Optional
+import orjson
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from app.core import config
+from app.db.models import PlaceOrderBase, OrderTicket, OrderStatus, OrderStructure, UserInDB, OrderResult, OrderResultStatus, \
+    ExchangeCredentials, OutboxEvent, OrderAcknowledgement, ORDER_RESULTS_JSON, Exchange, OrderHistoryPage
+from app.db.repositories.orderrepository import OrderRepository, decode_cursor
 from app.exchanges.integrations import AbstractExchange
-from app.dependencies import get_exchange_credentials, get_order_repository
-from app.db.services.kafkaproducer import KafkaProducer
+from app.exchanges.pool import exchange_pool
+from app.exchanges.markets import MarketRuleViolation, market_rules
+from app.api.errors import order_errors
+from app.dependencies import get_current_user, get_exchange, get_exchange_credentials, get_order, get_order_repository, find_exchange_credentials
+from app.db.services.outboxrelay import outbox_relay
+from app.db.services.idempotency import idempotency_store
+from app.db.services.updatehub import update_hub
 
 router = APIRouter()
 
-@router.post("/place_order/", response_model=OrderStructure)
-async def place_order(order: PlaceOrderBase = Body(...),                      
-                      exchange_credentials: ExchangeCredentials = Depends(get_exchange_credentials),
-                      order_repository: OrderRepository = Depends(get_order_repository)):
-    # 1. Determine the exchange to use. 
-    # This can be from `order.exchangeSpecificParams` or another dedicated field.
-    exchange_name = order.exchange.value
-    exchange: AbstractExchange = AbstractExchange.create(exchange_name, exchange_credentials.api_key, exchange_credentials.api_secret)
+# The bodies of the single order endpoints never change, they are serialized once
+ORDER_OPEN = b'{"status":"open"}'
+ORDER_NOT_PLACED = b'{"message":"Order could not be placed."}'
 
-    # 2. Place the order using the exchange's implementation
-    order_response = await exchange.place_order(order)
+async def submit_order(exchange: AbstractExchange, order: OrderTicket, order_repository: OrderRepository,
+                       exchange_credentials: ExchangeCredentials) -> OrderStructure:
+    """Place an order on the exchange, then record it with its outbox event. Returns None if the exchange did not accept it."""
+    # Checked and rounded against the market's rules locally, so that invalid orders never reach the exchange
+    order = market_rules.apply(order)
+    # A duplicate submission (e.g. a client retry) gets the outcome of the first one instead of reaching the exchange
+    claim = await idempotency_store.claim(idempotency_store.key(exchange_credentials, order.clientOrderId))
+    if claim.replayed:
+        return claim.result
+    try:
+        order_response = await exchange.place_order(order)
+    except BaseException:
+        await idempotency_store.release(claim)
+        raise
     order_id = order_response.id
     client_oid = order_response.clientOrderId
-    if order_id and client_oid:
-        # 2.1. Store the order in the database
-        order_repository.create(OrderStructure(clientOrderId=client_oid, id=order_id))
-        # 2.2. Produce the order to the Kafka topic        
-        await KafkaProducer().send_order("orders_submitted", order_id, client_oid)
-        return JSONResponse(status_code=200, content={"status": OrderStatus.OPEN})
+    if not (order_id and client_oid):
+        await idempotency_store.complete(claim, None)
+        return None
+    # Store the order together with the event to publish; the outbox relay produces it to Kafka,
+    # keyed by account so that an account's events stay ordered on one partition
+    account_key = f"{exchange_credentials.user_id}:{exchange_credentials.name.value}"
+    event = OutboxEvent(topic="orders_submitted", key=account_key,
+                        payload={"orderId": order_id, "clientOid": client_oid, "userId": exchange_credentials.user_id,
+                                 "exchange": exchange_credentials.name.value, "symbol": order.symbol})
+    # Fields the exchange response lacks are filled in from the request while the document is built, without copying the model
+    defaults = {"symbol": order.symbol, "type": order.type.value, "side": order.side.value, "amount": order.amount,
+                "price": order.price, "status": OrderStatus.OPEN.value}
+    try:
+        await order_repository.create(order_response, account=exchange_credentials, event=event, defaults=defaults)
+    except BaseException:
+        # Not replayed as a success: the order was never stored nor its event sent. The exchange rejects a retry
+        # reusing the clientOrderId rather than opening the position twice.
+        await idempotency_store.release(claim)
+        raise
+    # Only an order that was recorded is replayed to duplicates
+    await idempotency_store.complete(claim, order_response)
+    outbox_relay.notify()
+    # Pushed to the user's other /stream connections, e.g. their dashboards, without delaying the response
+    update_hub.publish_soon(exchange_credentials.user_id, "order",
+                            {"id": order_id, "clientOrderId": client_oid, "exchange": exchange_credentials.name.value,
+                             "symbol": order.symbol, "status": OrderStatus.OPEN.value})
+    return order_response
+
+@router.post("/place_order/", response_model=OrderAcknowledgement)
+async def place_order(order: OrderTicket = Depends(get_order),
+                      exchange_credentials: ExchangeCredentials = Depends(get_exchange_credentials),
+                      exchange: AbstractExchange = Depends(get_exchange),
+                      order_repository: OrderRepository = Depends(get_order_repository)):
+    # 1. The exchange client for the account comes from the pool (see get_exchange)
+
+    # 2. Place the order using the exchange's implementation, then store and publish it
+    with order_errors():
+        order_response = await submit_order(exchange, order, order_repository, exchange_credentials)
+    if order_response:
+        return Response(ORDER_OPEN, status_code=200, media_type="application/json")
     else:
-        return JSONResponse(status_code=400, content={"message": 'Order could not be placed.'})
\ No newline at end of file
+        return Response(ORDER_NOT_PLACED, status_code=400, media_type="application/json")
+
+@router.post("/place_orders/", response_model=List[OrderResult])
+async def place_orders(orders: List[PlaceOrderBase] = Body(...),
+                       current_user: UserInDB = Depends(get_current_user),
+                       order_repository: OrderRepository = Depends(get_order_repository)):
+    """
+    Place several orders at once. The whole batch is validated before anything is sent; orders are then
+    dispatched concurrently (bounded per exchange) and each one gets its own result, so a failed leg
+    does not affect the others.
+    """
+    # 1. Validate the whole batch up front
+    if not orders:
+        raise HTTPException(status_code=400, detail="No orders given.")
+    if len(orders) > config.ORDER_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {config.ORDER_BATCH_MAX_SIZE} orders can be placed at once.")
+    if len({order.clientOrderId for order in orders}) != len(orders):
+        raise HTTPException(status_code=400, detail="clientOrderId must be unique within a batch.")
+    credentials = {order.exchange.value: find_exchange_credentials(current_user, order.exchange.value) for order in orders}
+    tickets = [OrderTicket.from_order(order) for order in orders]
+
+    # 2. Dispatch concurrently
+    async def dispatch(order: OrderTicket) -> OrderResult:
+        exchange_name = order.exchange.value
+        exchange_credentials = credentials[exchange_name]
+        try:
+            async with exchange_pool.limit(exchange_name), \
+                    exchange_pool.lease(exchange_name, exchange_credentials.api_key, exchange_credentials.api_secret) as exchange:
+                order_response = await submit_order(exchange, order, order_repository, exchange_credentials)
+        except MarketRuleViolation as e:
+            return OrderResult(clientOrderId=order.clientOrderId, status=OrderResultStatus.REJECTED, error=str(e))
+        except Exception as e:
+            return OrderResult(clientOrderId=order.clientOrderId, status=OrderResultStatus.FAILED, error=str(e) or type(e).__name__)
+        if not order_response:
+            return OrderResult(clientOrderId=order.clientOrderId, status=OrderResultStatus.REJECTED, error="Order could not be placed.")
+        return OrderResult(clientOrderId=order.clientOrderId, status=OrderResultStatus.PLACED, id=order_response.id)
+
+    results = await asyncio.gather(*(dispatch(order) for order in tickets))
+    # Serialized by pydantic-core straight to bytes instead of through jsonable_encoder and the response_model
+    return Response(ORDER_RESULTS_JSON.dump_json(results), status_code=200, media_type="application/json")
+
+def _history_json(value) -> bytes:
+    # Dates are stored as naive UTC; anything orjson does not know (e.g. a Decimal128 in `info`) is written as a string
+    return orjson.dumps(value, option=orjson.OPT_NAIVE_UTC, default=str)
+
+@router.get("/history", response_model=OrderHistoryPage)
+async def order_history(exchange: Optional[Exchange] = None, symbol: Optional[str] = None, status: Optional[OrderStatus] = None,
+                        start: Optional[datetime] = Query(None, description="Orders created at or after this time"),
+                        end: Optional[datetime] = Query(None, description="Orders created before this time"),
+                        fields: Optional[str] = Query(None, description="Comma separated fields to return, all by default"),
+                        cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+                        limit: int = Query(config.ORDER_HISTORY_PAGE_SIZE, ge=1, le=config.ORDER_HISTORY_MAX_PAGE_SIZE),
+                        format: Literal["json", "ndjson"] = "json",
+                        current_user: UserInDB = Depends(get_current_user),
+                        order_repository: OrderRepository = Depends(get_order_repository)):
+    """
+    The account's orders, newest first. Pages are keyset paginated on (createdAt, _id), so that deep pages cost the
+    same as the first one; `format=ndjson` streams every matching order instead, one JSON document per line,
+    without holding them in memory (`limit` does not apply).
+    """
+    projected = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    try:
+        after = decode_cursor(cursor) if cursor else None
+        # Validated before anything is read, so that a bad request never reaches MongoDB nor starts a stream
+        order_repository.history_projection(projected)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filters = {"exchange": exchange.value if exchange else None, "symbol": symbol, "status": status.value if status else None,
+               "start": start, "end": end}
+
+    if format == "ndjson":
+        async def lines():
+            async for batch in order_repository.stream_history(current_user.id, config.ORDER_HISTORY_STREAM_BATCH, after=after,
+                                                               fields=projected, **filters):
+                # One chunk per cursor batch rather than per order
+                yield b"".join([_history_json(document) + b"\n" for document in batch])
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    orders, next_cursor = await order_repository.history(current_user.id, limit, after=after, fields=projected, **filters)
+    return Response(_history_json({"orders": orders, "next_cursor": next_cursor}), status_code=200, media_type="application/json")
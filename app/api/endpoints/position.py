@@ -1,35 +1,36 @@
-from fastapi import APIRouter, Body, Depends
-from fastapi.responses import JSONResponse
-from app.db.models import UserInDB, PlaceOrderBase, OrderStatus, ExchangeCredentials, OrderStructure
+from fastapi import APIRouter, Depends
+from fastapi.responses import Response
+from app.api.errors import order_errors
+from app.db.models import UserInDB, OrderTicket, OrderAcknowledgement
 from app.exchanges.integrations import AbstractExchange
-from app.dependencies import get_exchange_credentials, get_current_user, has_open_position, is_tpsl_order_type
+from app.exchanges.markets import market_rules
+from app.dependencies import get_exchange, get_current_user, get_order, has_open_position, is_tpsl_order_type
 
 router = APIRouter()
 
-@router.post("/close_position/", response_model=OrderStructure)
-async def close_position(order: PlaceOrderBase = Body(...),
+POSITION_CLOSED = b'{"status":"closed"}'
+ORDER_OPEN = b'{"status":"open"}'
+
+@router.post("/close_position/", response_model=OrderAcknowledgement)
+async def close_position(order: OrderTicket = Depends(get_order),
                         current_user: UserInDB = Depends(get_current_user),                      
-                        exchange_credentials: ExchangeCredentials = Depends(get_exchange_credentials),
-                        has_open_position: bool = Depends(has_open_position)):
+                        has_open_position: bool = Depends(has_open_position),
+                        exchange: AbstractExchange = Depends(get_exchange)):
     
-    exchange_name = order.exchange.value
-    exchange: AbstractExchange = AbstractExchange.create(exchange_name, exchange_credentials.api_key, exchange_credentials.api_secret)
-
-    # 2. Place the order using the exchange's implementation
-    order_response = await exchange.place_order(order)
-    return JSONResponse(status_code=200, content={"status": OrderStatus.CLOSED})
+    # 2. Place the order using the exchange's implementation, checked against the market's rules like /order/place_order
+    with order_errors():
+        order_response = await exchange.place_order(market_rules.apply(order))
+    return Response(POSITION_CLOSED, status_code=200, media_type="application/json")
 
 
-@router.post("/tpsl_order/", response_model=OrderStructure)
-async def take_profit_stop_loss(order: PlaceOrderBase = Body(...),
+@router.post("/tpsl_order/", response_model=OrderAcknowledgement)
+async def take_profit_stop_loss(order: OrderTicket = Depends(get_order),
                                 current_user: UserInDB = Depends(get_current_user),                      
-                                exchange_credentials: ExchangeCredentials = Depends(get_exchange_credentials),
                                 has_open_position: bool = Depends(has_open_position),
-                                is_tpsl_order_type: bool = Depends(is_tpsl_order_type)):
+                                is_tpsl_order_type: bool = Depends(is_tpsl_order_type),
+                                exchange: AbstractExchange = Depends(get_exchange)):
     
-    exchange_name = order.exchange.value
-    exchange: AbstractExchange = AbstractExchange.create(exchange_name, exchange_credentials.api_key, exchange_credentials.api_secret)
-
-    # 2. Place the order using the exchange's implementation
-    order_response = await exchange.place_order(order)
-    return JSONResponse(status_code=200, content={"status": OrderStatus.OPEN})
\ No newline at end of file
+    # 2. Place the order using the exchange's implementation, checked against the market's rules like /order/place_order
+    with order_errors():
+        order_response = await exchange.place_order(market_rules.apply(order))
+    return Response(ORDER_OPEN, status_code=200, media_type="application/json")
\ No newline at end of file
@@ -0,0 +1,69 @@
+import asyncio
+from typing import AsyncIterator
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, WebSocketException, status
+from fastapi.responses import StreamingResponse
+from starlette.websockets import WebSocketState
+from app.core import config
+from app.db.models import UserInDB
+from app.db.services.updatehub import Subscription, TooManySubscribers, update_hub
+from app.dependencies import get_current_user, get_websocket_user
+
+router = APIRouter()
+
+SSE_KEEP_ALIVE = b": keep-alive\n\n"
+
+
+async def _end_on_disconnect(websocket: WebSocket, subscription: Subscription) -> None:
+    # Clients send nothing on the stream; reading only notices that they went away
+    try:
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        subscription.close()
+
+@router.websocket("/stream")
+async def stream_websocket(websocket: WebSocket, current_user: UserInDB = Depends(get_websocket_user)):
+    """
+    Order and position updates of the user, pushed as JSON text messages {"type": ..., "data": ...} until the
+    client disconnects. A {"type": "resync"} message means updates may have been missed: read the current state
+    from the API. A client that does not keep up is disconnected with code 1013.
+    """
+    try:
+        async with update_hub.subscribe(current_user.id) as subscription:
+            await websocket.accept()
+            watcher = asyncio.create_task(_end_on_disconnect(websocket, subscription))
+            try:
+                while (message := await subscription.get()) is not None:
+                    await websocket.send_text(message.decode())
+            except WebSocketDisconnect:
+                return
+            finally:
+                watcher.cancel()
+            if websocket.client_state == WebSocketState.CONNECTED and websocket.application_state == WebSocketState.CONNECTED:
+                # Dropped for being too slow, or the worker is shutting down
+                code = status.WS_1013_TRY_AGAIN_LATER if subscription.dropped else status.WS_1001_GOING_AWAY
+                await websocket.close(code=code)
+    except TooManySubscribers:
+        raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many connections")
+
+async def sse_events(user_id: str, heartbeat: float = config.STREAM_HEARTBEAT) -> AsyncIterator[bytes]:
+    """The user's updates as server-sent events, with a comment every `heartbeat` seconds to keep proxies from timing out."""
+    async with update_hub.subscribe(user_id) as subscription:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield SSE_KEEP_ALIVE
+                continue
+            if message is None:
+                return
+            yield b"data: " + message + b"\n\n"
+
+@router.get("/stream")
+async def stream_server_sent_events(current_user: UserInDB = Depends(get_current_user)):
+    """Server-sent events fallback of the /stream WebSocket for clients that cannot open one; same messages."""
+    # Checked up front, the stream can no longer be refused once the response started
+    if update_hub.closing or update_hub.connections >= update_hub.max_connections:
+        raise HTTPException(status_code=503, detail="Too many connections, retry shortly", headers={"Retry-After": "5"})
+    return StreamingResponse(sse_events(current_user.id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,26 @@
+import math
+from contextlib import contextmanager
+from typing import Iterator
+from fastapi import HTTPException
+from app.core.retrytemplate import CircuitOpen
+from app.db.services.idempotency import DuplicateRequestInProgress
+from app.exchanges.markets import MarketRuleViolation
+from app.exchanges.ratelimit import RateLimitExceeded
+
+
+@contextmanager
+def order_errors() -> Iterator[None]:
+    """Map the errors of placing an order to the HTTP errors of the order endpoints, with Retry-After where it applies."""
+    try:
+        yield
+    except MarketRuleViolation as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DuplicateRequestInProgress as e:
+        raise HTTPException(status_code=409, detail="An order with this clientOrderId is being placed",
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail="Exchange rate limit reached, retry shortly",
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail="Exchange unavailable, retry shortly",
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
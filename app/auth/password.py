@@ -1,4 +1,10 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
 from passlib.context import CryptContext
+from app.core import config
+from app.core.lifecycle import after_fork
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -7,4 +13,87 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hashing jobs are already waiting for a worker."""
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt hashing/verification on a bounded worker pool so that a burst of logins never stalls
+    the event loop. bcrypt releases the GIL, so a thread pool already spreads the work across cores;
+    a process pool can be selected instead. Jobs beyond `max_queue` waiting ones are rejected.
+    """
+
+    def __init__(self, executor_type: str = config.PASSWORD_HASH_EXECUTOR, workers: int = config.PASSWORD_HASH_WORKERS,
+                 max_queue: int = config.PASSWORD_HASH_MAX_QUEUE):
+        self.executor_type = executor_type
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.pending - self.workers)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "in_flight": self.pending,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_seconds": self.total_seconds / self.completed if self.completed else 0.0,
+            "max_seconds": self.max_seconds,
+        }
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _after_fork(self) -> None:
+        # The parent's worker threads (or processes) do not exist in the child
+        self._executor = None
+        self.pending = 0
+
+    def _get_executor(self) -> Executor:
+        # Created on first use so that the workers belong to the process serving requests
+        if self._executor is None:
+            if self.executor_type == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        return self._executor
+
+    async def _run(self, func: Callable, *args):
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.pending -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+
+
+password_hasher = PasswordHasher()
+after_fork(password_hasher._after_fork)
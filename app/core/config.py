@@ -1,14 +1,124 @@
-from decouple import config
+from decouple import Csv, config
 
 MONGODB_URI = config('MONGODB_URI')
 MONGODB_DB = config("MONGODB_DB")
 SECRET_KEY = config('SECRET_KEY')
 ALGORITHM = config('ALGORITHM')
-ACCESS_TOKEN_EXPIRE_MINUTES = config('ACCESS_TOKEN_EXPIRE_MINUTES')
-CACHE_KEY_FORMAT = config('CACHE_KEY_FORMAT')
-REDIS_MAX_CONNECTIONS = config('REDIS_MAX_CONNECTIONS')
-REDIS_MIN_CONNECTIONS = config('REDIS_MIN_CONNECTIONS')
+ACCESS_TOKEN_EXPIRE_MINUTES = config('ACCESS_TOKEN_EXPIRE_MINUTES', cast=int)
+CACHE_KEY_FORMAT = config('CACHE_KEY_FORMAT')  # Redis hash holding an account's positions, e.g. positions:{user_id}
+REDIS_MAX_CONNECTIONS = config('REDIS_MAX_CONNECTIONS', cast=int)
+REDIS_MIN_CONNECTIONS = config('REDIS_MIN_CONNECTIONS', cast=int)
 REDIS_HOST = config('REDIS_HOST')
-REDIS_PORT = config('REDIS_PORT')
+REDIS_PORT = config('REDIS_PORT', cast=int)
+REDIS_POOL_TIMEOUT = config('REDIS_POOL_TIMEOUT', default=1.0, cast=float)  # seconds a command waits for a free pooled connection
 SERVICE_NAME = config('SERVICE_NAME')
 KAFKA_URI = config('KAFKA_URI')
+
+# MongoDB connection pool
+MONGODB_MIN_POOL_SIZE = config('MONGODB_MIN_POOL_SIZE', default=10, cast=int)
+MONGODB_MAX_POOL_SIZE = config('MONGODB_MAX_POOL_SIZE', default=100, cast=int)
+MONGODB_MAX_IDLE_TIME_MS = config('MONGODB_MAX_IDLE_TIME_MS', default=60000, cast=int)
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = config('MONGODB_SERVER_SELECTION_TIMEOUT_MS', default=5000, cast=int)
+
+# Exchange client pool
+EXCHANGE_POOL_MAX_SIZE = config('EXCHANGE_POOL_MAX_SIZE', default=256, cast=int)
+EXCHANGE_POOL_IDLE_TTL = config('EXCHANGE_POOL_IDLE_TTL', default=300, cast=int)  # seconds
+
+# Authenticated user cache
+USER_CACHE_MAX_SIZE = config('USER_CACHE_MAX_SIZE', default=10000, cast=int)
+USER_CACHE_TTL = config('USER_CACHE_TTL', default=300, cast=int)  # seconds
+USER_CACHE_CHANNEL = config('USER_CACHE_CHANNEL', default='user_cache_invalidation')
+
+# Verified access token cache and revocations
+TOKEN_CACHE_MAX_SIZE = config('TOKEN_CACHE_MAX_SIZE', default=10000, cast=int)
+TOKEN_REVOCATION_PREFIX = config('TOKEN_REVOCATION_PREFIX', default='revoked_token:')  # Redis key of a revoked token, + its hash
+TOKEN_REVOCATION_CHANNEL = config('TOKEN_REVOCATION_CHANNEL', default='token_revocation')
+
+# Password hashing executor
+PASSWORD_HASH_EXECUTOR = config('PASSWORD_HASH_EXECUTOR', default='thread')  # thread or process
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=4, cast=int)
+PASSWORD_HASH_MAX_QUEUE = config('PASSWORD_HASH_MAX_QUEUE', default=64, cast=int)
+
+# Batch order placement
+ORDER_BATCH_MAX_SIZE = config('ORDER_BATCH_MAX_SIZE', default=50, cast=int)
+EXCHANGE_MAX_CONCURRENCY = config('EXCHANGE_MAX_CONCURRENCY', default=10, cast=int)  # in-flight calls per exchange and worker
+
+# Kafka producer
+KAFKA_LINGER_MS = config('KAFKA_LINGER_MS', default=5, cast=int)
+KAFKA_MAX_BATCH_SIZE = config('KAFKA_MAX_BATCH_SIZE', default=65536, cast=int)  # bytes per partition batch
+KAFKA_COMPRESSION_TYPE = config('KAFKA_COMPRESSION_TYPE', default='gzip')  # gzip, snappy, lz4, zstd or none
+KAFKA_ACKS = config('KAFKA_ACKS', default='all')
+KAFKA_SEND_WAIT = config('KAFKA_SEND_WAIT', default=False, cast=bool)  # wait for the broker ack before replying
+
+# Order outbox relay
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=500, cast=int)
+OUTBOX_POLL_INTERVAL = config('OUTBOX_POLL_INTERVAL', default=1.0, cast=float)  # seconds between polls when idle
+OUTBOX_CLAIM_TTL = config('OUTBOX_CLAIM_TTL', default=30, cast=int)  # seconds a worker holds claimed events
+
+# Position synchronization
+POSITION_SYNC_ENABLED = config('POSITION_SYNC_ENABLED', default=False, cast=bool)  # poll every account from each API worker
+POSITION_SYNC_INTERVAL = config('POSITION_SYNC_INTERVAL', default=2.0, cast=float)  # seconds between polls
+POSITION_SYNC_ACCOUNT_REFRESH = config('POSITION_SYNC_ACCOUNT_REFRESH', default=60.0, cast=float)  # seconds
+
+# Logging
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+LOG_BATCH_SIZE = config('LOG_BATCH_SIZE', default=256, cast=int)
+LOG_FLUSH_INTERVAL = config('LOG_FLUSH_INTERVAL', default=0.05, cast=float)  # seconds
+LOG_FLUSH_TIMEOUT = config('LOG_FLUSH_TIMEOUT', default=5.0, cast=float)  # seconds flush() waits for queued records
+LOG_BACKPRESSURE_SAMPLE_RATE = config('LOG_BACKPRESSURE_SAMPLE_RATE', default=10, cast=int)  # keep 1 in N info records when backed up
+
+# Exchange rate limiting (token buckets shared through Redis)
+RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+RATE_LIMIT_WAIT = config('RATE_LIMIT_WAIT', default=True, cast=bool)  # wait for a token instead of failing fast
+RATE_LIMIT_MAX_WAIT = config('RATE_LIMIT_MAX_WAIT', default=2.0, cast=float)  # seconds
+RATE_LIMIT_PREFIX = config('RATE_LIMIT_PREFIX', default='ratelimit')
+
+# Exchange call resilience (circuit breakers per exchange and operation, retries)
+BREAKER_FAIL_MAX = config('BREAKER_FAIL_MAX', default=5, cast=int)  # consecutive failures that open a circuit
+BREAKER_RESET_TIMEOUT = config('BREAKER_RESET_TIMEOUT', default=20.0, cast=float)  # seconds before a trial call
+RETRY_ATTEMPTS = config('RETRY_ATTEMPTS', default=3, cast=int)
+RETRY_BASE_DELAY = config('RETRY_BASE_DELAY', default=0.1, cast=float)  # seconds
+RETRY_MAX_DELAY = config('RETRY_MAX_DELAY', default=1.0, cast=float)  # seconds
+RETRY_DEADLINE = config('RETRY_DEADLINE', default=5.0, cast=float)  # seconds
+
+# Market rules used to validate and round orders locally
+MARKET_RULES_REFRESH_INTERVAL = config('MARKET_RULES_REFRESH_INTERVAL', default=3600.0, cast=float)  # seconds
+
+# Idempotent order submission (keyed by clientOrderId)
+IDEMPOTENCY_PREFIX = config('IDEMPOTENCY_PREFIX', default='idempotency')
+IDEMPOTENCY_LOCK_TTL = config('IDEMPOTENCY_LOCK_TTL', default=30, cast=int)  # seconds an in-flight submission holds its key
+IDEMPOTENCY_RESULT_TTL = config('IDEMPOTENCY_RESULT_TTL', default=86400, cast=int)  # seconds a result is replayed
+IDEMPOTENCY_WAIT_TIMEOUT = config('IDEMPOTENCY_WAIT_TIMEOUT', default=10.0, cast=float)  # seconds a duplicate waits
+
+# Order status reconciliation (consumer of the orders_submitted topic)
+RECONCILER_ENABLED = config('RECONCILER_ENABLED', default=False, cast=bool)  # run the consumer inside the API workers
+RECONCILER_TOPIC = config('RECONCILER_TOPIC', default='orders_submitted')
+RECONCILER_GROUP_ID = config('RECONCILER_GROUP_ID', default='order_reconciler')  # workers of a group share the partitions
+RECONCILER_INTERVAL = config('RECONCILER_INTERVAL', default=5.0, cast=float)  # seconds between passes over pending orders
+RECONCILER_MAX_RECORDS = config('RECONCILER_MAX_RECORDS', default=500, cast=int)  # messages per poll
+RECONCILER_SINCE_MARGIN = config('RECONCILER_SINCE_MARGIN', default=60, cast=int)  # seconds of clock skew allowed for in since cursors
+RECONCILER_MAX_AGE = config('RECONCILER_MAX_AGE', default=604800, cast=int)  # seconds an order is looked for before giving up
+RECONCILER_CREDENTIALS_REFRESH = config('RECONCILER_CREDENTIALS_REFRESH', default=60.0, cast=float)  # seconds between credential reloads
+
+# MongoDB write coalescing (inserts and updates of these collections are sent in batches)
+MONGODB_COALESCE_COLLECTIONS = config('MONGODB_COALESCE_COLLECTIONS', default='orders', cast=Csv())
+MONGODB_WRITE_BATCH_SIZE = config('MONGODB_WRITE_BATCH_SIZE', default=100, cast=int)  # operations per batch
+MONGODB_WRITE_BATCH_DELAY = config('MONGODB_WRITE_BATCH_DELAY', default=0.002, cast=float)  # seconds the first write of a batch waits
+# Write concern of a collection when the caller gives none, e.g. "orders=majority,events=1"
+MONGODB_WRITE_CONCERNS = config('MONGODB_WRITE_CONCERNS', default='', cast=Csv(post_process=dict, cast=lambda pair: tuple(pair.split('=', 1))))
+
+# Order history
+ORDER_HISTORY_PAGE_SIZE = config('ORDER_HISTORY_PAGE_SIZE', default=100, cast=int)  # orders per page unless asked otherwise
+ORDER_HISTORY_MAX_PAGE_SIZE = config('ORDER_HISTORY_MAX_PAGE_SIZE', default=1000, cast=int)
+ORDER_HISTORY_STREAM_BATCH = config('ORDER_HISTORY_STREAM_BATCH', default=500, cast=int)  # orders per chunk when streaming NDJSON
+
+# Order and position updates pushed over /stream
+STREAM_CHANNEL_PREFIX = config('STREAM_CHANNEL_PREFIX', default='updates:')  # Redis channel of a user is the prefix + user id
+STREAM_QUEUE_SIZE = config('STREAM_QUEUE_SIZE', default=256, cast=int)  # messages a connection may fall behind before it is dropped
+STREAM_MAX_CONNECTIONS = config('STREAM_MAX_CONNECTIONS', default=10000, cast=int)  # per worker
+STREAM_HEARTBEAT = config('STREAM_HEARTBEAT', default=15.0, cast=float)  # seconds between SSE keep-alive comments
+
+# Process lifecycle
+PRELOAD = config('PRELOAD', default=False, cast=bool)  # startup work done once by the master, with gunicorn --preload
+SHUTDOWN_DRAIN_TIMEOUT = config('SHUTDOWN_DRAIN_TIMEOUT', default=20.0, cast=float)  # seconds in-flight requests get on shutdown
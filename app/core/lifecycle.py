@@ -0,0 +1,190 @@
+import asyncio
+import inspect
+import os
+import traceback
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, Union
+from fastapi.responses import ORJSONResponse
+from app.core.logging import AsyncLogger
+
+Step = Callable[[], Union[Awaitable[Any], Any]]
+
+
+def after_fork(callback: Callable[[], None]) -> None:
+    """
+    Run `callback` in a child process right after a fork, e.g. to drop clients whose sockets, threads or event loop
+    belong to the parent when the app was preloaded by the master (gunicorn --preload).
+    """
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=callback)
+
+
+class Resource(NamedTuple):
+    name: str
+    start: Optional[Step]
+    stop: Optional[Step]
+
+
+class ResourceContainer:
+    """
+    The resources of a worker process, in startup order. start() runs in the worker, after the fork; stop() stops
+    what was started in reverse order, logging rather than raising errors so that one failing resource does not
+    keep the others open. Steps may be coroutine functions or plain functions.
+    """
+
+    def __init__(self):
+        self._resources: List[Resource] = []
+        self._started: List[Resource] = []
+        self._logger = AsyncLogger().get_logger()
+
+    def add(self, name: str, start: Optional[Step] = None, stop: Optional[Step] = None) -> "ResourceContainer":
+        self._resources.append(Resource(name, start, stop))
+        return self
+
+    def stats(self) -> dict:
+        return {"started": [resource.name for resource in self._started]}
+
+    async def start(self) -> None:
+        for resource in self._resources:
+            try:
+                await self._run(resource.start)
+            except BaseException:
+                self._logger.error(f"Error starting {resource.name}: {traceback.format_exc()}")
+                # The worker does not come up, nothing it opened so far may leak
+                await self.stop()
+                raise
+            self._started.append(resource)
+
+    async def stop(self) -> None:
+        while self._started:
+            resource = self._started.pop()
+            try:
+                await self._run(resource.stop)
+            except Exception:
+                self._logger.error(f"Error stopping {resource.name}: {traceback.format_exc()}")
+
+    @staticmethod
+    async def _run(step: Optional[Step]) -> None:
+        if step is not None:
+            result = step()
+            if inspect.isawaitable(result):
+                await result
+
+
+class ShutdownSignal:
+    """
+    Fires as soon as the server is asked to exit. uvicorn then closes its sockets and waits for every open
+    connection before it runs the lifespan shutdown, so work that lets connections end, e.g. closing the /stream
+    connections or refusing new requests, must not wait for the lifespan: it is registered here instead. Callbacks
+    run on the event loop, from uvicorn's signal handler, and must not block.
+    """
+
+    def __init__(self):
+        self.received = False
+        self._callbacks: List[Callable[[], None]] = []
+        self._logger = AsyncLogger().get_logger()
+
+    def on_shutdown(self, callback: Callable[[], None]) -> None:
+        self._callbacks.append(callback)
+
+    def trigger(self) -> None:
+        if self.received:
+            return
+        self.received = True
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception:
+                self._logger.error(f"Error in shutdown callback: {traceback.format_exc()}")
+
+    def reset(self) -> None:
+        self.received = False
+
+    def install(self) -> None:
+        """Hook trigger() into uvicorn's exit signal handling (SIGINT, SIGTERM), also under gunicorn's UvicornWorker."""
+        try:
+            from uvicorn.server import Server
+        except ImportError:
+            return
+        if getattr(Server.handle_exit, "shutdown_signal", None) is self:
+            return
+        handle_exit = Server.handle_exit
+
+        def _handle_exit(server, sig, frame):
+            handle_exit(server, sig, frame)
+            self.trigger()
+        _handle_exit.shutdown_signal = self
+        Server.handle_exit = _handle_exit
+
+
+class InFlightRequests:
+    """
+    Count of the HTTP requests a worker is serving, so that shutdown waits for them before closing the clients
+    they use. Once draining, new requests are refused with 503 (see InFlightMiddleware).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self.refused = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    def stats(self) -> dict:
+        return {"in_flight": self.count, "draining": self.draining, "refused": self.refused}
+
+    def enter(self) -> None:
+        self.count += 1
+
+    def exit(self) -> None:
+        self.count -= 1
+        if self.count == 0 and self._idle is not None:
+            self._idle.set()
+
+    def stop_accepting(self) -> None:
+        """Refuse new requests from now on, without waiting for the current ones."""
+        self.draining = True
+
+    async def drain(self, timeout: float) -> int:
+        """Refuse new requests and wait up to `timeout` seconds for the current ones; returns how many are left."""
+        self.draining = True
+        if self.count:
+            self._idle = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._idle = None
+        return self.count
+
+    def reset(self) -> None:
+        self.count = 0
+        self.draining = False
+        self._idle = None
+
+
+class InFlightMiddleware:
+    """ASGI middleware keeping InFlightRequests current."""
+
+    def __init__(self, app, requests: InFlightRequests):
+        self.app = app
+        self.requests = requests
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if self.requests.draining:
+            self.requests.refused += 1
+            response = ORJSONResponse({"detail": "Shutting down, retry shortly"}, status_code=503,
+                                      headers={"Retry-After": "1", "Connection": "close"})
+            await response(scope, receive, send)
+            return
+        self.requests.enter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.requests.exit()
+
+
+in_flight_requests = InFlightRequests()
+shutdown_signal = ShutdownSignal()
@@ -1,32 +1,216 @@
+import atexit
 import logging
+import os
+import queue
 import sys
-import json
+import threading
+import time
+from contextvars import ContextVar
+from typing import BinaryIO, Optional
+from uuid import uuid4
+import orjson
 from app.core import config
 
+# Attributes copied from a record (passed through `extra=`) or from the request context into the JSON entry
+STRUCTURED_FIELDS = ("request_id", "user", "exchange", "order_type", "latency_ms", "method", "path", "status")
+
+# Structured fields of the request being served, filled in by RequestLoggingMiddleware and the dependencies
+log_context: ContextVar[Optional[dict]] = ContextVar("log_context", default=None)
+
+
+def bind_log_context(**fields) -> None:
+    """Attach fields (e.g. user, exchange) to every record logged for the current request."""
+    context = log_context.get()
+    if context is not None:
+        context.update(fields)
+
+
 class JSONFormatter(logging.Formatter):
-    def format(self, record):
+    def format(self, record) -> str:
+        return self.encode(record).decode()
+
+    def encode(self, record) -> bytes:
+        """The JSON entry of a record as bytes, what AsyncLogHandler writes without going through str."""
         log_entry = {
-            "timestamp": self.formatTime(record, self.datefmt),
+            "timestamp": record.created,
             "name": record.name,
             "level": record.levelname,
             "message": record.getMessage()
         }
-        return json.dumps(log_entry)
+        for field in STRUCTURED_FIELDS:
+            value = record.__dict__.get(field)
+            if value is not None:
+                log_entry[field] = value
+        if record.exc_info:
+            log_entry["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(log_entry, default=str)
+
 
 class AsyncLogHandler(logging.Handler):
-    def __init__(self, *args, **kwargs):
+    """
+    Handler that only enqueues records; a background thread formats them in batches and writes each
+    batch with a single call. Only the request context is copied onto a record when it is enqueued, its
+    message and exception are rendered by the writer thread, so arguments must not be changed once logged.
+    Under backpressure (queue above `high_watermark`) records below WARNING are sampled, 1 in
+    `sample_rate` is kept; when the queue is full records are dropped. Both are counted.
+    """
+
+    def __init__(self, stream: BinaryIO = None, maxsize: int = config.LOG_QUEUE_SIZE, batch_size: int = config.LOG_BATCH_SIZE,
+                 flush_interval: float = config.LOG_FLUSH_INTERVAL, sample_rate: int = config.LOG_BACKPRESSURE_SAMPLE_RATE,
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.stream = stream
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = max(1, sample_rate)
+        self.high_watermark = int(maxsize * 0.8)
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self._sampled = 0
+        self._queue: "queue.Queue[Optional[logging.LogRecord]]" = None
+        self._writer: Optional[threading.Thread] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        atexit.register(self.close)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start_writer()
+        if record.levelno < logging.WARNING and self._queue.qsize() >= self.high_watermark:
+            self._sampled += 1
+            if self._sampled % self.sample_rate:
+                self.sampled_out += 1
+                return
+        # The context variable is only readable from the caller's thread
+        context = log_context.get()
+        if context:
+            for field, value in context.items():
+                record.__dict__.setdefault(field, value)
+        try:
+            self._queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = config.LOG_FLUSH_TIMEOUT):
+        """Block until every record enqueued so far has been written, for at most `timeout` seconds."""
+        if self._writer is not None and self._writer.is_alive() and self._pid == os.getpid():
+            # Queue.join() without its unbounded wait: a stuck stream must not hang the shutdown
+            deadline = time.monotonic() + timeout
+            with self._queue.all_tasks_done:
+                while self._queue.unfinished_tasks:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._queue.all_tasks_done.wait(remaining)
 
-    async def emit(self, record):
-        log_entry = self.format(record)
-        sys.stdout.write(log_entry + "\n")
-        sys.stdout.flush()
+    def close(self):
+        if self._writer is not None and self._pid == os.getpid():
+            if self._writer.is_alive():
+                try:
+                    self._queue.put(None, timeout=5)
+                except queue.Full:
+                    pass
+                self._writer.join(timeout=5)
+            self._writer = None
+        super().close()
+
+    def _start_writer(self):
+        with self._start_lock:
+            # Also runs after a fork: the writer thread of the parent does not exist in the child
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.maxsize)
+                self._writer = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
+                self._pid = os.getpid()
+                self._writer.start()
+
+    def _write_loop(self):
+        log_queue = self._queue
+        while True:
+            record = log_queue.get()
+            batch = [record]
+            deadline = time.monotonic() + self.flush_interval
+            while record is not None and len(batch) < self.batch_size:
+                try:
+                    record = log_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(record)
+            self._write_batch([record for record in batch if record is not None])
+            for _ in batch:
+                log_queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _write_batch(self, records):
+        if not records:
+            return
+        formatter = self.formatter
+        # JSONFormatter renders bytes directly, other formatters follow the str contract of logging.Formatter
+        encode = formatter.encode if isinstance(formatter, JSONFormatter) else lambda record: self.format(record).encode()
+        lines = []
+        for record in records:
+            try:
+                lines.append(encode(record))
+            except Exception:
+                self.handleError(record)
+        try:
+            stream = self.stream or sys.stdout.buffer
+            stream.write(b"\n".join(lines) + b"\n")
+            stream.flush()
+            self.written += len(lines)
+        except Exception:
+            self.dropped += len(lines)
+
+
+class RequestLoggingMiddleware:
+    """ASGI middleware that gives each request an id, exposes it in the log context and logs its latency."""
+
+    def __init__(self, app):
+        self.app = app
+        self._logger = AsyncLogger().get_logger()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = next((value.decode() for name, value in scope["headers"] if name == b"x-request-id"), None) or uuid4().hex
+        context = {"request_id": request_id}
+        token = log_context.set(context)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            context["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            self._logger.info("request", extra={"method": scope["method"], "path": scope["path"], "status": status})
+            log_context.reset(token)
 
 
 class AsyncLogger:
     _instance = None
-    _logger: AsyncLogHandler = None
-    def __new__(cls, name: str = None, level: str = logging.INFO):
+    _logger: logging.Logger = None
+    _handler: AsyncLogHandler = None
+    def __new__(cls, name: str = None, level: str = config.LOG_LEVEL):
         if cls._instance is None:
             cls._instance = super(AsyncLogger, cls).__new__(cls)
             cls._instance._logger = cls._initialize_logger(config.SERVICE_NAME, level)
@@ -37,14 +221,21 @@ class AsyncLogger:
         logger = logging.getLogger(name)
         logger.setLevel(level)
 
-        # Console log handler
+        # Console log handler, writes from a background thread
         ch = AsyncLogHandler()
         ch.setLevel(level)
         formatter = JSONFormatter()
         ch.setFormatter(formatter)
+        AsyncLogger._handler = ch
 
-        logger.addHandler(ch)        
+        logger.addHandler(ch)
         return logger
 
     def get_logger(self) -> logging.Logger:
         return self._logger
+
+    def stats(self) -> dict:
+        return self._handler.stats()
+
+    def flush(self) -> None:
+        self._handler.flush()
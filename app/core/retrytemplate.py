@@ -1,27 +1,166 @@
-import pybreaker
-import tenacity
-import requests
-
-# Define the circuit breaker
-breaker = pybreaker.CircuitBreaker(fail_max=3, reset_timeout=20)  # Trips after 3 failures, resets after 20 seconds
-
-# This is a decorator that you can use on any function that should be protected by the circuit breaker.
-@breaker
-def protected_function_call():
-    # This function would contain the call to the external service.
-    response = requests.get('https://external-service-url.com/api')
-    return response.json()
-
-# This is a decorator for retrying
-@tenacity.retry(stop=tenacity.stop_after_attempt(3), wait=tenacity.wait_fixed(5))
-def retried_function_call():
-    # This function would contain the call to the external service that you want to retry.
-    response = requests.get('https://external-service-url.com/api')
-    return response.json()
-
-# To use both circuit breaker and retry together
-@breaker
-@tenacity.retry(stop=tenacity.stop_after_attempt(3), wait=tenacity.wait_fixed(5))
-def protected_and_retried_function_call():
-    response = requests.get('https://external-service-url.com/api')
-    return response.json()
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, Type, TypeVar
+from app.core import config
+from app.core.metrics import REGISTRY, GaugeCallback
+
+T = TypeVar("T")
+
+
+class CircuitOpen(Exception):
+    """Raised instead of making a call while the circuit breaker of its target is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Asyncio circuit breaker. After `fail_max` consecutive failures the circuit opens and calls fail
+    right away with CircuitOpen for `reset_timeout` seconds; then up to `half_open_max` trial calls are
+    let through and the first outcome closes or reopens the circuit.
+
+    Only exceptions in `failure_on` count as failures; any other exception means the target answered
+    (e.g. an order rejected for insufficient funds) and counts as a success, except those in `ignore`,
+    raised before the target was reached.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, fail_max: int = config.BREAKER_FAIL_MAX, reset_timeout: float = config.BREAKER_RESET_TIMEOUT,
+                 failure_on: Tuple[Type[BaseException], ...] = (Exception,), ignore: Tuple[Type[BaseException], ...] = (),
+                 half_open_max: int = 1):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failure_on = failure_on
+        self.ignore = ignore
+        self.half_open_max = half_open_max
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._state = self.CLOSED
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._trials >= self.half_open_max):
+            self.rejected += 1
+            raise CircuitOpen(self.name, max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)))
+        if state == self.HALF_OPEN:
+            self._trials += 1
+        try:
+            result = await fn()
+        except self.failure_on:
+            self._on_failure()
+            raise
+        except self.ignore:
+            if state == self.HALF_OPEN:
+                self._trials -= 1
+            raise
+        except Exception:
+            # An error the target itself reported (e.g. invalid order) shows it is up
+            self._on_success()
+            raise
+        except BaseException:
+            # Cancelled: no outcome, give the trial slot back
+            if state == self.HALF_OPEN:
+                self._trials -= 1
+            raise
+        self._on_success()
+        return result
+
+    def _on_success(self) -> None:
+        self.failures = 0
+        self._state = self.CLOSED
+
+    def _on_failure(self) -> None:
+        self.failures += 1
+        if self._state == self.HALF_OPEN or self.failures >= self.fail_max:
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self.opened += 1
+
+
+class RetryPolicy(NamedTuple):
+    attempts: int = config.RETRY_ATTEMPTS
+    base_delay: float = config.RETRY_BASE_DELAY  # seconds, doubled on every attempt
+    max_delay: float = config.RETRY_MAX_DELAY  # seconds
+    deadline: float = config.RETRY_DEADLINE  # seconds from the first attempt after which no retry starts
+
+
+NO_RETRY = RetryPolicy(attempts=1)
+
+
+def backoff(policy: RetryPolicy, attempt: int) -> float:
+    """Full jitter: a random delay up to the exponential backoff of the attempt, so clients don't retry in lockstep."""
+    return random.uniform(0, min(policy.max_delay, policy.base_delay * 2 ** attempt))
+
+
+async def retry_call(fn: Callable[[], Awaitable[T]], policy: RetryPolicy = RetryPolicy(), breaker: CircuitBreaker = None,
+                     retry_on: Tuple[Type[BaseException], ...] = (Exception,),
+                     before_retry: Callable[[BaseException], Awaitable[Optional[T]]] = None) -> T:
+    """
+    Call `fn` through `breaker`, retrying errors in `retry_on` with jittered backoff. A retry is not
+    started if its delay would end past the deadline, and never once the circuit is open.
+
+    `before_retry` runs before each retry with the error; a non-None result is returned instead of
+    retrying. Use it for calls that are not idempotent, e.g. to find an order that was created
+    although its response was lost.
+    """
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            return await (breaker.call(fn) if breaker is not None else fn())
+        except retry_on as e:
+            attempt += 1
+            if attempt >= policy.attempts:
+                raise
+            delay = backoff(policy, attempt)
+            if time.monotonic() - started + delay > policy.deadline:
+                raise
+            if breaker is not None and breaker.state == CircuitBreaker.OPEN:
+                raise
+            await asyncio.sleep(delay)
+            if before_retry is not None:
+                result = await before_retry(e)
+                if result is not None:
+                    return result
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """The breaker of a target (e.g. bitget:order), created on first use and shared by the whole process."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name, **kwargs)
+    return breaker
+
+
+def breaker_stats() -> Dict[str, dict]:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+REGISTRY.register(GaugeCallback(
+    "circuit_breaker_state", "State of each circuit breaker: 0 closed, 1 half open, 2 open.", ("breaker",),
+    lambda: {(name,): _STATE_VALUES[breaker.state] for name, breaker in _breakers.items()}))
@@ -0,0 +1,57 @@
+from typing import Dict, List
+from pydantic import BaseModel, Field
+from pymongo import IndexModel
+from app.core.logging import AsyncLogger
+from app.db.repositories.orderrepository import OrderRepository
+from app.db.repositories.userrepository import UserRepository
+from app.db.services.mongodbservice import AsyncMongoDBService
+
+# Repositories declaring the indexes their queries rely on
+REPOSITORIES = [UserRepository, OrderRepository]
+
+
+class CollectionIndexReport(BaseModel):
+    existing: List[str] = Field(default_factory=list)
+    created: List[str] = Field(default_factory=list)
+    # Indexes present in the database but not declared by any repository
+    undeclared: List[str] = Field(default_factory=list)
+    # Indexes that have not served a single operation since the server started
+    unused: List[str] = Field(default_factory=list)
+
+
+def declared_indexes() -> Dict[str, List[IndexModel]]:
+    indexes: Dict[str, List[IndexModel]] = {}
+    for repository in REPOSITORIES:
+        for collection_name, models in repository.INDEXES.items():
+            indexes.setdefault(collection_name, []).extend(models)
+    return indexes
+
+
+async def ensure_indexes(db_service: AsyncMongoDBService) -> Dict[str, CollectionIndexReport]:
+    """Create the declared indexes that are missing and report on the ones that look unnecessary."""
+    logger = AsyncLogger().get_logger()
+    report: Dict[str, CollectionIndexReport] = {}
+    for collection_name, models in declared_indexes().items():
+        collection_report = CollectionIndexReport()
+        existing = await db_service.index_information(collection_name)
+        collection_report.existing = list(existing)
+
+        missing = [model for model in models if model.document["name"] not in existing]
+        if missing:
+            collection_report.created = await db_service.create_indexes(collection_name, missing)
+
+        declared = {model.document["name"] for model in models} | {"_id_"}
+        collection_report.undeclared = [name for name in existing if name not in declared]
+
+        stats = await db_service.aggregate(collection_name, [{"$indexStats": {}}])
+        collection_report.unused = [index["name"] for index in stats
+                                    if index["name"] != "_id_" and index["name"] not in collection_report.created
+                                    and not index.get("accesses", {}).get("ops")]
+
+        if collection_report.created:
+            logger.info(f"Created indexes on {collection_name}: {collection_report.created}")
+        if collection_report.undeclared or collection_report.unused:
+            logger.warning(f"Index report for {collection_name}: undeclared={collection_report.undeclared} "
+                           f"unused={collection_report.unused}")
+        report[collection_name] = collection_report
+    return report
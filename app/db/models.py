@@ -1,7 +1,8 @@
+from datetime import datetime
 from enum import Enum
-from typing import Optional, List
+from typing import Dict, List, NamedTuple, Optional
 from uuid import uuid4
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
 
 
 class Exchange(str, Enum):
@@ -66,36 +67,56 @@ class PlaceOrderBase(BaseModel):
     takeProfit: Optional[float] = Field(default=None)
     stopLoss: Optional[float] = Field(default=None)
 
-    @model_validator(mode='before')
-    def check_order_validations(cls, values):
-        order_type = values.get("type")
-        amount = values.get("amount")
-        price = values.get("price")
-        trigger_price = values.get("triggerPrice")
-        takeProfit = values.get("takeProfit")
-        stopLoss = values.get("stopLoss")
-        
-        # If the order_type == limit and 'amount' is None or 'price' is None
-        if order_type == OrderType.LIMIT and (amount is None or price is None):
+    @model_validator(mode='after')
+    def check_order_validations(self) -> "PlaceOrderBase":
+        # Runs on the validated model: plain attribute reads and enum identity checks instead of dict lookups on raw input
+        order_type = self.type
+
+        # If the order_type == limit and 'price' is None (amount is always required)
+        if order_type is OrderType.LIMIT and self.price is None:
             raise ValueError("For LIMIT order type, both amount and price must be provided.")
-        
+
         # If order_type is 'market' and 'price' is not None
-        if order_type == OrderType.MARKET and price is not None:
+        if order_type is OrderType.MARKET and self.price is not None:
             raise ValueError("For MARKET order type, price should not be provided.")
-        
-        # If order_type is stop_limit or stop_market and amount is None or price is None or trigger_price is None
-        if order_type == OrderType.STOP_LIMIT and (amount is None or price is None or trigger_price is None):
+
+        # If order_type is stop_limit and price is None or trigger_price is None
+        if order_type is OrderType.STOP_LIMIT and (self.price is None or self.triggerPrice is None):
             raise ValueError("For STOP_LIMIT or STOP_MARKET order types, amount, price, and trigger price must all be provided.")
-        
-        if order_type == OrderType.STOP_MARKET and (amount is None or trigger_price is None):
+
+        if order_type is OrderType.STOP_MARKET and self.triggerPrice is None:
             raise ValueError("For STOP_MARKET order type, amount and trigger price must be provided.")
-        
-        # If order_type is take_profit_stop_loss and trigger_price is None
-        if order_type == OrderType.TAKE_PROFIT_STOP_LOSS and (takeProfit is None and stopLoss is None):
+
+        # If order_type is take_profit_stop_loss and neither takeProfit nor stopLoss is given
+        if order_type is OrderType.TAKE_PROFIT_STOP_LOSS and (self.takeProfit is None and self.stopLoss is None):
             raise ValueError("For TAKE_PROFIT_STOP_LOSS order type, takeProfit or stopLoss must be provided.")
-        
-        return values
-    
+
+        return self
+
+
+class OrderTicket(NamedTuple):
+    """
+    Internal, immutable form of a validated PlaceOrderBase, built once per order and passed through the
+    market rules, the exchange clients, the repository and the outbox. It has the same field names as the
+    model; changes are made with _replace() instead of model_copy().
+    """
+    symbol: str
+    type: OrderType
+    side: OrderSide
+    amount: float
+    positionAction: PositionAction
+    exchange: Exchange
+    price: Optional[float] = None
+    triggerPrice: Optional[float] = None
+    clientOrderId: Optional[str] = None
+    timeInForce: Optional[TimeInForce] = TimeInForce.GoodTillCancel
+    takeProfit: Optional[float] = None
+    stopLoss: Optional[float] = None
+
+    @classmethod
+    def from_order(cls, order: PlaceOrderBase) -> "OrderTicket":
+        return cls(**order.__dict__)
+
 class OrderStructure(BaseModel):
     id: str
     clientOrderId: str
@@ -117,6 +138,35 @@ class OrderStructure(BaseModel):
     fee: Optional[dict] = Field(None)
     info: Optional[dict] = Field(None)
 
+class OrderAcknowledgement(BaseModel):
+    """Body returned once an order was accepted by the exchange."""
+    status: OrderStatus
+
+class OutboxEvent(BaseModel):
+    """Event stored alongside the document it describes and relayed to Kafka once the write is durable."""
+    topic: str
+    key: Optional[str] = Field(default=None)
+    payload: dict
+    published: bool = Field(default=False)
+    createdAt: datetime = Field(default_factory=datetime.utcnow)
+
+class OrderResultStatus(str, Enum):
+    PLACED = "placed"
+    REJECTED = "rejected"
+    FAILED = "failed"
+
+class OrderResult(BaseModel):
+    """Outcome of one order of a batch placement."""
+    clientOrderId: str
+    status: OrderResultStatus
+    id: Optional[str] = Field(default=None)
+    error: Optional[str] = Field(default=None)
+
+class OrderHistoryPage(BaseModel):
+    """A page of the order history, newest first; `next_cursor` is None on the last page."""
+    orders: List[dict]
+    next_cursor: Optional[str] = Field(default=None)
+
 class PositionStructure(BaseModel):
     exchange: Exchange
     info: object
@@ -141,4 +191,12 @@ class PositionStructure(BaseModel):
     unrealizedPnl: float # differncebetween the market price and entry price * qty
     liquidationPrice: float # price at which collateral < maintenanceMargin (NUKED)
     marginMode: str # crossed or isolated
-    percentage: float # represents unrealizedPnl / initialMargin
\ No newline at end of file
+    percentage: float # represents unrealizedPnl / initialMargin
+
+
+# Serializers writing JSON bytes straight from the models (pydantic-core), without building a dict first
+ORDER_JSON = TypeAdapter(OrderStructure)
+POSITION_JSON = TypeAdapter(PositionStructure)
+ORDER_RESULTS_JSON = TypeAdapter(List[OrderResult])
+# Stored idempotency outcome, {"order": <OrderStructure or null>}, validated straight from the JSON bytes
+ORDER_OUTCOME_JSON = TypeAdapter(Dict[str, Optional[OrderStructure]])
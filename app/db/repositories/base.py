@@ -1,10 +1,14 @@
 from abc import ABC, abstractmethod
-from typing import Optional, TypeVar
+from typing import Dict, List, Optional, TypeVar
+from pymongo import IndexModel
 
 T = TypeVar("T")
 
 class BaseRepository(ABC):
 
+    # Collection name -> indexes the repository's queries rely on
+    INDEXES: Dict[str, List[IndexModel]] = {}
+
     @abstractmethod
     async def get(self, id: str) -> Optional[T]:
         pass
@@ -1,14 +1,58 @@
-from app.db.models import OrderStructure
+import base64
+from datetime import datetime, timedelta
+from app.db.models import ORDER_JSON, OrderStatus, OrderStructure, ExchangeCredentials, OutboxEvent
 from app.db.repositories.base import BaseRepository
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+import orjson
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.write_concern import WriteConcern
 from app.db.services.mongodbservice import AsyncMongoDBService
 
+# Position in the order history, (createdAt, _id) of the last order returned
+HistoryPosition = Tuple[datetime, ObjectId]
+
+
+def encode_cursor(document: Dict[str, Any]) -> str:
+    """Opaque token for the history position right after `document`."""
+    return base64.urlsafe_b64encode(orjson.dumps([document["createdAt"].isoformat(), str(document["_id"])])).decode()
+
+
+def decode_cursor(cursor: str) -> HistoryPosition:
+    try:
+        created_at, last_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), ObjectId(last_id)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
 class OrderRepository(BaseRepository):
 
     # Collection name to be used for users in MongoDB
     ORDER_COLLECTION_NAME = "orders"
     EXCHANGE_COLLECTION_NAME = "exchange_credentials"
 
+    # Indexes ensured at startup, see app.db.indexes
+    INDEXES = {
+        ORDER_COLLECTION_NAME: [
+            IndexModel([("clientOrderId", ASCENDING)], unique=True, name="clientOrderId_unique"),
+            # Only orders whose event has not been relayed yet are indexed
+            IndexModel([("outbox.createdAt", ASCENDING)], partialFilterExpression={"outbox.published": False}, name="outbox_pending"),
+            # Orders the reconciler still follows, see app.exchanges.reconciler
+            IndexModel([("createdAt", ASCENDING)], partialFilterExpression={"status": OrderStatus.OPEN.value}, name="status_open"),
+            # Order history of an account, newest first, paged by (createdAt, _id)
+            IndexModel([("userId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)], name="user_history"),
+        ],
+    }
+
+    # Newest first; _id breaks ties between orders created in the same millisecond, so that a position is unique
+    HISTORY_SORT = [("createdAt", DESCENDING), ("_id", DESCENDING)]
+    # Fields the history can be projected on
+    HISTORY_FIELDS = frozenset(OrderStructure.model_fields) | {"exchange", "createdAt", "updatedAt"}
+
+    # An order is only acknowledged once it (and its outbox event) survives a primary failover
+    WRITE_CONCERN = WriteConcern(w="majority", j=True)
+
     def __init__(self, db_service: AsyncMongoDBService):
         self._db_service = db_service
 
@@ -20,9 +64,25 @@ class OrderRepository(BaseRepository):
         
         return OrderStructure(**order_data)
 
-    async def create(self, order: OrderStructure) -> OrderStructure:
-        """Create a new order."""
-        order_id = await self._db_service.insert_one(self.COLLECTION_NAME, order.model_dump())
+    async def create(self, order: OrderStructure, account: ExchangeCredentials = None, event: OutboxEvent = None,
+                     defaults: Dict[str, Any] = None) -> OrderStructure:
+        """
+        Create a new order. When an event is given it is stored in the same document, so the order and the
+        event to publish about it are written atomically; the OutboxRelay delivers it afterwards.
+        `defaults` fill in fields the order does not have, e.g. those missing from an exchange response.
+        """
+        # Same serializer as the API and the idempotency store, in python mode since the driver encodes the BSON
+        document = ORDER_JSON.dump_python(order, exclude_none=True)
+        if defaults:
+            for field, value in defaults.items():
+                document.setdefault(field, value)
+        document["createdAt"] = datetime.utcnow()
+        if account is not None:
+            document["userId"] = account.user_id
+            document["exchange"] = account.name.value
+        if event is not None:
+            document["outbox"] = event.model_dump()
+        await self._db_service.insert_one(self.ORDER_COLLECTION_NAME, document, write_concern=self.WRITE_CONCERN)
         
         return order
     
@@ -30,4 +90,102 @@ class OrderRepository(BaseRepository):
         pass
 
     async def delete(self, order_id: str) -> None:
-        pass
\ No newline at end of file
+        pass
+
+    @staticmethod
+    def history_filter(user_id: str, exchange: Optional[str] = None, symbol: Optional[str] = None, status: Optional[str] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None, after: Optional[HistoryPosition] = None) -> dict:
+        query: Dict[str, Any] = {"userId": user_id}
+        if exchange is not None:
+            query["exchange"] = exchange
+        if symbol is not None:
+            query["symbol"] = symbol
+        if status is not None:
+            query["status"] = status
+        created = {}
+        if start is not None:
+            created["$gte"] = start
+        if end is not None:
+            created["$lt"] = end
+        if created:
+            query["createdAt"] = created
+        if after is not None:
+            # Keyset pagination: strictly after the last order returned, in HISTORY_SORT order
+            created_at, last_id = after
+            query["$or"] = [{"createdAt": {"$lt": created_at}}, {"createdAt": created_at, "_id": {"$lt": last_id}}]
+        return query
+
+    @classmethod
+    def history_projection(cls, fields: Optional[Sequence[str]] = None) -> dict:
+        """Only `fields` (plus what paging needs) if given, otherwise everything but the internal fields."""
+        if not fields:
+            return {"outbox": 0, "userId": 0}
+        unknown = set(fields) - cls.HISTORY_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+        return dict.fromkeys(fields, 1) | {"createdAt": 1}
+
+    @staticmethod
+    def _history_document(document: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+        document.pop("_id", None)
+        if fields and "createdAt" not in fields:
+            document.pop("createdAt", None)
+        return document
+
+    async def history(self, user_id: str, limit: int, after: Optional[HistoryPosition] = None, fields: Optional[Sequence[str]] = None,
+                      **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """A page of the account's orders, newest first, and the cursor of the next page (None on the last one)."""
+        # One order more than asked tells whether there is a next page
+        documents = await self._db_service.find(self.ORDER_COLLECTION_NAME, self.history_filter(user_id, after=after, **filters),
+                                                self.history_projection(fields), length=limit + 1, sort=self.HISTORY_SORT)
+        next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+        return [self._history_document(document, fields) for document in documents[:limit]], next_cursor
+
+    async def stream_history(self, user_id: str, batch_size: int, after: Optional[HistoryPosition] = None,
+                             fields: Optional[Sequence[str]] = None, **filters) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Every matching order of the account, newest first, in lists of up to `batch_size` read off the cursor."""
+        async for batch in self._db_service.iterate(self.ORDER_COLLECTION_NAME, self.history_filter(user_id, after=after, **filters),
+                                                    self.history_projection(fields), sort=self.HISTORY_SORT, batch_size=batch_size):
+            yield [self._history_document(document, fields) for document in batch]
+
+    async def stream_open(self, batch_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Orders still open on the exchange as far as the database knows, oldest first, in lists of up to `batch_size`."""
+        async for batch in self._db_service.iterate(self.ORDER_COLLECTION_NAME, {"status": OrderStatus.OPEN.value},
+                                                    {"_id": 0, "id": 1, "clientOrderId": 1, "userId": 1, "exchange": 1, "symbol": 1,
+                                                     "filled": 1, "createdAt": 1},
+                                                    sort=[("createdAt", ASCENDING)], batch_size=batch_size):
+            yield batch
+
+    async def update_statuses(self, updates: Dict[str, Dict[str, Any]]) -> int:
+        """Apply status changes keyed by clientOrderId in one bulk write, returns the number of orders modified."""
+        if not updates:
+            return 0
+        now = datetime.utcnow()
+        operations = [UpdateOne({"clientOrderId": client_oid}, {"$set": dict(fields, updatedAt=now)})
+                      for client_oid, fields in updates.items()]
+        return await self._db_service.bulk_write(self.ORDER_COLLECTION_NAME, operations)
+
+    async def claim_outbox(self, worker_id: str, limit: int, claim_ttl: float) -> List[Dict[str, Any]]:
+        """
+        Claim up to `limit` unpublished events, oldest first, for `claim_ttl` seconds so that relays running in
+        other workers skip them. Claims of a relay that died expire and are picked up again.
+        """
+        now = datetime.utcnow()
+        claimable = {"outbox.published": False,
+                     "$or": [{"outbox.claimedUntil": None}, {"outbox.claimedUntil": {"$lt": now}}]}
+        candidates = await self._db_service.find(self.ORDER_COLLECTION_NAME, claimable, {"_id": 1}, length=limit,
+                                                 sort=[("outbox.createdAt", ASCENDING)])
+        if not candidates:
+            return []
+        ids = [candidate["_id"] for candidate in candidates]
+        await self._db_service.update_many(self.ORDER_COLLECTION_NAME, {"_id": {"$in": ids}, **claimable},
+                                           {"$set": {"outbox.claimedBy": worker_id,
+                                                     "outbox.claimedUntil": now + timedelta(seconds=claim_ttl)}})
+        return await self._db_service.find(self.ORDER_COLLECTION_NAME,
+                                           {"_id": {"$in": ids}, "outbox.claimedBy": worker_id, "outbox.published": False},
+                                           {"outbox": 1}, sort=[("outbox.createdAt", ASCENDING)])
+
+    async def mark_published(self, ids: List[Any]) -> int:
+        return await self._db_service.update_many(self.ORDER_COLLECTION_NAME, {"_id": {"$in": ids}},
+                                                  {"$set": {"outbox.published": True, "outbox.publishedAt": datetime.utcnow()},
+                                                   "$unset": {"outbox.claimedBy": "", "outbox.claimedUntil": ""}})
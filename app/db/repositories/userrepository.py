@@ -1,7 +1,10 @@
-from app.db.models import UserInDB
+from app.db.models import UserInDB, ExchangeCredentials
 from app.db.repositories.base import BaseRepository
-from typing import Optional
+from typing import Iterable, List, Optional
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
 from app.db.services.mongodbservice import AsyncMongoDBService
+from app.db.services.usercache import user_cache
 
 class UserRepository(BaseRepository):
 
@@ -9,24 +12,38 @@ class UserRepository(BaseRepository):
     USER_COLLECTION_NAME = "users"
     EXCHANGE_COLLECTION_NAME = "exchange_credentials"
 
+    # Indexes ensured at startup, see app.db.indexes
+    INDEXES = {
+        USER_COLLECTION_NAME: [IndexModel([("username", ASCENDING)], unique=True, name="username_unique")],
+        EXCHANGE_COLLECTION_NAME: [IndexModel([("user_id", ASCENDING), ("name", ASCENDING)], name="user_id_name")],
+    }
+
     def __init__(self, db_service: AsyncMongoDBService):
         self._db_service = db_service
 
     async def get(self, username: str) -> Optional[UserInDB]:
-        """Retrieve a user by username along with their exchange credentials."""
-        user_data = await self._db_service.find_one(self.USER_COLLECTION_NAME, {"username": username})
-        if not user_data:
+        """Retrieve a user by username along with their exchange credentials in a single round trip."""
+        pipeline = [
+            {"$match": {"username": username}},
+            {"$limit": 1},
+            {"$lookup": {
+                "from": self.EXCHANGE_COLLECTION_NAME,
+                "localField": "_id",
+                "foreignField": "user_id",
+                "pipeline": [{"$project": {"_id": 0, "name": 1, "api_key": 1, "api_secret": 1}}],
+                "as": "exchanges",
+            }},
+            {"$project": {"username": 1, "hashed_password": 1, "api_key": 1, "api_secret": 1, "exchanges": 1}},
+        ]
+        result = await self._db_service.aggregate(self.USER_COLLECTION_NAME, pipeline, length=1)
+        if not result:
             return None
-
-        # Extract user_id from the retrieved user data
-        user_id = user_data["_id"]
-        exchange_credentials = await self._db_service.find(self.EXCHANGE_COLLECTION_NAME, {"user_id": user_id}).to_list()
+        user_data = result[0]
 
         # Convert ObjectId to string for serialization
-        user_data["id"] = str(user_data["_id"])
-        
-        # Attach the exchange credentials to the user data
-        user_data["exchanges"] = exchange_credentials
+        user_data["id"] = str(user_data.pop("_id"))
+        for exchange in user_data["exchanges"]:
+            exchange["user_id"] = user_data["id"]
         return UserInDB(**user_data)
 
     async def create(self, user: UserInDB) -> UserInDB:
@@ -36,10 +53,47 @@ class UserRepository(BaseRepository):
         return user
     
     async def update(self, username: str, user: UserInDB) -> UserInDB:
-        pass
+        """Update a user's login and API credentials."""
+        await self._db_service.update_one(self.USER_COLLECTION_NAME, {"username": username},
+                                          {"$set": user.model_dump(include={"username", "hashed_password", "api_key", "api_secret"})})
+        # Cached copies on every worker are now stale
+        await user_cache.invalidate(username)
+        return user
 
     async def delete(self, username: str) -> None:
-        pass
+        """Delete a user."""
+        await self._db_service.delete_one(self.USER_COLLECTION_NAME, {"username": username})
+        await user_cache.invalidate(username)
+
+    # Cached users embed their exchange credentials (see get()): every write to them evicts the user on every
+    # worker, as update() does, so that rotated or removed keys are not used until the cache entry expires
+
+    async def add_exchange_credentials(self, username: str, credentials: ExchangeCredentials) -> None:
+        """Store a user's API keys for an exchange."""
+        await self._db_service.insert_one(self.EXCHANGE_COLLECTION_NAME,
+                                          {"user_id": ObjectId(credentials.user_id), "name": credentials.name.value,
+                                           "api_key": credentials.api_key, "api_secret": credentials.api_secret})
+        await user_cache.invalidate(username)
+
+    async def update_exchange_credentials(self, username: str, credentials: ExchangeCredentials) -> None:
+        """Rotate a user's API keys for an exchange."""
+        await self._db_service.update_one(self.EXCHANGE_COLLECTION_NAME,
+                                          {"user_id": ObjectId(credentials.user_id), "name": credentials.name.value},
+                                          {"$set": {"api_key": credentials.api_key, "api_secret": credentials.api_secret}})
+        await user_cache.invalidate(username)
+
+    async def delete_exchange_credentials(self, username: str, user_id: str, exchange_name: str) -> None:
+        """Remove a user's API keys for an exchange."""
+        await self._db_service.delete_one(self.EXCHANGE_COLLECTION_NAME, {"user_id": ObjectId(user_id), "name": exchange_name})
+        await user_cache.invalidate(username)
+
+    async def list_exchange_credentials(self, user_ids: Optional[Iterable[str]] = None) -> List[ExchangeCredentials]:
+        """Retrieve the exchange credentials of every account, or only of the users in `user_ids`."""
+        filter = {}
+        if user_ids is not None:
+            filter = {"user_id": {"$in": [ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id for user_id in user_ids]}}
+        credentials = await self._db_service.find(self.EXCHANGE_COLLECTION_NAME, filter, {"_id": 0, "user_id": 1, "name": 1, "api_key": 1, "api_secret": 1})
+        return [ExchangeCredentials(**dict(document, user_id=str(document["user_id"]))) for document in credentials]
 
     async def get_exchange_credentials(self, user_id: str, exchange_name: str) -> Optional[dict]:
         """Retrieve a user's api_key and secret for a given exchange."""
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Dict, Optional
+from uuid import uuid4
+from app.core import config
+from app.core.logging import AsyncLogger
+from app.db.models import ORDER_JSON, ORDER_OUTCOME_JSON, ExchangeCredentials, OrderStructure
+from app.db.services.redisservice import AsyncRedisService
+
+
+class DuplicateRequestInProgress(Exception):
+    """Raised when a duplicate submission gave up waiting for the first one to finish."""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"A submission for {key} is still in progress")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class Claim:
+    """Outcome of IdempotencyStore.claim(): either the right to submit (`owned`) or the result of an earlier submission."""
+    __slots__ = ("key", "token", "replayed", "result")
+
+    def __init__(self, key: str, token: Optional[str] = None, replayed: bool = False, result: Optional[OrderStructure] = None):
+        self.key = key
+        self.token = token
+        self.replayed = replayed
+        self.result = result
+
+    @property
+    def owned(self) -> bool:
+        return self.token is not None
+
+
+class IdempotencyStore:
+    """
+    Makes order submission idempotent per account and clientOrderId. The first request takes the key
+    with SET NX (expiring after `lock_ttl` in case the worker dies) and stores the outcome under it for
+    `result_ttl`; duplicates get that outcome without touching the exchange. A duplicate arriving while
+    the first is in flight waits for it: on the future of the first request when it is served by the
+    same worker, by polling Redis otherwise.
+
+    If Redis is unavailable submissions go through unguarded; the exchange still rejects a reused clientOrderId.
+    """
+    PENDING = b"pending:"
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, prefix: str = config.IDEMPOTENCY_PREFIX, lock_ttl: int = config.IDEMPOTENCY_LOCK_TTL,
+                 result_ttl: int = config.IDEMPOTENCY_RESULT_TTL, wait_timeout: float = config.IDEMPOTENCY_WAIT_TIMEOUT):
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        self.claimed = 0
+        self.replayed = 0
+        self.errors = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._logger = AsyncLogger().get_logger()
+
+    def stats(self) -> dict:
+        return {"claimed": self.claimed, "replayed": self.replayed, "in_flight": len(self._inflight), "errors": self.errors}
+
+    def key(self, account: ExchangeCredentials, client_order_id: str) -> str:
+        return f"{self.prefix}:{account.user_id}:{account.name.value}:{client_order_id}"
+
+    async def claim(self, key: str) -> Claim:
+        redis_service = AsyncRedisService()
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                try:
+                    stored = await asyncio.wait_for(asyncio.shield(inflight), timeout=max(0.0, remaining))
+                except asyncio.TimeoutError:
+                    raise DuplicateRequestInProgress(key, self.lock_ttl)
+                if stored is not None:
+                    return self._replay(key, stored)
+                # The first request failed, this one may submit
+                continue
+
+            token = uuid4().hex
+            try:
+                if await redis_service.set(key, self.PENDING + token.encode(), ttl=self.lock_ttl, only_if_absent=True):
+                    self._inflight[key] = asyncio.get_running_loop().create_future()
+                    self.claimed += 1
+                    return Claim(key, token)
+                stored = await redis_service.get(key)
+            except Exception as e:
+                self.errors += 1
+                self._logger.error("Idempotency store unavailable, submitting {} unguarded: {}".format(key, e))
+                return Claim(key)
+            if stored is not None and not stored.startswith(self.PENDING):
+                return self._replay(key, stored)
+            if remaining <= 0:
+                raise DuplicateRequestInProgress(key, self.lock_ttl)
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    async def complete(self, claim: Claim, result: Optional[OrderStructure]) -> None:
+        """Store the outcome of an owned claim; `result` None records that the exchange did not accept the order."""
+        if not claim.owned:
+            return
+        stored = b'{"order":' + (ORDER_JSON.dump_json(result, exclude_none=True) if result is not None else b"null") + b"}"
+        try:
+            await AsyncRedisService().set(claim.key, stored, ttl=self.result_ttl)
+        except Exception as e:
+            self.errors += 1
+            self._logger.error("Error storing the result of {}: {}".format(claim.key, e))
+        self._resolve(claim.key, stored)
+
+    async def release(self, claim: Claim) -> None:
+        """Give an owned claim up without a result (the submission failed) so that a retry can go through."""
+        if not claim.owned:
+            return
+        try:
+            await AsyncRedisService().delete_if_equals(claim.key, self.PENDING + claim.token.encode())
+        except Exception as e:
+            self.errors += 1
+            self._logger.error("Error releasing {}: {}".format(claim.key, e))
+        self._resolve(claim.key, None)
+
+    def _resolve(self, key: str, stored: Optional[bytes]) -> None:
+        inflight = self._inflight.pop(key, None)
+        if inflight is not None and not inflight.done():
+            inflight.set_result(stored)
+
+    def _replay(self, key: str, stored: bytes) -> Claim:
+        self.replayed += 1
+        return Claim(key, replayed=True, result=ORDER_OUTCOME_JSON.validate_json(stored)["order"])
+
+
+idempotency_store = IdempotencyStore()
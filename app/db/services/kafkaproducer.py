@@ -1,6 +1,12 @@
+import asyncio
+import time
+from typing import Any, Optional
 from aiokafka import AIOKafkaProducer
-import json
+import orjson
 import app.core.config as config
+from app.core.lifecycle import after_fork
+from app.core.logging import AsyncLogger
+from app.core.metrics import observe_stage
 
 class KafkaProducer:
     _instance = None
@@ -12,16 +18,91 @@ class KafkaProducer:
         return cls._instance
 
     def init_producer(self, *args, **kwargs):
-        self.producer = AIOKafkaProducer(
-            bootstrap_servers=config.KAFKA_URI
+        # Created by start(): AIOKafkaProducer belongs to the event loop it is created in, i.e. the worker's
+        self.producer: Optional[AIOKafkaProducer] = None
+        self._logger = AsyncLogger().get_logger()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        # Delivery counters, updated from the delivery callbacks
+        self.pending = 0
+        self.delivered = 0
+        self.failed = 0
+        self.total_delivery_seconds = 0.0
+
+    def create_producer(self) -> AIOKafkaProducer:
+        compression_type = config.KAFKA_COMPRESSION_TYPE.lower()
+        return AIOKafkaProducer(
+            bootstrap_servers=config.KAFKA_URI,
+            acks=int(config.KAFKA_ACKS) if config.KAFKA_ACKS.lstrip("-").isdigit() else config.KAFKA_ACKS,
+            linger_ms=config.KAFKA_LINGER_MS,
+            max_batch_size=config.KAFKA_MAX_BATCH_SIZE,
+            compression_type=None if compression_type in ("", "none") else compression_type,
+            key_serializer=lambda key: key.encode() if isinstance(key, str) else key,
+            value_serializer=orjson.dumps,
         )
 
     async def start(self):
+        if self.producer is None:
+            self.producer = self.create_producer()
         await self.producer.start()
 
+    async def flush(self):
+        """Wait until every enqueued message has been acknowledged (or failed)."""
+        if self.producer is not None:
+            await self.producer.flush()
+
     async def stop(self):
-        await self.producer.stop()
+        if self.producer is not None:
+            producer, self.producer = self.producer, None
+            await producer.stop()
+
+    @classmethod
+    def _after_fork(cls):
+        # A producer started in the parent runs on the parent's loop and sockets
+        if cls._instance is not None:
+            cls._instance.producer = None
+            cls._instance._reset_counters()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "avg_delivery_seconds": self.total_delivery_seconds / self.delivered if self.delivered else 0.0,
+        }
+
+    async def send(self, topic: str, value: Any, key: Optional[str] = None, wait: bool = config.KAFKA_SEND_WAIT) -> "asyncio.Future":
+        """
+        Enqueue a message into the producer's batch for `topic`. Messages with the same key land on the same
+        partition. Unless `wait` is set this returns as soon as the message is buffered; the returned future
+        resolves with the record metadata once the broker acknowledged it.
+        """
+        started = time.perf_counter()
+        delivery = await self.producer.send(topic, value=value, key=key)
+        observe_stage("kafka_enqueue", time.perf_counter() - started)
+        self.pending += 1
+        delivery.add_done_callback(lambda future: self._on_delivery(topic, future, started))
+        if wait:
+            await delivery
+        return delivery
+
+    async def send_order(self, topic:str, order_id:str, client_oid:str, key: Optional[str] = None, wait: bool = config.KAFKA_SEND_WAIT):
+        value = {"orderId": order_id, "clientOid": client_oid}
+        return await self.send(topic, value, key=key, wait=wait)
+
+    def _on_delivery(self, topic: str, future: "asyncio.Future", started: float) -> None:
+        self.pending -= 1
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+            self._logger.error("Error delivering message to Kafka topic {}: {}".format(
+                topic, "cancelled" if future.cancelled() else future.exception()))
+        else:
+            elapsed = time.perf_counter() - started
+            self.delivered += 1
+            self.total_delivery_seconds += elapsed
+            # The callback runs in a copy of the sender's context, so the request's labels still apply
+            observe_stage("kafka_delivery", elapsed)
+
 
-    async def send_order(self, topic:str, order_id:str, client_oid:str):
-        value = json.dumps({"orderId": order_id, "clientOid": client_oid})
-        await self.producer.send_and_wait(topic, value=value)
+after_fork(KafkaProducer._after_fork)
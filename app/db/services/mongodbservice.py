@@ -1,28 +1,253 @@
 from app.core.logging import AsyncLogger
+from app.core.lifecycle import after_fork
 from app.core import config
+from app.core.metrics import REGISTRY, Histogram, timed
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
-from typing import Dict, Any
+from pymongo import monitoring
+from pymongo import IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError, WriteError
+from pymongo.write_concern import WriteConcern
+from typing import AsyncIterator, Callable, Dict, Any, List, Optional, Set, Tuple
+import asyncio
 import traceback
 
+WRITE_BATCH_SIZE = REGISTRY.register(Histogram(
+    "mongo_write_batch_size", "Operations per coalesced MongoDB write.", ("collection", "kind"),
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)))
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Keeps running counters of connection pool usage across every server the client talks to."""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.check_out_failed = 0
+        self.pools_cleared = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "open": self.created - self.closed,
+            "in_use": self.checked_out,
+            "created": self.created,
+            "closed": self.closed,
+            "check_out_failed": self.check_out_failed,
+            "pools_cleared": self.pools_cleared,
+        }
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        self.check_out_failed += 1
+
+    def pool_cleared(self, event):
+        self.pools_cleared += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+def parse_write_concerns(values: Dict[str, str]) -> Dict[str, WriteConcern]:
+    """{"orders": "majority", "events": "1"} -> a WriteConcern per collection."""
+    return {collection: WriteConcern(w=int(w) if w.isdigit() else w) for collection, w in values.items()}
+
+
+class _Batch:
+    __slots__ = ("write_concern", "operations", "futures", "timer")
+
+    def __init__(self, write_concern: Optional[WriteConcern]):
+        self.write_concern = write_concern
+        self.operations: List[Any] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class WriteCoalescer:
+    """
+    Collects the inserts and updates of a collection for up to `max_delay` seconds, or until `max_batch` of
+    them are waiting, and sends them as one unordered insert_many / bulk_write. Every caller awaits its own
+    operation and gets its own outcome: the inserted _id, or the error of its document (e.g. a duplicate key)
+    while the rest of the batch is written. Operations with different write concerns go in different batches.
+    """
+
+    def __init__(self, get_collection: Callable[[str, Optional[WriteConcern]], AsyncIOMotorCollection],
+                 max_batch: int = config.MONGODB_WRITE_BATCH_SIZE, max_delay: float = config.MONGODB_WRITE_BATCH_DELAY,
+                 write_concerns: Dict[str, WriteConcern] = None):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.write_concerns = write_concerns or {}
+        self.batches = 0
+        self.operations = 0
+        self.errors = 0
+        self._get_collection = get_collection
+        self._pending: Dict[Tuple, _Batch] = {}
+        self._writes: Set[asyncio.Task] = set()
+        self._logger = AsyncLogger().get_logger()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"batches": self.batches, "operations": self.operations, "errors": self.errors,
+                "avg_batch_size": self.operations / self.batches if self.batches else 0.0,
+                "pending": sum(len(batch.operations) for batch in self._pending.values())}
+
+    def insert(self, collection_name: str, document: Dict[str, Any], write_concern: Optional[WriteConcern] = None) -> asyncio.Future:
+        """Queue an insert, the returned future resolves with the document's _id."""
+        return self._submit(collection_name, "insert", document, write_concern)
+
+    def update(self, collection_name: str, filter: Dict[str, Any], update: Dict[str, Any],
+               write_concern: Optional[WriteConcern] = None) -> asyncio.Future:
+        return self._submit(collection_name, "update", UpdateOne(filter, update), write_concern)
+
+    async def flush(self) -> None:
+        """Send every queued operation now and wait until all batches are written."""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def _submit(self, collection_name: str, kind: str, operation: Any, write_concern: Optional[WriteConcern]) -> asyncio.Future:
+        write_concern = write_concern or self.write_concerns.get(collection_name)
+        # WriteConcern is not hashable, its document is
+        key = (collection_name, kind, tuple(sorted(write_concern.document.items())) if write_concern is not None else None)
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(write_concern)
+            batch.timer = loop.call_later(self.max_delay, self._flush, key)
+        future = loop.create_future()
+        batch.operations.append(operation)
+        batch.futures.append(future)
+        if len(batch.operations) >= self.max_batch:
+            self._flush(key)
+        return future
+
+    def _flush(self, key: Tuple) -> None:
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.create_task(self._write(key[0], key[1], batch))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, collection_name: str, kind: str, batch: _Batch) -> None:
+        self.batches += 1
+        self.operations += len(batch.operations)
+        WRITE_BATCH_SIZE.observe(len(batch.operations), collection_name, kind)
+        errors: Dict[int, Exception] = {}
+        try:
+            collection = self._get_collection(collection_name, batch.write_concern)
+            if kind == "insert":
+                await collection.insert_many(batch.operations, ordered=False)
+            else:
+                await collection.bulk_write(batch.operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                error_type = DuplicateKeyError if error.get("code") == 11000 else WriteError
+                errors[error["index"]] = error_type(error.get("errmsg"), error.get("code"), error)
+            if e.details.get("writeConcernErrors"):
+                # The writes were applied but not acknowledged as requested: no caller of the batch can count on its write
+                concern_error = WriteConcernError(str(e.details["writeConcernErrors"]), e.code, e.details)
+                errors.update((index, concern_error) for index in range(len(batch.futures)) if index not in errors)
+        except Exception as e:
+            self._logger.error(f"Error writing a batch of {len(batch.operations)} to {collection_name}: {traceback.format_exc()}")
+            errors = {index: e for index in range(len(batch.futures))}
+        self.errors += len(errors)
+        for index, future in enumerate(batch.futures):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                # insert_many sets the _id of every document it did not come with
+                future.set_result(batch.operations[index]["_id"] if kind == "insert" else None)
+
+
 class AsyncMongoDBService:
-    
+    # Process-wide instance shared by every request, see get_instance()
+    _shared: Optional["AsyncMongoDBService"] = None
+
     def __init__(self, uri=config.MONGODB_URI, database_name=config.MONGODB_DB):
-        self._client = AsyncIOMotorClient(uri)
+        self._pool_listener = PoolStatsListener()
+        self._client = AsyncIOMotorClient(uri,
+                                          minPoolSize=config.MONGODB_MIN_POOL_SIZE,
+                                          maxPoolSize=config.MONGODB_MAX_POOL_SIZE,
+                                          maxIdleTimeMS=config.MONGODB_MAX_IDLE_TIME_MS,
+                                          serverSelectionTimeoutMS=config.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                                          event_listeners=[self._pool_listener])
         self._db: AsyncIOMotorDatabase = self._client[database_name]
+        # Inserts and updates of these collections go through the coalescer instead of one round trip each
+        self._coalesced = set(config.MONGODB_COALESCE_COLLECTIONS)
+        self._writes = WriteCoalescer(self.get_collection, write_concerns=parse_write_concerns(config.MONGODB_WRITE_CONCERNS))
         self._logger = AsyncLogger().get_logger()
 
-    def get_collection(self, collection_name: str) -> AsyncIOMotorCollection:
+    @classmethod
+    def get_instance(cls) -> "AsyncMongoDBService":
+        """Return the shared service, creating its client (and connection pool) on first use."""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        # pymongo clients are not fork-safe: a worker opens its own instead of using the parent's sockets
+        cls._shared = None
+
+    @classmethod
+    async def close_instance(cls) -> None:
+        if cls._shared is not None:
+            shared, cls._shared = cls._shared, None
+            await shared.close()
+
+    def pool_stats(self) -> Dict[str, int]:
+        stats = self._pool_listener.stats()
+        stats["max_pool_size"] = config.MONGODB_MAX_POOL_SIZE
+        stats["min_pool_size"] = config.MONGODB_MIN_POOL_SIZE
+        return stats
+
+    def write_stats(self) -> Dict[str, Any]:
+        return self._writes.stats()
+
+    def get_collection(self, collection_name: str, write_concern: Optional[WriteConcern] = None) -> AsyncIOMotorCollection:
+        if write_concern is not None:
+            return self._db.get_collection(collection_name, write_concern=write_concern)
         return self._db[collection_name]
 
-    async def insert_one(self, collection_name: str, data: Dict[str, Any]) -> Any:
+    @timed("mongo_insert_one")
+    async def insert_one(self, collection_name: str, data: Dict[str, Any], write_concern: Optional[WriteConcern] = None) -> Any:
+        if collection_name in self._coalesced:
+            return await self._writes.insert(collection_name, data, write_concern)
         try:
-            collection = self.get_collection(collection_name)
+            collection = self.get_collection(collection_name, write_concern)
             result = await collection.insert_one(data)
             return result.inserted_id
         except Exception as e:
             self._logger.error(f"Error inserting document into {collection_name}: {traceback.format_exc()}")
             raise e
 
+    @timed("mongo_find_one")
     async def find_one(self, collection_name: str, filter: Dict[str, Any], projection: Dict[str, Any] = None) -> Dict[str, Any]:
         try:
             collection = self.get_collection(collection_name)
@@ -31,7 +256,55 @@ class AsyncMongoDBService:
             self._logger.error(f"Error finding document in {collection_name}: {traceback.format_exc()}")
             raise e
 
+    @timed("mongo_find")
+    async def find(self, collection_name: str, filter: Dict[str, Any], projection: Dict[str, Any] = None, length: Optional[int] = None,
+                   sort: Optional[List[tuple]] = None) -> List[Dict[str, Any]]:
+        try:
+            collection = self.get_collection(collection_name)
+            cursor = collection.find(filter, projection, sort=sort)
+            if length is not None:
+                cursor = cursor.limit(length)
+            return await cursor.to_list(length)
+        except Exception as e:
+            self._logger.error(f"Error finding documents in {collection_name}: {traceback.format_exc()}")
+            raise e
+
+    async def iterate(self, collection_name: str, filter: Dict[str, Any], projection: Dict[str, Any] = None,
+                      sort: Optional[List[tuple]] = None, batch_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        The documents of a query in lists of up to `batch_size`, as the server returns them; the whole result is
+        never held in memory. The cursor is closed when the iteration stops early.
+        """
+        collection = self.get_collection(collection_name)
+        cursor = collection.find(filter, projection, sort=sort, batch_size=batch_size)
+        try:
+            batch = []
+            async for document in cursor:
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+        except Exception as e:
+            self._logger.error(f"Error iterating documents of {collection_name}: {traceback.format_exc()}")
+            raise e
+        finally:
+            await cursor.close()
+
+    @timed("mongo_aggregate")
+    async def aggregate(self, collection_name: str, pipeline: List[Dict[str, Any]], length: Optional[int] = None) -> List[Dict[str, Any]]:
+        try:
+            collection = self.get_collection(collection_name)
+            return await collection.aggregate(pipeline).to_list(length)
+        except Exception as e:
+            self._logger.error(f"Error aggregating documents in {collection_name}: {traceback.format_exc()}")
+            raise e
+
+    @timed("mongo_update_one")
     async def update_one(self, collection_name: str, filter: Dict[str, Any], update: Dict[str, Any]) -> None:
+        if collection_name in self._coalesced:
+            return await self._writes.update(collection_name, filter, update)
         try:
             collection = self.get_collection(collection_name)
             await collection.update_one(filter, update)
@@ -39,6 +312,29 @@ class AsyncMongoDBService:
             self._logger.error(f"Error updating document in {collection_name}: {traceback.format_exc()}")
             raise e
 
+    @timed("mongo_update_many")
+    async def update_many(self, collection_name: str, filter: Dict[str, Any], update: Dict[str, Any]) -> int:
+        try:
+            collection = self.get_collection(collection_name)
+            result = await collection.update_many(filter, update)
+            return result.modified_count
+        except Exception as e:
+            self._logger.error(f"Error updating documents in {collection_name}: {traceback.format_exc()}")
+            raise e
+
+    @timed("mongo_bulk_write")
+    async def bulk_write(self, collection_name: str, operations: List[Any], ordered: bool = False,
+                         write_concern: Optional[WriteConcern] = None) -> int:
+        """Send many writes in one round trip; unordered, so one failing operation does not stop the others."""
+        try:
+            collection = self.get_collection(collection_name, write_concern)
+            result = await collection.bulk_write(operations, ordered=ordered)
+            return result.modified_count
+        except Exception as e:
+            self._logger.error(f"Error bulk writing to {collection_name}: {traceback.format_exc()}")
+            raise e
+
+    @timed("mongo_delete_one")
     async def delete_one(self, collection_name: str, filter: Dict[str, Any]) -> None:
         try:
             collection = self.get_collection(collection_name)
@@ -47,9 +343,31 @@ class AsyncMongoDBService:
             self._logger.error(f"Error deleting document from {collection_name}: {traceback.format_exc()}")
             raise e
 
+    async def create_indexes(self, collection_name: str, indexes: List[IndexModel]) -> List[str]:
+        try:
+            collection = self.get_collection(collection_name)
+            return await collection.create_indexes(indexes)
+        except Exception as e:
+            self._logger.error(f"Error creating indexes on {collection_name}: {traceback.format_exc()}")
+            raise e
+
+    async def index_information(self, collection_name: str) -> Dict[str, Dict[str, Any]]:
+        try:
+            collection = self.get_collection(collection_name)
+            return await collection.index_information()
+        except Exception as e:
+            self._logger.error(f"Error listing indexes of {collection_name}: {traceback.format_exc()}")
+            raise e
+
     async def close(self) -> None:
+        # Writes still waiting for their batch go out before the client is closed
+        await self._writes.flush()
         try:
-            await self._client.close()
+            # Motor's close() is synchronous; it tears down every pooled socket
+            self._client.close()
         except Exception as e:
             self._logger.error(f"Error closing MongoDB client: {traceback.format_exc()}")
             raise e
+
+
+after_fork(AsyncMongoDBService._after_fork)
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import socket
+import traceback
+from typing import Callable, Optional
+from uuid import uuid4
+from app.core import config
+from app.core.logging import AsyncLogger
+from app.db.repositories.orderrepository import OrderRepository
+from app.db.services.kafkaproducer import KafkaProducer
+from app.db.services.mongodbservice import AsyncMongoDBService
+
+
+class OutboxRelay:
+    """
+    Background task that drains outbox events stored with orders to Kafka in batches.
+    Delivery is at-least-once: an event is marked published only after the broker acknowledged it,
+    so a crash between the two makes it go out again.
+    """
+
+    def __init__(self, repository_factory: Callable[[], OrderRepository] = lambda: OrderRepository(AsyncMongoDBService.get_instance()),
+                 batch_size: int = config.OUTBOX_BATCH_SIZE, poll_interval: float = config.OUTBOX_POLL_INTERVAL,
+                 claim_ttl: float = config.OUTBOX_CLAIM_TTL):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_ttl = claim_ttl
+        self.published = 0
+        self.failed = 0
+        self._repository_factory = repository_factory
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+        self._logger = AsyncLogger().get_logger()
+
+    def notify(self) -> None:
+        """Wake the relay up right away instead of at the next poll, e.g. after an order was stored."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {"published": self.published, "failed": self.failed}
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            # Stop cooperatively: cancelling the task inside wait_for() can be lost when the wakeup event is
+            # set at the same moment, which left shutdown waiting forever
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+            # Last drain so that events stored by the final requests go out before the producer is flushed
+            try:
+                while await self.relay_once() == self.batch_size:
+                    pass
+            except Exception:
+                self._logger.error(f"Error draining the outbox on shutdown: {traceback.format_exc()}")
+
+    async def relay_once(self) -> int:
+        """Publish one batch of pending events, returns the number of events claimed."""
+        repository = self._repository_factory()
+        documents = await repository.claim_outbox(self._worker_id, self.batch_size, self.claim_ttl)
+        if not documents:
+            return 0
+        producer = KafkaProducer()
+        deliveries = []
+        for document in documents:
+            event = document["outbox"]
+            deliveries.append(await producer.send(event["topic"], event["payload"], key=event.get("key"), wait=False))
+        results = await asyncio.gather(*deliveries, return_exceptions=True)
+
+        delivered = [document["_id"] for document, result in zip(documents, results) if not isinstance(result, BaseException)]
+        if delivered:
+            await repository.mark_published(delivered)
+        self.published += len(delivered)
+        # Undelivered events keep their claim until it expires and are then retried
+        self.failed += len(documents) - len(delivered)
+        return len(documents)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                claimed = await self.relay_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.error(f"Error relaying the outbox: {traceback.format_exc()}")
+                claimed = 0
+            if claimed < self.batch_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+
+outbox_relay = OutboxRelay()
@@ -1,10 +1,36 @@
 import redis.asyncio as redis
+import orjson
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 from app.core import config
+from app.core.lifecycle import after_fork
 from app.core.logging import AsyncLogger
+from app.core.metrics import timed
+from app.db.models import POSITION_JSON, PositionStructure
+
+# (user_id, exchange, symbol, side)
+PositionKey = Tuple[str, str, str, str]
+
+DELETE_IF_EQUALS_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
 
 class AsyncRedisService:
+    """
+    Redis access shared by the whole process through one connection pool. When all REDIS_MAX_CONNECTIONS are
+    in use a command waits up to REDIS_POOL_TIMEOUT for one to be released instead of failing right away.
+    Pub/sub listeners hold their connection for as long as they run, they get connections of their own (see
+    pubsub()) so that they never take from the commands' budget.
+
+    Positions are stored as one hash per account (CACHE_KEY_FORMAT, e.g. positions:{user_id}) with one field
+    per exchange/symbol/side, so every position of an account can be read or written in a single command.
+    """
     _instance = None
     _connection = None
+    _pool = None
+    _subscriber = None
     _logger = None
 
     def __new__(cls):
@@ -14,33 +40,217 @@ class AsyncRedisService:
         return cls._instance
 
     async def get_connection(self):
+        # Kept on the class, like the instance itself, so that there is a single pool per process to reset
+        cls = type(self)
         try:
-            if not self._connection:
-                self._connection = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+            if not cls._connection:
+                cls._pool = redis.BlockingConnectionPool(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0,
+                                                         max_connections=config.REDIS_MAX_CONNECTIONS,
+                                                         timeout=config.REDIS_POOL_TIMEOUT)
+                cls._connection = redis.Redis(connection_pool=cls._pool)
         except Exception as e:
             self._logger.error("Error while connecting to Redis: {}".format(e))
         return self._connection
 
+    def pubsub(self, **kwargs) -> redis.client.PubSub:
+        """A pub/sub session on a dedicated connection, outside the pool of the commands."""
+        cls = type(self)
+        if cls._subscriber is None:
+            # Unbounded: one connection per listener of the process (user cache, token cache, update hub)
+            cls._subscriber = redis.Redis(host=config.REDIS_HOST, port=config.REDIS_PORT, db=0)
+        return cls._subscriber.pubsub(**kwargs)
+
+    async def warm_up(self):
+        """Open REDIS_MIN_CONNECTIONS connections up front so the first requests don't pay for connecting."""
+        await self.get_connection()
+        connections = []
+        try:
+            for _ in range(min(config.REDIS_MIN_CONNECTIONS, config.REDIS_MAX_CONNECTIONS)):
+                connections.append(await self._pool.get_connection("PING"))
+        except Exception as e:
+            self._logger.error("Error while opening Redis connections: {}".format(e))
+        finally:
+            for connection in connections:
+                await self._pool.release(connection)
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        # The parent's connections stay with the parent, a worker opens its own pool
+        cls._connection = None
+        cls._pool = None
+        cls._subscriber = None
+
     async def close(self):
+        cls = type(self)
         try:
-            if self._connection:
-                await self._connection.close()
-                self._connection = None
+            if cls._connection:
+                connection, pool = cls._connection, cls._pool
+                cls._connection = None
+                cls._pool = None
+                await connection.close()
+                if pool is not None:
+                    await pool.disconnect()
+            if cls._subscriber:
+                subscriber, cls._subscriber = cls._subscriber, None
+                await subscriber.close(close_connection_pool=True)
         except Exception as e:
             self._logger.error("Error while closing Redis connection: {}".format(e))
 
-    async def get_position(self, key: str):
+    @staticmethod
+    def position_key(user_id: str) -> str:
+        return config.CACHE_KEY_FORMAT.format(user_id=user_id)
+
+    @staticmethod
+    def position_field(exchange: str, symbol: str, side: str) -> str:
+        return f"{exchange}:{symbol}:{side}"
+
+    @staticmethod
+    def _dump_position(position: Union[PositionStructure, dict]) -> Tuple[str, bytes]:
+        if isinstance(position, PositionStructure):
+            field = AsyncRedisService.position_field(position.exchange.value, position.symbol, position.side)
+            return field, POSITION_JSON.dump_json(position)
+        # Enum members (e.g. Exchange.BITGET) are keyed by their value
+        exchange = getattr(position["exchange"], "value", position["exchange"])
+        return AsyncRedisService.position_field(exchange, position["symbol"], position["side"]), orjson.dumps(position)
+
+    @timed("redis_get_position")
+    async def get_position(self, user_id: str, exchange: str, symbol: str, side: str) -> Optional[dict]:
         try:
             conn = await self.get_connection()
-            return await conn.get(key)
+            value = await conn.hget(self.position_key(user_id), self.position_field(exchange, symbol, side))
+            return orjson.loads(value) if value is not None else None
         except Exception as e:
             self._logger.error("Error while getting position from Redis: {}".format(e))
             raise e  
 
-    async def set_position(self, key: str, value: str):
+    @timed("redis_set_position")
+    async def set_position(self, user_id: str, position: Union[PositionStructure, dict]):
         try:
             conn = await self.get_connection()
-            await conn.set(key, value)
+            field, value = self._dump_position(position)
+            await conn.hset(self.position_key(user_id), field, value)
         except Exception as e:
             self._logger.error("Error while setting position in Redis: {}".format(e))
-            raise e        
\ No newline at end of file
+            raise e        
+
+    @timed("redis_delete_position")
+    async def delete_position(self, user_id: str, exchange: str, symbol: str, side: str):
+        try:
+            conn = await self.get_connection()
+            await conn.hdel(self.position_key(user_id), self.position_field(exchange, symbol, side))
+        except Exception as e:
+            self._logger.error("Error while deleting position from Redis: {}".format(e))
+            raise e
+
+    @timed("redis_get_account_positions")
+    async def get_account_positions(self, user_id: str) -> List[dict]:
+        try:
+            conn = await self.get_connection()
+            values = await conn.hvals(self.position_key(user_id))
+            return [orjson.loads(value) for value in values]
+        except Exception as e:
+            self._logger.error("Error while getting account positions from Redis: {}".format(e))
+            raise e
+
+    @timed("redis_get_positions")
+    async def get_positions(self, keys: Iterable[PositionKey]) -> List[Optional[dict]]:
+        """Look up many positions in one round trip; results are in the order of `keys`."""
+        keys = list(keys)
+        if not keys:
+            return []
+        fields_by_account: Dict[str, List[str]] = {}
+        for user_id, exchange, symbol, side in keys:
+            fields_by_account.setdefault(user_id, []).append(self.position_field(exchange, symbol, side))
+        try:
+            conn = await self.get_connection()
+            async with conn.pipeline(transaction=False) as pipe:
+                for user_id, fields in fields_by_account.items():
+                    pipe.hmget(self.position_key(user_id), fields)
+                replies = await pipe.execute()
+        except Exception as e:
+            self._logger.error("Error while getting positions from Redis: {}".format(e))
+            raise e
+        values = {}
+        for (user_id, fields), reply in zip(fields_by_account.items(), replies):
+            for field, value in zip(fields, reply):
+                values[(user_id, field)] = orjson.loads(value) if value is not None else None
+        return [values[(user_id, self.position_field(exchange, symbol, side))] for user_id, exchange, symbol, side in keys]
+
+    @timed("redis_set_positions")
+    async def set_positions(self, positions: Iterable[Tuple[str, Union[PositionStructure, dict]]],
+                            removed: Iterable[PositionKey] = ()):
+        """Write many (user_id, position) pairs and delete `removed` positions in one round trip."""
+        mappings: Dict[str, Dict[str, bytes]] = {}
+        for user_id, position in positions:
+            field, value = self._dump_position(position)
+            mappings.setdefault(user_id, {})[field] = value
+        deletions: Dict[str, List[str]] = {}
+        for user_id, exchange, symbol, side in removed:
+            deletions.setdefault(user_id, []).append(self.position_field(exchange, symbol, side))
+        if not mappings and not deletions:
+            return
+        try:
+            conn = await self.get_connection()
+            async with conn.pipeline(transaction=False) as pipe:
+                for user_id, mapping in mappings.items():
+                    pipe.hset(self.position_key(user_id), mapping=mapping)
+                for user_id, fields in deletions.items():
+                    pipe.hdel(self.position_key(user_id), *fields)
+                await pipe.execute()
+        except Exception as e:
+            self._logger.error("Error while setting positions in Redis: {}".format(e))
+            raise e
+
+    @timed("redis_get")
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            conn = await self.get_connection()
+            return await conn.get(key)
+        except Exception as e:
+            self._logger.error("Error while getting {} from Redis: {}".format(key, e))
+            raise e
+
+    @timed("redis_set")
+    async def set(self, key: str, value: Union[str, bytes], ttl: int = None, only_if_absent: bool = False) -> bool:
+        """SET with an optional expiry in seconds; with `only_if_absent` (NX) returns False when the key already exists."""
+        try:
+            conn = await self.get_connection()
+            return bool(await conn.set(key, value, ex=ttl, nx=only_if_absent))
+        except Exception as e:
+            self._logger.error("Error while setting {} in Redis: {}".format(key, e))
+            raise e
+
+    @timed("redis_delete_if_equals")
+    async def delete_if_equals(self, key: str, value: Union[str, bytes]) -> bool:
+        """Delete `key` only if it still holds `value`, e.g. to release a lock that may have expired and been taken over."""
+        try:
+            conn = await self.get_connection()
+            return bool(await conn.eval(DELETE_IF_EQUALS_SCRIPT, 1, key, value))
+        except Exception as e:
+            self._logger.error("Error while deleting {} from Redis: {}".format(key, e))
+            raise e
+
+    @timed("redis_publish")
+    async def publish(self, channel: str, message: str) -> int:
+        try:
+            conn = await self.get_connection()
+            return await conn.publish(channel, message)
+        except Exception as e:
+            self._logger.error("Error while publishing to Redis channel {}: {}".format(channel, e))
+            raise e
+
+    @timed("redis_publish_many")
+    async def publish_many(self, messages: Iterable[Tuple[str, Union[str, bytes]]]) -> None:
+        """PUBLISH every (channel, message) pair in one round trip."""
+        try:
+            conn = await self.get_connection()
+            async with conn.pipeline(transaction=False) as pipe:
+                for channel, message in messages:
+                    pipe.publish(channel, message)
+                await pipe.execute()
+        except Exception as e:
+            self._logger.error("Error while publishing to Redis: {}".format(e))
+            raise e
+
+
+after_fork(AsyncRedisService._after_fork)
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import math
+import time
+from typing import Optional
+from jose import JWTError, jwt
+from app.core import config
+from app.core.cache import TTLCache
+from app.core.logging import AsyncLogger
+from app.db.services.redisservice import AsyncRedisService
+
+
+class TokenRevoked(JWTError):
+    """Raised for a token that was revoked, e.g. by logging out."""
+
+
+class TokenCache:
+    """
+    In-process cache of verified access tokens, so that the signature and claims of a token are checked once
+    per worker rather than on every request. Entries are keyed by a hash of the token, never the token itself,
+    and expire with the token's `exp`.
+
+    Revoking a token stores its hash in Redis until the token would have expired and broadcasts it on a pub/sub
+    channel, so that every worker evicts it. Workers check Redis only when they verify a token they have not
+    cached; if Redis is unavailable that check is skipped rather than failing authentication.
+    """
+    RECONNECT_DELAY = 1.0
+    # Lifetime of a revocation received from another worker
+    REVOCATION_TTL = config.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+    def __init__(self, maxsize: int = config.TOKEN_CACHE_MAX_SIZE, prefix: str = config.TOKEN_REVOCATION_PREFIX,
+                 channel: str = config.TOKEN_REVOCATION_CHANNEL):
+        self.prefix = prefix
+        self.channel = channel
+        self.revocation_errors = 0
+        # Entries carry their own lifetime (the token's), the cache-wide one is never used
+        self._verified = TTLCache(maxsize, ttl=0)
+        # Revocations received by this worker, kept while the token would still verify
+        self._revoked = TTLCache(maxsize, ttl=0)
+        self._listener: Optional[asyncio.Task] = None
+        self._logger = AsyncLogger().get_logger()
+
+    @staticmethod
+    def token_id(token: str) -> str:
+        return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def decode(token: str) -> dict:
+        """Full verification of the signature and claims; raises JWTError."""
+        return jwt.decode(token, config.SECRET_KEY, algorithms=[config.ALGORITHM])
+
+    async def verify(self, token: str) -> str:
+        """The username (`sub`) of a valid, unrevoked token; raises JWTError otherwise."""
+        token_id = self.token_id(token)
+        username = self._verified.get(token_id)
+        if username is not None:
+            return username
+        payload = self.decode(token)
+        username = payload.get("sub")
+        if username is None:
+            raise JWTError("Token has no subject")
+        # Checked locally again after reading Redis: the revocation may have been received in between
+        if token_id in self._revoked or await self._revoked_in_redis(token_id) or token_id in self._revoked:
+            raise TokenRevoked("Token was revoked")
+        expires_in = payload.get("exp", 0) - time.time()
+        # A token without an expiry is verified on every request
+        if expires_in > 0:
+            self._verified.set(token_id, username, ttl=expires_in)
+        return username
+
+    async def revoke(self, token: str) -> None:
+        """Revoke a valid token on every worker until it expires."""
+        payload = self.decode(token)
+        token_id = self.token_id(token)
+        expires_in = payload["exp"] - time.time() if "exp" in payload else None
+        self._forget(token_id, expires_in)
+        redis_service = AsyncRedisService()
+        await redis_service.set(self.prefix + token_id, b"1", ttl=math.ceil(expires_in) if expires_in else None)
+        await redis_service.publish(self.channel, token_id)
+
+    def clear(self) -> None:
+        self._verified.clear()
+        self._revoked.clear()
+
+    def stats(self) -> dict:
+        return dict(self._verified.stats(), revoked=len(self._revoked), revocation_errors=self.revocation_errors)
+
+    def revoked_elsewhere(self, token_id: str) -> None:
+        """
+        Record a revocation broadcast by another worker like a local one, so that a verify() already past the cache
+        but still reading Redis cannot cache the token afterwards. The token's expiry is not known here, its default
+        lifetime bounds the entry; the Redis key outlives it.
+        """
+        self._forget(token_id, self.REVOCATION_TTL)
+
+    def _forget(self, token_id: str, expires_in: Optional[float]) -> None:
+        self._verified.pop(token_id)
+        # Without an expiry the Redis key is the only record
+        if expires_in:
+            self._revoked.set(token_id, True, ttl=expires_in)
+
+    async def _revoked_in_redis(self, token_id: str) -> bool:
+        try:
+            return await AsyncRedisService().get(self.prefix + token_id) is not None
+        except Exception:
+            # Already logged by the Redis service
+            self.revocation_errors += 1
+            return False
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with AsyncRedisService().pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            token_id = message["data"]
+                            self.revoked_elsewhere(token_id.decode() if isinstance(token_id, bytes) else token_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._logger.error("Token revocation listener disconnected: {}".format(e))
+                # Revocations may have been missed while disconnected
+                self._verified.clear()
+                await asyncio.sleep(self.RECONNECT_DELAY)
+
+
+token_cache = TokenCache()
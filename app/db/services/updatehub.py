@@ -0,0 +1,208 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+import orjson
+from app.core import config
+from app.core.logging import AsyncLogger
+from app.db.services.redisservice import AsyncRedisService
+
+# Sent to every connection after the subscription to Redis was re-established: updates may have been missed
+RESYNC = b'{"type":"resync"}'
+
+
+class TooManySubscribers(Exception):
+    """Raised when the worker already serves STREAM_MAX_CONNECTIONS connections."""
+
+
+class HubClosing(TooManySubscribers):
+    """Raised for a new connection while the worker shuts down."""
+
+
+class Subscription:
+    """
+    The updates of one user for one connection. The queue is bounded: a consumer that falls `maxsize`
+    messages behind is dropped rather than buffered without limit; it reconnects and reads the current state.
+    """
+    __slots__ = ("user_id", "maxsize", "dropped", "_queue")
+
+    def __init__(self, user_id: str, maxsize: int):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self.dropped = False
+        # Bounded by put(), the queue itself must keep room for the closing sentinel
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def put(self, message: bytes) -> bool:
+        """Queue a message; returns False, and ends the subscription, if the consumer is too far behind."""
+        if self._queue.qsize() >= self.maxsize:
+            self.dropped = True
+            self.close()
+            return False
+        self._queue.put_nowait(message)
+        return True
+
+    def close(self) -> None:
+        self._queue.put_nowait(None)
+
+    async def get(self) -> Optional[bytes]:
+        """The next message, None once the subscription ended."""
+        return await self._queue.get()
+
+
+class UpdateHub:
+    """
+    Pushes order and position updates to the connections of /stream. Updates are published on a Redis
+    channel per user (STREAM_CHANNEL_PREFIX + user_id); every worker holds a single pattern subscription on
+    those channels and fans each message out to the local connections of that user, so the number of
+    connections never reaches Redis. Messages are forwarded as published, without being decoded.
+
+    Delivery is best effort: a publish failure is counted, not raised, and clients get a resync message when
+    updates may have been lost.
+    """
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, prefix: str = config.STREAM_CHANNEL_PREFIX, queue_size: int = config.STREAM_QUEUE_SIZE,
+                 max_connections: int = config.STREAM_MAX_CONNECTIONS):
+        self.prefix = prefix
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        self.connections = 0
+        self.closing = False
+        self.delivered = 0
+        self.dropped = 0
+        self.publish_errors = 0
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._publishes: Set[asyncio.Task] = set()
+        self._logger = AsyncLogger().get_logger()
+
+    def stats(self) -> dict:
+        return {"connections": self.connections, "users": len(self._subscriptions), "delivered": self.delivered,
+                "dropped": self.dropped, "publish_errors": self.publish_errors}
+
+    def channel(self, user_id: str) -> str:
+        return f"{self.prefix}{user_id}"
+
+    @staticmethod
+    def message(kind: str, data: Any) -> bytes:
+        return orjson.dumps({"type": kind, "data": data}, option=orjson.OPT_NAIVE_UTC, default=str)
+
+    async def publish(self, user_id: str, kind: str, data: Any) -> None:
+        await self.publish_many([(user_id, kind, data)])
+
+    def publish_soon(self, user_id: str, kind: str, data: Any) -> None:
+        """Publish an update in the background, for callers that must not wait for Redis (see flush())."""
+        task = asyncio.create_task(self.publish(user_id, kind, data))
+        self._publishes.add(task)
+        task.add_done_callback(self._publishes.discard)
+
+    async def flush(self) -> None:
+        """Wait for the updates being published in the background."""
+        if self._publishes:
+            await asyncio.gather(*self._publishes, return_exceptions=True)
+
+    async def publish_many(self, updates: Iterable[Tuple[str, str, Any]]) -> None:
+        """Publish (user_id, kind, data) updates in one round trip."""
+        messages = [(self.channel(user_id), self.message(kind, data)) for user_id, kind, data in updates]
+        if not messages:
+            return
+        try:
+            await AsyncRedisService().publish_many(messages)
+        except Exception:
+            # Already logged by the Redis service; the update is lost, the state it reports is not
+            self.publish_errors += 1
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: str) -> AsyncIterator[Subscription]:
+        if self.closing:
+            raise HubClosing()
+        if self.connections >= self.max_connections:
+            raise TooManySubscribers()
+        subscription = Subscription(user_id, self.queue_size)
+        self._subscriptions.setdefault(user_id, set()).add(subscription)
+        self.connections += 1
+        try:
+            # Workers that never serve a stream never subscribe
+            await self.start()
+            yield subscription
+        finally:
+            self._remove(subscription)
+
+    def dispatch(self, channel: bytes, message: bytes) -> None:
+        """Hand a message received on `channel` to the local connections of its user."""
+        subscriptions = self._subscriptions.get(channel[len(self.prefix):].decode())
+        if not subscriptions:
+            return
+        for subscription in list(subscriptions):
+            if subscription.put(message):
+                self.delivered += 1
+            else:
+                self.dropped += 1
+                self._logger.warning(f"Dropped a slow /stream consumer of {subscription.user_id}")
+                self._remove(subscription)
+
+    def broadcast(self, message: bytes) -> None:
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                if not subscription.put(message):
+                    self.dropped += 1
+                    self._remove(subscription)
+
+    def _remove(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.user_id)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.user_id]
+        self.connections -= 1
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        self._end_streams()
+
+    def close_streams(self) -> None:
+        """End every open stream and refuse new ones, e.g. as soon as the worker is asked to shut down."""
+        self.closing = True
+        self._end_streams()
+
+    def _end_streams(self) -> None:
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+                self._remove(subscription)
+
+    def reset(self) -> None:
+        self.closing = False
+
+    async def _listen(self) -> None:
+        connected_before = False
+        while True:
+            try:
+                async with AsyncRedisService().pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.psubscribe(f"{self.prefix}*")
+                    if connected_before:
+                        self.broadcast(RESYNC)
+                    connected_before = True
+                    async for message in pubsub.listen():
+                        if message["type"] == "pmessage":
+                            self.dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._logger.error("Update hub subscription disconnected: {}".format(e))
+                connected_before = True
+                await asyncio.sleep(self.RECONNECT_DELAY)
+
+
+update_hub = UpdateHub()
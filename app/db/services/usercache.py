@@ -0,0 +1,76 @@
+import asyncio
+from typing import Optional
+from app.core import config
+from app.core.cache import TTLCache
+from app.core.logging import AsyncLogger
+from app.db.models import UserInDB
+from app.db.services.redisservice import AsyncRedisService
+
+
+class UserCache:
+    """
+    In-process cache of authenticated users keyed by username, so that get_current_user does no
+    database I/O in steady state. Every worker keeps its own copy; invalidate() evicts the user
+    locally and broadcasts the username on a Redis pub/sub channel so the other workers evict it too.
+    """
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, maxsize: int = config.USER_CACHE_MAX_SIZE, ttl: float = config.USER_CACHE_TTL,
+                 channel: str = config.USER_CACHE_CHANNEL):
+        self.channel = channel
+        self._cache = TTLCache(maxsize, ttl)
+        self._listener: Optional[asyncio.Task] = None
+        self._logger = AsyncLogger().get_logger()
+
+    def get(self, username: str) -> Optional[UserInDB]:
+        return self._cache.get(username)
+
+    def set(self, user: UserInDB) -> None:
+        self._cache.set(user.username, user)
+
+    def evict(self, username: str) -> None:
+        self._cache.pop(username)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    async def invalidate(self, username: str) -> None:
+        """Evict a user from every worker's cache, e.g. after their credentials changed."""
+        self.evict(username)
+        await AsyncRedisService().publish(self.channel, username)
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with AsyncRedisService().pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            username = message["data"]
+                            self.evict(username.decode() if isinstance(username, bytes) else username)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._logger.error("User cache invalidation listener disconnected: {}".format(e))
+                # Invalidations may have been missed while disconnected
+                self.clear()
+                await asyncio.sleep(self.RECONNECT_DELAY)
+
+
+user_cache = UserCache()
@@ -1,17 +1,21 @@
-from fastapi import Depends, HTTPException
-from typing import Union
-from app.core import config
-from app.core.logging import AsyncLogger
-from app.db.models import UserInDB, PlaceOrderBase, ExchangeCredentials, OrderType
+from fastapi import Body, Depends, HTTPException, Query, WebSocket, WebSocketException
+from typing import AsyncIterator, Optional, Union
+from app.core.logging import AsyncLogger, bind_log_context
+from app.core.metrics import stage_timer
+from app.db.models import UserInDB, PlaceOrderBase, OrderTicket, ExchangeCredentials, OrderType
 from app.db.repositories.orderrepository import OrderRepository
 from app.db.services.mongodbservice import AsyncMongoDBService
 from app.db.repositories.userrepository import UserRepository
-from app.auth.jwt import oauth2_scheme, TokenData, JWTError, jwt, HTTPException, status
+from app.auth.jwt import oauth2_scheme, JWTError, HTTPException, status
 from app.db.services.redisservice import AsyncRedisService as redis_service
+from app.db.services.usercache import user_cache
+from app.db.services.tokencache import token_cache
+from app.exchanges.integrations import AbstractExchange
+from app.exchanges.pool import exchange_pool
 
 
 def get_db_service() -> AsyncMongoDBService:
-    return AsyncMongoDBService()
+    return AsyncMongoDBService.get_instance()
 
 def get_user_repository(db_service: AsyncMongoDBService = Depends(get_db_service)) -> UserRepository:
     return UserRepository(db_service)
@@ -19,45 +23,86 @@ def get_user_repository(db_service: AsyncMongoDBService = Depends(get_db_service
 def get_order_repository(db_service: AsyncMongoDBService = Depends(get_db_service)) -> OrderRepository:
     return OrderRepository(db_service)
 
-# To get the current user from the token
-async def get_current_user(token: str = Depends(oauth2_scheme), user_repository = Depends(get_user_repository)) -> Union[UserInDB, None]:
+async def authenticate(token: str, user_repository: UserRepository) -> UserInDB:
+    """The user a bearer token was issued to; raises 401 if the token is invalid and 404 if the user is gone."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, config.SECRET_KEY, algorithms=[config.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
+        # Verified once per worker, then served from the token cache until the token expires or is revoked
+        with stage_timer("jwt_decode"):
+            username = await token_cache.verify(token)
     except JWTError:        
-        AsyncLogger().get_logger().logger_instance.with_traceback("Error while decoding token")
+        AsyncLogger().get_logger().warning("Error while decoding token", exc_info=True)
         raise credentials_exception
-    user = await user_repository.get(username=token_data.username)
+    bind_log_context(user=username)
+    with stage_timer("user_lookup"):
+        user = user_cache.get(username)
+        if user is not None:
+            return user
+        user = await user_repository.get(username=username)
     if user is None:
-        AsyncLogger().get_logger().logger_instance.with_traceback("User not found")
+        AsyncLogger().get_logger().warning("User not found")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    user_cache.set(user)
     return user
 
-def get_exchange_credentials(order: PlaceOrderBase, 
-                             current_user: UserInDB = Depends(get_current_user)
-) -> ExchangeCredentials:
-    exchange_name = order.exchange.value
-    matching_exchange = next((exchange for exchange in current_user.exchanges if exchange.name == exchange_name), None)
+# To get the current user from the token
+async def get_current_user(token: str = Depends(oauth2_scheme), user_repository = Depends(get_user_repository)) -> Union[UserInDB, None]:
+    return await authenticate(token, user_repository)
+
+async def get_websocket_user(websocket: WebSocket, token: Optional[str] = Query(None),
+                             user_repository = Depends(get_user_repository)) -> UserInDB:
+    """
+    The user of a WebSocket, authenticated once at the handshake. Browsers cannot set headers on a WebSocket,
+    so the token is also accepted as the `token` query parameter.
+    """
+    if token is None:
+        scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason="Not authenticated")
+    try:
+        return await authenticate(token, user_repository)
+    except HTTPException as e:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=e.detail)
+
+def find_exchange_credentials(user: UserInDB, exchange_name: str) -> ExchangeCredentials:
+    matching_exchange = next((exchange for exchange in user.exchanges if exchange.name == exchange_name), None)
     
     if not matching_exchange:
         raise HTTPException(status_code=404, detail="Exchange credentials not found")
     return matching_exchange
 
-async def has_open_position(order: PlaceOrderBase, current_user: UserInDB = Depends(get_current_user)) -> bool:
-    cached_position = await redis_service.get_position(current_user.id, order.exchange.value, order.symbol, order.side.value)
+async def get_order(order: PlaceOrderBase = Body(...)) -> OrderTicket:
+    """
+    The request's order, validated once. Every dependency and endpoint that needs the order takes it from here:
+    declaring the model in each of them makes FastAPI validate the body again for each one. A coroutine, so that
+    FastAPI runs it on the event loop instead of handing it to the threadpool.
+    """
+    return OrderTicket.from_order(order)
+
+def get_exchange_credentials(order: OrderTicket = Depends(get_order), 
+                             current_user: UserInDB = Depends(get_current_user)
+) -> ExchangeCredentials:
+    return find_exchange_credentials(current_user, order.exchange.value)
+
+async def get_exchange(order: OrderTicket = Depends(get_order),
+                       exchange_credentials: ExchangeCredentials = Depends(get_exchange_credentials)
+) -> AsyncIterator[AbstractExchange]:
+    bind_log_context(exchange=order.exchange.value, order_type=order.type.value)
+    # The client goes back to the pool once the response has been sent
+    async with exchange_pool.lease(order.exchange.value, exchange_credentials.api_key, exchange_credentials.api_secret) as exchange:
+        yield exchange
+
+async def has_open_position(order: OrderTicket = Depends(get_order), current_user: UserInDB = Depends(get_current_user)) -> bool:
+    cached_position = await redis_service().get_position(current_user.id, order.exchange.value, order.symbol, order.side.value)
     if cached_position is None: 
         raise HTTPException(status_code=400, detail="No open position for the given symbol.")
     return True
 
-def is_tpsl_order_type(order: PlaceOrderBase) -> bool:
+def is_tpsl_order_type(order: OrderTicket = Depends(get_order)) -> bool:
     if order.type not in OrderType.TAKE_PROFIT_STOP_LOSS:
         raise HTTPException(status_code=400, detail="Order type is not a TP/SL order")
     return True
\ No newline at end of file
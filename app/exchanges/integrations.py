@@ -1,53 +1,173 @@
+import aiohttp
 import ccxt.async_support as ccxt
 from abc import ABC, abstractmethod
-from app.db.models import PlaceOrderBase, OrderStructure, OrderType, PositionAction, TimeInForce
+from typing import Awaitable, Callable, List, Optional
+from app.core import config
+from app.core.metrics import stage_timer
+from app.core.retrytemplate import NO_RETRY, CircuitBreaker, RetryPolicy, get_breaker, retry_call
+from app.db.models import ORDER_JSON, OrderTicket, OrderStructure, OrderType, PositionAction, TimeInForce
+from app.exchanges.ratelimit import RateLimiter, RateLimitExceeded, rate_limiter as default_rate_limiter
 
 class AbstractExchange(ABC):
+    # Key of the exchange in the rate limits (see app.exchanges.ratelimit)
+    name: str = None
 
-    def __init__(self, api_key: str, api_secret: str):
+    # Errors meaning the exchange could not be reached or is overloaded; they are retried and trip the circuit breakers
+    TRANSIENT_ERRORS = (ccxt.NetworkError,)
+
+    # Attributes ccxt populates in load_markets(); copying them lets a new client skip that call
+    MARKET_ATTRIBUTES = ("markets", "markets_by_id", "symbols", "ids", "currencies", "currencies_by_id",
+                         "codes", "baseCurrencies", "quoteCurrencies")
+
+    def __init__(self, api_key: str, api_secret: str, session: aiohttp.ClientSession = None,
+                 rate_limiter: RateLimiter = None):
         self.api_key = api_key
         self.api_secret = api_secret
+        self.session = session
+        if rate_limiter is None and config.RATE_LIMIT_ENABLED:
+            rate_limiter = default_rate_limiter
+        self.rate_limiter = rate_limiter
 
     @staticmethod
-    def create(name: str, api_key: str, api_secret: str) -> "AbstractExchange":
-        if name == "bitget":
-            return BitgetExchange(api_key, api_secret)
-        elif name == "bybit":
-            return BybitExchange(api_key, api_secret)
-        else:
-            raise ValueError(f"Unsupported exchange: {name}")
+    def create(name: str, api_key: str, api_secret: str, session: aiohttp.ClientSession = None) -> "AbstractExchange":
+        with stage_timer("exchange_create", name):
+            if name == "bitget":
+                return BitgetExchange(api_key, api_secret, session=session)
+            elif name == "bybit":
+                return BybitExchange(api_key, api_secret, session=session)
+            else:
+                raise ValueError(f"Unsupported exchange: {name}")
+
+    def ccxt_config(self) -> dict:
+        """Constructor options for the underlying ccxt client."""
+        ccxt_config = {
+            'apiKey': self.api_key,
+            'secret': self.api_secret,
+        }
+        # A session passed in is owned (and closed) by whoever created it, e.g. the ExchangePool
+        if self.session is not None:
+            ccxt_config['session'] = self.session
+        # ccxt's throttle only spaces out the calls of this one instance, the shared limiter replaces it
+        if self.rate_limiter is not None:
+            ccxt_config['enableRateLimit'] = False
+        return ccxt_config
+
+    async def throttle(self, endpoint: str, cost: int = 1) -> None:
+        """Take a token for a call of the given endpoint class (order, private or public) before making it."""
+        if self.rate_limiter is not None:
+            with stage_timer("rate_limit", self.name):
+                await self.rate_limiter.acquire(self.name, endpoint, self.api_key, cost)
+
+    def breaker(self, operation: str) -> CircuitBreaker:
+        """Circuit breaker of an operation on this exchange, shared by every client of the process."""
+        return get_breaker(f"{self.name}:{operation}", failure_on=self.TRANSIENT_ERRORS, ignore=(RateLimitExceeded,))
+
+    async def call(self, operation: str, endpoint: str, fn: Callable[[], Awaitable], policy: RetryPolicy = RetryPolicy(),
+                   before_retry: Callable[[BaseException], Awaitable] = None):
+        """Make an exchange call through its circuit breaker and the rate limiter, retrying transient errors."""
+        async def attempt():
+            await self.throttle(endpoint)
+            return await fn()
+        # Includes retries and rate limit waits, the rate_limit stage tells the latter apart
+        with stage_timer(f"exchange_{operation}", self.name):
+            return await retry_call(attempt, policy, self.breaker(operation), retry_on=self.TRANSIENT_ERRORS, before_retry=before_retry)
+
+    @property
+    def markets_loaded(self) -> bool:
+        return bool(self.exchange.markets)
+
+    def export_markets(self) -> dict:
+        return {attribute: getattr(self.exchange, attribute) for attribute in self.MARKET_ATTRIBUTES}
+
+    def import_markets(self, markets: dict) -> None:
+        """Reuse market metadata loaded by another client of the same exchange instead of fetching it again."""
+        for attribute, value in markets.items():
+            setattr(self.exchange, attribute, value)
+
+    async def load_markets(self, reload: bool = False) -> dict:
+        return await self.call("load_markets", "public", lambda: self.exchange.load_markets(reload))
+
+    async def close(self) -> None:
+        await self.exchange.close()
+
+    @property
+    def supports_position_stream(self) -> bool:
+        return bool(self.exchange.has.get('watchPositions'))
+
+    async def fetch_positions(self, symbols: list = None) -> list:
+        """Every open position of the account, as ccxt position structures."""
+        return await self.call("fetch_positions", "private", lambda: self.exchange.fetch_positions(symbols))
+
+    async def fetch_open_orders(self, symbol: str, since: Optional[int] = None) -> List[dict]:
+        """Open orders of the account on `symbol` placed after `since` (ms), as ccxt order structures."""
+        return await self.call("fetch_open_orders", "private", lambda: self.exchange.fetch_open_orders(symbol, since))
+
+    async def fetch_closed_orders(self, symbol: str, since: Optional[int] = None) -> List[dict]:
+        """Filled, cancelled or expired orders of the account on `symbol` placed after `since` (ms)."""
+        return await self.call("fetch_closed_orders", "private", lambda: self.exchange.fetch_closed_orders(symbol, since))
+
+    async def watch_positions(self) -> list:
+        """Wait for the next position update pushed by the exchange (only when supports_position_stream)."""
+        return await self.exchange.watch_positions()
     
-    async def place_order(self, order:PlaceOrderBase) -> OrderStructure:
-        match order.type:
-            case OrderType.MARKET:
-                return await self.place_market_order(order)
-            case OrderType.LIMIT:
-                return await self.place_limit_order(order)
-            case OrderType.STOP_LIMIT:
-                return await self.place_stop_limit_order(order)
-            case OrderType.STOP_MARKET:
-                return await self.place_stop_market_order(order)
-            case OrderType.TAKE_PROFIT_STOP_LOSS:
-                return await self.place_tpsl_order(order)
+    async def find_order(self, symbol: str, client_order_id: str) -> Optional[dict]:
+        """The open or closed order with this clientOrderId, None if the exchange has no such order."""
+        await self.throttle("private", cost=2)
+        for fetch in (self.exchange.fetch_open_orders, self.exchange.fetch_closed_orders):
+            for order in await fetch(symbol):
+                if order.get("clientOrderId") == client_order_id:
+                    return order
+        return None
+
+    async def place_order(self, order: OrderTicket) -> OrderStructure:
+        async def create():
+            match order.type:
+                case OrderType.MARKET:
+                    return await self.place_market_order(order)
+                case OrderType.LIMIT:
+                    return await self.place_limit_order(order)
+                case OrderType.STOP_LIMIT:
+                    return await self.place_stop_limit_order(order)
+                case OrderType.STOP_MARKET:
+                    return await self.place_stop_market_order(order)
+                case OrderType.TAKE_PROFIT_STOP_LOSS:
+                    return await self.place_tpsl_order(order)
+
+        async def find_created(error: BaseException):
+            # The failed attempt may have reached the exchange, retrying blindly could open the position twice
+            try:
+                return await self.find_order(order.symbol, order.clientOrderId)
+            except Exception:
+                raise error
+
+        # Creating an order is not idempotent: it is only retried when it can be looked up by clientOrderId
+        if order.clientOrderId:
+            response = await self.call("place_order", "order", create, before_retry=find_created)
+        else:
+            response = await self.call("place_order", "order", create, policy=NO_RETRY)
+        # ccxt returns its unified order structure as a plain dict
+        if isinstance(response, dict):
+            response = ORDER_JSON.validate_python(response)
+        return response
 
     @abstractmethod
-    async def place_market_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_market_order(self, order: OrderTicket) -> OrderStructure:
         pass
 
     @abstractmethod
-    async def place_limit_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_limit_order(self, order: OrderTicket) -> OrderStructure:
         pass
 
     @abstractmethod
-    async def place_stop_limit_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_stop_limit_order(self, order: OrderTicket) -> OrderStructure:
         pass
 
     @abstractmethod
-    async def place_stop_market_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_stop_market_order(self, order: OrderTicket) -> OrderStructure:
         pass
 
     @abstractmethod
-    async def place_tpsl_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_tpsl_order(self, order: OrderTicket) -> OrderStructure:
         pass
 
     @abstractmethod
@@ -59,22 +179,22 @@ class AbstractExchange(ABC):
         pass
 
 class BitgetExchange(AbstractExchange):
-    def __init__(self, api_key: str, api_secret: str):
-        super().__init__(api_key, api_secret)
-        self.exchange = ccxt.bitget({
-            'apiKey': self.api_key,
-            'secret': self.api_secret,
-        })
+    name = "bitget"
+
+    def __init__(self, api_key: str, api_secret: str, session: aiohttp.ClientSession = None,
+                 rate_limiter: RateLimiter = None):
+        super().__init__(api_key, api_secret, session=session, rate_limiter=rate_limiter)
+        self.exchange = ccxt.bitget(self.ccxt_config())
 
-    async def place_market_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_market_order(self, order: OrderTicket) -> OrderStructure:
         return await self.exchange.create_order(order.symbol, OrderType.MARKET.value, order.side.value, order.amount,
                                            params={'clientOrderId': order.clientOrderId, 'timeInForce': order.timeInForce.value})
     
-    async def place_limit_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_limit_order(self, order: OrderTicket) -> OrderStructure:
         return await self.exchange.create_order(order.symbol, OrderType.LIMIT.value, order.side.value, order.amount, order.price, 
                                                 params={'clientOrderId': order.clientOrderId, 'timeInForce': order.timeInForce.value})
     
-    async def place_stop_limit_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_stop_limit_order(self, order: OrderTicket) -> OrderStructure:
         # if order.positionAction == PositionAction.Close:
         # Validate that there is an open position for the symbol which is stored in Redis
         return await self.exchange.create_order(order.symbol, OrderType.LIMIT.value, order.side.value, order.amount, order.price,
@@ -84,7 +204,7 @@ class BitgetExchange(AbstractExchange):
                                                     'reduceOnly': True if order.positionAction == PositionAction.CLOSE else False
                                                     })                                             
     
-    async def place_stop_market_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_stop_market_order(self, order: OrderTicket) -> OrderStructure:
         return await self.exchange.create_order(order.symbol, OrderType.MARKET.value, order.side.value, order.amount,
                                            params = {'triggerPrice': order.triggerPrice,
                                                     'clientOrderId': order.clientOrderId,
@@ -92,7 +212,7 @@ class BitgetExchange(AbstractExchange):
                                                     'reduceOnly': True if order.positionAction == PositionAction.CLOSE else False
                                                     })
     
-    async def place_tpsl_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_tpsl_order(self, order: OrderTicket) -> OrderStructure:
         """
         Closes the entire amount of the position
         """
@@ -111,26 +231,26 @@ class BitgetExchange(AbstractExchange):
         pass
 
 class BybitExchange(AbstractExchange):
-    def __init__(self, api_key: str, api_secret: str):
-        super().__init__(api_key, api_secret)
-        self.exchange = ccxt.bybit({
-            'apiKey': self.api_key,
-            'secret': self.api_secret,
-    })
+    name = "bybit"
+
+    def __init__(self, api_key: str, api_secret: str, session: aiohttp.ClientSession = None,
+                 rate_limiter: RateLimiter = None):
+        super().__init__(api_key, api_secret, session=session, rate_limiter=rate_limiter)
+        self.exchange = ccxt.bybit(self.ccxt_config())
     
-    async def place_market_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_market_order(self, order: OrderTicket) -> OrderStructure:
         pass
     
-    async def place_limit_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_limit_order(self, order: OrderTicket) -> OrderStructure:
         pass
     
-    async def place_stop_limit_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_stop_limit_order(self, order: OrderTicket) -> OrderStructure:
         pass
     
-    async def place_stop_market_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_stop_market_order(self, order: OrderTicket) -> OrderStructure:
         pass
     
-    async def place_tpsl_order(self, order: PlaceOrderBase) -> OrderStructure:
+    async def place_tpsl_order(self, order: OrderTicket) -> OrderStructure:
         pass
 
     async def get_balance(self) -> dict:
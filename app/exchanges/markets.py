@@ -0,0 +1,164 @@
+import asyncio
+import traceback
+from decimal import ROUND_DOWN, ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, NamedTuple, Optional
+from app.core import config
+from app.core.logging import AsyncLogger
+from app.db.models import OrderTicket
+from app.exchanges.pool import ExchangePool, exchange_pool
+
+# Order fields holding a price, all of them are rounded to the market's tick size
+PRICE_FIELDS = ("price", "triggerPrice", "takeProfit", "stopLoss")
+
+
+class MarketRuleViolation(ValueError):
+    """Raised when an order breaks the trading rules of its market and would be rejected by the exchange."""
+
+
+class MarketRules(NamedTuple):
+    """Trading rules of one market, taken from the ccxt market structure (precision in TICK_SIZE mode)."""
+    symbol: str
+    active: bool
+    price_tick: Optional[Decimal]
+    amount_step: Optional[Decimal]
+    min_amount: Optional[float]
+    max_amount: Optional[float]
+    min_price: Optional[float]
+    max_price: Optional[float]
+    min_cost: Optional[float]
+    contract_size: float
+
+    @classmethod
+    def from_market(cls, market: dict) -> "MarketRules":
+        precision = market.get("precision") or {}
+        limits = market.get("limits") or {}
+
+        def limit(name: str, bound: str) -> Optional[float]:
+            return (limits.get(name) or {}).get(bound)
+
+        def step(value) -> Optional[Decimal]:
+            return Decimal(str(value)) if value else None
+
+        return cls(symbol=market["symbol"], active=market.get("active") is not False,
+                   price_tick=step(precision.get("price")), amount_step=step(precision.get("amount")),
+                   min_amount=limit("amount", "min"), max_amount=limit("amount", "max"),
+                   min_price=limit("price", "min"), max_price=limit("price", "max"), min_cost=limit("cost", "min"),
+                   contract_size=market.get("contractSize") or 1)
+
+
+def round_to_step(value: float, step: Optional[Decimal], rounding: str) -> float:
+    if step is None:
+        return value
+    return float((Decimal(str(value)) / step).quantize(Decimal(1), rounding=rounding) * step)
+
+
+class MarketRulesIndex:
+    """
+    Per exchange, the trading rules of every market keyed by unified symbol and by exchange id, so that
+    orders are checked and rounded locally instead of being rejected by the exchange after a round trip.
+
+    The index is rebuilt whenever the pool holds a newer market snapshot; start() reloads the snapshots
+    every `refresh_interval` seconds. Orders for an exchange whose markets are not loaded yet go through
+    unchecked.
+    """
+
+    def __init__(self, pool: ExchangePool = exchange_pool, refresh_interval: float = config.MARKET_RULES_REFRESH_INTERVAL):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.rejected = 0
+        self._rules: Dict[str, Dict[str, MarketRules]] = {}
+        self._sources: Dict[str, dict] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        self._logger = AsyncLogger().get_logger()
+
+    def stats(self) -> dict:
+        return {"markets": {name: len({rules.symbol for rules in rules_by_symbol.values()})
+                            for name, rules_by_symbol in self._rules.items()},
+                "rejected": self.rejected}
+
+    def get(self, exchange: str, symbol: str) -> Optional[MarketRules]:
+        rules = self._index(exchange)
+        return rules.get(symbol) if rules is not None else None
+
+    def apply(self, order: OrderTicket) -> OrderTicket:
+        """Return the order with price and amount rounded to its market's precision, or raise MarketRuleViolation."""
+        rules_by_symbol = self._index(order.exchange.value)
+        if rules_by_symbol is None:
+            return order
+        try:
+            return self._apply(rules_by_symbol, order)
+        except MarketRuleViolation:
+            self.rejected += 1
+            raise
+
+    async def start(self, names: Iterable[str]) -> None:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh(list(names)))
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    def _index(self, exchange: str) -> Optional[Dict[str, MarketRules]]:
+        snapshot = self.pool.get_markets(exchange)
+        if snapshot is None:
+            return None
+        if self._sources.get(exchange) is not snapshot:
+            rules_by_symbol = {}
+            for market in (snapshot.get("markets") or {}).values():
+                rules = MarketRules.from_market(market)
+                rules_by_symbol[market["symbol"]] = rules
+                if market.get("id"):
+                    rules_by_symbol.setdefault(market["id"], rules)
+            self._rules[exchange] = rules_by_symbol
+            self._sources[exchange] = snapshot
+        return self._rules[exchange]
+
+    @staticmethod
+    def _apply(rules_by_symbol: Dict[str, MarketRules], order: OrderTicket) -> OrderTicket:
+        rules = rules_by_symbol.get(order.symbol)
+        if rules is None:
+            raise MarketRuleViolation(f"Unknown symbol {order.symbol} on {order.exchange.value}.")
+        if not rules.active:
+            raise MarketRuleViolation(f"Market {order.symbol} is not open for trading.")
+
+        # Never trade more than asked: the amount is rounded down, prices to the nearest tick
+        amount = round_to_step(order.amount, rules.amount_step, ROUND_DOWN)
+        if amount <= 0 or (rules.min_amount is not None and amount < rules.min_amount):
+            raise MarketRuleViolation(f"Amount {order.amount} is below the minimum of {rules.min_amount} for {order.symbol}.")
+        if rules.max_amount is not None and amount > rules.max_amount:
+            raise MarketRuleViolation(f"Amount {order.amount} is above the maximum of {rules.max_amount} for {order.symbol}.")
+
+        update = {"amount": amount}
+        for field in PRICE_FIELDS:
+            value = getattr(order, field)
+            if value is None:
+                continue
+            value = round_to_step(value, rules.price_tick, ROUND_HALF_UP)
+            if (rules.min_price is not None and value < rules.min_price) or (rules.max_price is not None and value > rules.max_price):
+                raise MarketRuleViolation(f"{field} {getattr(order, field)} is outside the price range of {order.symbol}.")
+            update[field] = value
+
+        # Market orders carry no price, their notional is left to the exchange
+        price = update.get("price")
+        if price is not None and rules.min_cost is not None and amount * rules.contract_size * price < rules.min_cost:
+            raise MarketRuleViolation(f"Order value is below the minimum of {rules.min_cost} for {order.symbol}.")
+        return order._replace(**update)
+
+    async def _refresh(self, names: list) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.pool.preload_markets(names, reload=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.error(f"Error refreshing market rules: {traceback.format_exc()}")
+
+
+market_rules = MarketRulesIndex()
@@ -0,0 +1,187 @@
+import asyncio
+import ssl
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Tuple
+
+import aiohttp
+import certifi
+
+from app.core import config
+from app.core.lifecycle import after_fork
+from app.core.logging import AsyncLogger
+from app.exchanges.integrations import AbstractExchange
+
+
+class _PooledClient:
+    __slots__ = ("client", "api_secret", "last_used", "leases", "evicted")
+
+    def __init__(self, client: AbstractExchange, api_secret: str):
+        self.client = client
+        self.api_secret = api_secret
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.evicted = False
+
+
+class ExchangePool:
+    """
+    Keeps live exchange clients keyed by (exchange, api_key) so that placing an order reuses an
+    already-configured ccxt instance instead of building a new one per request.
+
+    - All clients of the same exchange share one aiohttp session (keep-alive connections and TLS
+      sessions are reused across accounts) and one copy of the exchange's market metadata.
+    - At most `max_size` clients are kept; the least recently used one is evicted beyond that.
+    - Clients unused for `idle_ttl` seconds are closed on the next checkout.
+    - A client that is evicted while leased is closed only once its last lease is released.
+    """
+
+    def __init__(self, max_size: int = config.EXCHANGE_POOL_MAX_SIZE, idle_ttl: float = config.EXCHANGE_POOL_IDLE_TTL,
+                 factory: Callable[..., AbstractExchange] = AbstractExchange.create,
+                 max_concurrency: int = config.EXCHANGE_MAX_CONCURRENCY):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.max_concurrency = max_concurrency
+        self._factory = factory
+        self._limits: Dict[str, asyncio.Semaphore] = {}
+        self._clients: "OrderedDict[Tuple[str, str], _PooledClient]" = OrderedDict()
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._markets: Dict[str, dict] = {}
+        self._logger = AsyncLogger().get_logger()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "clients": len(self._clients),
+            "leased": sum(1 for entry in self._clients.values() if entry.leases),
+            "sessions": len(self._sessions),
+            "markets_cached": len(self._markets),
+        }
+
+    @asynccontextmanager
+    async def lease(self, name: str, api_key: str, api_secret: str) -> AsyncIterator[AbstractExchange]:
+        """Borrow the client for an account for the duration of the block."""
+        entry = await self._checkout(name, api_key, api_secret)
+        try:
+            yield entry.client
+        finally:
+            entry.leases -= 1
+            entry.last_used = time.monotonic()
+            if name not in self._markets and entry.client.markets_loaded:
+                self._markets[name] = entry.client.export_markets()
+            if entry.evicted and entry.leases == 0:
+                await self._close_client(entry.client)
+
+    async def preload_markets(self, names: Iterable[str], reload: bool = False) -> None:
+        """
+        Load market metadata once per exchange so that no order pays for a cold load_markets(). Exchanges already
+        loaded are skipped unless `reload` is set, as the periodic refresh of the market rules does.
+        """
+        for name in names:
+            if name in self._markets and not reload:
+                # Already loaded, e.g. by the master process before forking this worker
+                continue
+            client = self._factory(name, None, None, session=self._session(name))
+            try:
+                await client.load_markets()
+                self._markets[name] = client.export_markets()
+            except Exception:
+                self._logger.error(f"Error preloading markets for {name}: {traceback.format_exc()}")
+            finally:
+                await self._close_client(client)
+
+    def limit(self, name: str) -> asyncio.Semaphore:
+        """Semaphore bounding the concurrent calls this worker makes to an exchange."""
+        semaphore = self._limits.get(name)
+        if semaphore is None:
+            semaphore = self._limits[name] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    def get_markets(self, name: str) -> dict:
+        return self._markets.get(name)
+
+    async def close(self, keep_markets: bool = False) -> None:
+        entries = list(self._clients.values())
+        self._clients.clear()
+        for entry in entries:
+            await self._close_client(entry.client)
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+        if not keep_markets:
+            self._markets.clear()
+        self._limits.clear()
+
+    def _after_fork(self) -> None:
+        # Clients, sessions and semaphores belong to the parent's event loop; market metadata is plain data
+        # loaded once by the parent and shared with the workers
+        self._clients.clear()
+        self._sessions.clear()
+        self._limits.clear()
+
+    async def _checkout(self, name: str, api_key: str, api_secret: str) -> _PooledClient:
+        to_close = self._expire_idle()
+        key = (name, api_key)
+        entry = self._clients.get(key)
+        if entry is not None and entry.api_secret != api_secret:
+            # The secret was rotated, the old client can no longer sign requests
+            to_close.extend(self._evict(key))
+            entry = None
+
+        if entry is None:
+            client = self._factory(name, api_key, api_secret, session=self._session(name))
+            markets = self._markets.get(name)
+            if markets is not None:
+                client.import_markets(markets)
+            entry = _PooledClient(client, api_secret)
+            self._clients[key] = entry
+            while len(self._clients) > self.max_size:
+                to_close.extend(self._evict(next(iter(self._clients))))
+        else:
+            self._clients.move_to_end(key)
+
+        entry.leases += 1
+        entry.last_used = time.monotonic()
+        for client in to_close:
+            await self._close_client(client)
+        return entry
+
+    def _expire_idle(self) -> List[AbstractExchange]:
+        if not self._clients:
+            return []
+        deadline = time.monotonic() - self.idle_ttl
+        expired = [key for key, entry in self._clients.items() if entry.leases == 0 and entry.last_used < deadline]
+        closed = []
+        for key in expired:
+            closed.extend(self._evict(key))
+        return closed
+
+    def _evict(self, key: Tuple[str, str]) -> List[AbstractExchange]:
+        """Remove a client from the pool, returning it if it can be closed right away."""
+        entry = self._clients.pop(key)
+        entry.evicted = True
+        return [entry.client] if entry.leases == 0 else []
+
+    def _session(self, name: str) -> aiohttp.ClientSession:
+        session = self._sessions.get(name)
+        if session is None or session.closed:
+            context = ssl.create_default_context(cafile=certifi.where())
+            connector = aiohttp.TCPConnector(ssl=context, enable_cleanup_closed=True)
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[name] = session
+        return session
+
+    async def _close_client(self, client: AbstractExchange) -> None:
+        try:
+            await client.close()
+        except Exception:
+            self._logger.error(f"Error closing exchange client: {traceback.format_exc()}")
+
+
+exchange_pool = ExchangePool()
+after_fork(exchange_pool._after_fork)
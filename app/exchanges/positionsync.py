@@ -0,0 +1,191 @@
+import asyncio
+import traceback
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import orjson
+from app.core import config
+from app.core.logging import AsyncLogger
+from app.db.models import ExchangeCredentials, OrderSide, PositionStructure
+from app.db.repositories.userrepository import UserRepository
+from app.db.services.mongodbservice import AsyncMongoDBService
+from app.db.services.redisservice import AsyncRedisService, PositionKey
+from app.db.services.updatehub import update_hub
+from app.exchanges.pool import ExchangePool, exchange_pool
+
+# (user_id, exchange)
+AccountKey = Tuple[str, str]
+
+# ccxt reports position sides as long/short, positions are cached under the side of the order that opened them
+POSITION_SIDES = {"long": OrderSide.BUY.value, "short": OrderSide.SELL.value}
+
+
+def normalize_position(exchange: str, raw: dict) -> Optional[dict]:
+    """Map a ccxt position structure onto the PositionStructure fields; None if the position is closed."""
+    if not raw.get("contracts"):
+        return None
+    position = {field: raw.get(field) for field in PositionStructure.model_fields}
+    position["exchange"] = exchange
+    position["side"] = POSITION_SIDES.get(raw.get("side"), raw.get("side"))
+    return position
+
+
+class PositionFeed(ABC):
+    """Source of position snapshots for one account; every yielded list holds all of its open positions."""
+
+    @abstractmethod
+    def snapshots(self) -> AsyncIterator[List[dict]]:
+        pass
+
+
+class ExchangePositionFeed(PositionFeed):
+    """Streams positions over the exchange's websocket when it supports it, otherwise polls fetch_positions."""
+
+    def __init__(self, account: ExchangeCredentials, pool: ExchangePool = exchange_pool,
+                 poll_interval: float = config.POSITION_SYNC_INTERVAL):
+        self.account = account
+        self.pool = pool
+        self.poll_interval = poll_interval
+
+    async def snapshots(self) -> AsyncIterator[List[dict]]:
+        name = self.account.name.value
+        streaming = False
+        while True:
+            async with self.pool.lease(name, self.account.api_key, self.account.api_secret) as exchange:
+                if streaming:
+                    await exchange.watch_positions()
+                streaming = exchange.supports_position_stream
+                # A stream update may cover a single symbol, re-read the full set to get a consistent snapshot
+                async with self.pool.limit(name):
+                    positions = await exchange.fetch_positions()
+            yield positions
+            if not streaming:
+                await asyncio.sleep(self.poll_interval)
+
+
+class PositionSyncEngine:
+    """
+    Keeps the Redis position cache (see AsyncRedisService) current for every account with exchange
+    credentials. Each account gets a task consuming its PositionFeed; only positions that changed
+    since the previous snapshot are written, and closed positions are removed. Changes reach the
+    /stream clients of every API worker through the update hub, so a single engine serves them all.
+    """
+    RETRY_DELAY = 5.0
+
+    def __init__(self, feed_factory: Callable[[ExchangeCredentials], PositionFeed] = ExchangePositionFeed,
+                 accounts_loader: Callable[[], Awaitable[List[ExchangeCredentials]]] = None,
+                 account_refresh: float = config.POSITION_SYNC_ACCOUNT_REFRESH):
+        self.account_refresh = account_refresh
+        self.updates = 0
+        self._feed_factory = feed_factory
+        self._accounts_loader = accounts_loader or (lambda: UserRepository(AsyncMongoDBService.get_instance()).list_exchange_credentials())
+        self._tasks: Dict[AccountKey, asyncio.Task] = {}
+        self._known: Dict[AccountKey, Dict[str, Tuple[PositionKey, bytes]]] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        self._logger = AsyncLogger().get_logger()
+
+    def stats(self) -> dict:
+        return {"accounts": len(self._tasks), "updates": self.updates}
+
+    async def start(self) -> None:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_accounts())
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        if self._refresher is not None:
+            tasks.append(self._refresher)
+            self._refresher = None
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def track(self, account: ExchangeCredentials) -> None:
+        key = (account.user_id, account.name.value)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._sync_account(account))
+
+    async def untrack(self, key: AccountKey) -> None:
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self._known.pop(key, None)
+
+    async def apply(self, account: ExchangeCredentials, snapshot: List[dict]) -> None:
+        """Write the difference between `snapshot` and the last known positions of the account to Redis."""
+        key = (account.user_id, account.name.value)
+        redis_service = AsyncRedisService()
+        known = self._known.get(key)
+        if known is None:
+            # Positions cached before this process started may have been closed since
+            known = {}
+            for position in await redis_service.get_account_positions(account.user_id):
+                if position["exchange"] == account.name.value:
+                    field = redis_service.position_field(position["exchange"], position["symbol"], position["side"])
+                    known[field] = ((account.user_id, position["exchange"], position["symbol"], position["side"]), orjson.dumps(position))
+
+        current: Dict[str, Tuple[PositionKey, bytes]] = {}
+        changed = []
+        for raw in snapshot:
+            position = normalize_position(account.name.value, raw)
+            if position is None:
+                continue
+            field = redis_service.position_field(position["exchange"], position["symbol"], position["side"])
+            current[field] = ((account.user_id, position["exchange"], position["symbol"], position["side"]), orjson.dumps(position))
+            if field not in known or known[field][1] != current[field][1]:
+                changed.append((account.user_id, position))
+        removed = [position_key for field, (position_key, _) in known.items() if field not in current]
+        if changed or removed:
+            await redis_service.set_positions(changed, removed=removed)
+            self.updates += len(changed) + len(removed)
+            await update_hub.publish_many([(user_id, "position", position) for user_id, position in changed] +
+                                          [(user_id, "position_closed", {"exchange": exchange, "symbol": symbol, "side": side})
+                                           for user_id, exchange, symbol, side in removed])
+        self._known[key] = current
+
+    async def _sync_account(self, account: ExchangeCredentials) -> None:
+        while True:
+            try:
+                async for snapshot in self._feed_factory(account).snapshots():
+                    await self.apply(account, snapshot)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.error(f"Error synchronizing positions of {account.user_id} on {account.name.value}: {traceback.format_exc()}")
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    async def _refresh_accounts(self) -> None:
+        while True:
+            try:
+                accounts = await self._accounts_loader()
+                active = {(account.user_id, account.name.value) for account in accounts}
+                for key in [key for key in self._tasks if key not in active]:
+                    await self.untrack(key)
+                for account in accounts:
+                    self.track(account)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.error(f"Error loading accounts for position sync: {traceback.format_exc()}")
+            await asyncio.sleep(self.account_refresh)
+
+
+position_sync = PositionSyncEngine()
+
+
+async def run() -> None:
+    """Run the position sync as a process of its own: python -m app.exchanges.positionsync"""
+    await position_sync.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await position_sync.stop()
+        await exchange_pool.close()
+        await AsyncRedisService().close()
+        await AsyncMongoDBService.close_instance()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from app.core import config
+from app.core.logging import AsyncLogger
+from app.db.services.redisservice import AsyncRedisService
+
+
+class Limit(NamedTuple):
+    rate: float  # tokens added per second
+    burst: int   # bucket capacity
+
+
+# Buckets per exchange and endpoint class. "account" buckets are keyed by API key (the exchanges' per-UID limits),
+# "exchange" buckets are shared by every worker and account (the per-IP limits, assuming a single egress IP).
+RATE_LIMITS: Dict[str, Dict[str, Dict[str, Limit]]] = {
+    "bitget": {
+        "order": {"account": Limit(10, 10), "exchange": Limit(20, 20)},
+        "private": {"account": Limit(10, 10), "exchange": Limit(20, 20)},
+        "public": {"exchange": Limit(20, 20)},
+    },
+    "bybit": {
+        "order": {"account": Limit(10, 10), "exchange": Limit(120, 120)},
+        "private": {"account": Limit(10, 10), "exchange": Limit(120, 120)},
+        "public": {"exchange": Limit(120, 120)},
+    },
+}
+
+# Takes `cost` tokens from every bucket in KEYS or from none of them. ARGV: cost, then rate and burst of each key.
+# Returns 0 when granted, otherwise the milliseconds until the emptiest bucket holds enough tokens.
+# The clock is Redis' own so that workers on different hosts agree on it.
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1]) or burst
+    local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+    available = math.min(burst, available + elapsed * rate / 1000)
+    tokens[i] = available
+    if available < cost then
+        wait = math.max(wait, math.ceil((cost - available) * 1000 / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    -- Numbers are truncated to integers when passed to redis.call, keep the fraction as a string
+    redis.call('HSET', key, 'tokens', tostring(tokens[i] - cost), 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate) + 1000)
+end
+return 0
+"""
+
+
+class RateLimitExceeded(Exception):
+    """Raised when no token is available for an exchange call and the limiter does not (or can no longer) wait."""
+
+    def __init__(self, bucket: str, retry_after: float):
+        super().__init__(f"Rate limit reached for {bucket}, retry in {retry_after:.3f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token buckets stored in Redis so that every worker draws from the same budget, unlike ccxt's
+    throttle which only spaces out the calls of one client instance. Each call takes a token from the
+    bucket of its account and from the exchange-wide bucket of its endpoint class, atomically.
+
+    When `wait` is set the caller sleeps until tokens are available, up to `max_wait` seconds in total;
+    otherwise RateLimitExceeded is raised right away. If Redis is unreachable calls are let through.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, Dict[str, Limit]]] = RATE_LIMITS, wait: bool = config.RATE_LIMIT_WAIT,
+                 max_wait: float = config.RATE_LIMIT_MAX_WAIT, prefix: str = config.RATE_LIMIT_PREFIX):
+        self.limits = limits
+        self.wait = wait
+        self.max_wait = max_wait
+        self.prefix = prefix
+        self.granted = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.errors = 0
+        self._script = None
+        self._logger = AsyncLogger().get_logger()
+
+    def stats(self) -> dict:
+        return {"granted": self.granted, "throttled": self.throttled, "rejected": self.rejected, "errors": self.errors}
+
+    def buckets(self, exchange: str, endpoint: str, api_key: Optional[str] = None) -> List[Tuple[str, Limit]]:
+        """Redis keys and limits of the buckets a call draws from."""
+        limits = self.limits.get(exchange, {}).get(endpoint, {})
+        buckets = []
+        if api_key and "account" in limits:
+            # Keep API keys out of the Redis keyspace
+            account = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+            buckets.append((f"{self.prefix}:{exchange}:{endpoint}:{account}", limits["account"]))
+        if "exchange" in limits:
+            buckets.append((f"{self.prefix}:{exchange}:{endpoint}", limits["exchange"]))
+        return buckets
+
+    async def acquire(self, exchange: str, endpoint: str, api_key: Optional[str] = None, cost: int = 1,
+                      wait: Optional[bool] = None) -> float:
+        """Take `cost` tokens for a call, returns the seconds spent waiting for them."""
+        buckets = self.buckets(exchange, endpoint, api_key)
+        if not buckets:
+            return 0.0
+        wait = self.wait if wait is None else wait
+        keys = [key for key, _ in buckets]
+        args = [cost]
+        for _, limit in buckets:
+            args.extend((limit.rate, limit.burst))
+
+        started = time.monotonic()
+        while True:
+            try:
+                delay = await self._take(keys, args) / 1000
+            except Exception as e:
+                self.errors += 1
+                self._logger.error("Rate limiter unavailable, letting the call through: {}".format(e))
+                return time.monotonic() - started
+            if delay <= 0:
+                self.granted += 1
+                return time.monotonic() - started
+            waited = time.monotonic() - started
+            if not wait or waited + delay > self.max_wait:
+                self.rejected += 1
+                raise RateLimitExceeded(f"{exchange}:{endpoint}", delay)
+            self.throttled += 1
+            await asyncio.sleep(delay)
+
+    async def _take(self, keys: List[str], args: list) -> int:
+        conn = await AsyncRedisService().get_connection()
+        if self._script is None or self._script.registered_client is not conn:
+            self._script = conn.register_script(TOKEN_BUCKET_SCRIPT)
+        return await self._script(keys=keys, args=args)
+
+
+rate_limiter = RateLimiter()
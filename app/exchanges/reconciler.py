@@ -0,0 +1,318 @@
+import asyncio
+import time
+import traceback
+from datetime import timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import orjson
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener
+from kafka.partitioner.default import murmur2
+from app.core import config
+from app.core.logging import AsyncLogger
+from app.db.models import ExchangeCredentials, OrderStatus
+from app.db.repositories.orderrepository import OrderRepository
+from app.db.repositories.userrepository import UserRepository
+from app.db.services.mongodbservice import AsyncMongoDBService
+from app.db.services.updatehub import update_hub
+from app.exchanges.pool import ExchangePool, exchange_pool
+
+# (user_id, exchange); "user_id:exchange" is the Kafka key of the account's events
+AccountKey = Tuple[str, str]
+
+# ccxt statuses of orders that will not change any more, as OrderStatus spells them
+FINAL_STATUSES = {"closed": OrderStatus.CLOSED.value, "canceled": OrderStatus.CANCELLED.value, "cancelled": OrderStatus.CANCELLED.value,
+                  "expired": OrderStatus.EXPIRED.value, "rejected": OrderStatus.REJECTED.value}
+# Fields of the ccxt order structure copied onto the stored order besides its status
+FILL_FIELDS = ("filled", "remaining", "average", "cost", "lastTradeTimestamp")
+
+
+def partition_for(account: AccountKey, partitions: int) -> int:
+    """Partition the producer's default partitioner (murmur2, like the Java client) sends the account's events to."""
+    return (murmur2(f"{account[0]}:{account[1]}".encode()) & 0x7fffffff) % partitions
+
+
+class PendingOrder(NamedTuple):
+    order_id: Optional[str]
+    client_order_id: str
+    placed_at: int  # ms since the epoch
+    filled: float = 0.0  # as last written
+
+
+def order_changes(pending: PendingOrder, order: dict) -> Optional[dict]:
+    """Fields to write for an order as the exchange reports it, None if nothing changed since the last write."""
+    status = FINAL_STATUSES.get(order.get("status"), order.get("status"))
+    if status is None:
+        return None
+    if status == OrderStatus.OPEN.value and (order.get("filled") or 0.0) == pending.filled:
+        return None
+    changes = {"status": status}
+    changes.update((field, order[field]) for field in FILL_FIELDS if order.get(field) is not None)
+    return changes
+
+
+def default_consumer() -> AIOKafkaConsumer:
+    # Offsets are committed by the reconciler once the events of a poll are tracked
+    return AIOKafkaConsumer(bootstrap_servers=config.KAFKA_URI, group_id=config.RECONCILER_GROUP_ID, enable_auto_commit=False,
+                            auto_offset_reset="earliest", value_deserializer=orjson.loads)
+
+
+class _PartitionListener(ConsumerRebalanceListener):
+    def __init__(self, reconciler: "OrderReconciler"):
+        self.reconciler = reconciler
+
+    async def on_partitions_revoked(self, revoked):
+        self.reconciler.forget({partition.partition for partition in revoked})
+
+    async def on_partitions_assigned(self, assigned):
+        await self.reconciler.assign({partition.partition for partition in assigned})
+
+
+class OrderReconciler:
+    """
+    Consumes orders_submitted and follows every order until the exchange reports it closed, cancelled or
+    expired, writing its status and fills back to MongoDB.
+
+    - Pending orders are grouped per account and symbol. A pass asks the exchange once for the open orders of
+      each group, and once for its closed orders only if some pending order is no longer open, with a `since`
+      cursor at the oldest pending order of the group, instead of making one request per order.
+    - The status changes of a pass go to MongoDB in a single unordered bulk write.
+    - Workers of the same consumer group split the topic's partitions. Events are keyed by account, so all
+      orders of an account are followed by one worker. On assignment a worker also picks up the open orders
+      stored for its partitions' accounts, so committing offsets as soon as events are tracked loses nothing
+      when a worker dies.
+    """
+    RETRY_DELAY = 5.0
+
+    def __init__(self, pool: ExchangePool = exchange_pool,
+                 repository_factory: Callable[[], OrderRepository] = lambda: OrderRepository(AsyncMongoDBService.get_instance()),
+                 credentials_loader: Callable[[Iterable[str]], Awaitable[List[ExchangeCredentials]]] = None,
+                 consumer_factory: Callable[[], AIOKafkaConsumer] = default_consumer, topic: str = config.RECONCILER_TOPIC,
+                 interval: float = config.RECONCILER_INTERVAL, max_records: int = config.RECONCILER_MAX_RECORDS,
+                 since_margin: int = config.RECONCILER_SINCE_MARGIN, max_age: int = config.RECONCILER_MAX_AGE,
+                 credentials_refresh: float = config.RECONCILER_CREDENTIALS_REFRESH):
+        self.pool = pool
+        self.topic = topic
+        self.interval = interval
+        self.max_records = max_records
+        self.since_margin = since_margin
+        self.max_age = max_age
+        self.credentials_refresh = credentials_refresh
+        self.updated = 0
+        self.abandoned = 0
+        self.exchange_calls = 0
+        # account -> symbol -> clientOrderId -> order
+        self.pending: Dict[AccountKey, Dict[str, Dict[str, PendingOrder]]] = {}
+        self._repository_factory = repository_factory
+        self._credentials_loader = credentials_loader or (
+            lambda user_ids: UserRepository(AsyncMongoDBService.get_instance()).list_exchange_credentials(user_ids))
+        self._credentials: Dict[AccountKey, ExchangeCredentials] = {}
+        # Accounts without credentials in the last load, not looked up again until the next scheduled one
+        self._missing_credentials: Set[AccountKey] = set()
+        self._credentials_loaded_at: Optional[float] = None
+        self._credentials_lock = asyncio.Lock()
+        self._consumer_factory = consumer_factory
+        self._consumer: Optional[AIOKafkaConsumer] = None
+        self._tasks: List[asyncio.Task] = []
+        self._logger = AsyncLogger().get_logger()
+
+    def stats(self) -> dict:
+        return {"accounts": len(self.pending),
+                "orders": sum(len(orders) for symbols in self.pending.values() for orders in symbols.values()),
+                "updated": self.updated, "abandoned": self.abandoned, "exchange_calls": self.exchange_calls}
+
+    async def start(self) -> None:
+        if self._consumer is None:
+            self._consumer = self._consumer_factory()
+            self._consumer.subscribe([self.topic], listener=_PartitionListener(self))
+            await self._consumer.start()
+            self._tasks = [asyncio.create_task(self._consume()), asyncio.create_task(self._reconcile_periodically())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._consumer is not None:
+            consumer, self._consumer = self._consumer, None
+            await consumer.stop()
+
+    def track(self, account: AccountKey, symbol: str, order: PendingOrder) -> None:
+        # An order already followed keeps its state, e.g. when its event is delivered again
+        self.pending.setdefault(account, {}).setdefault(symbol, {}).setdefault(order.client_order_id, order)
+
+    def track_event(self, event: dict, timestamp: int) -> None:
+        """Follow the order of an orders_submitted event, `timestamp` (ms) being when it was produced."""
+        try:
+            account = (str(event["userId"]), event["exchange"])
+            self.track(account, event["symbol"], PendingOrder(event.get("orderId"), event["clientOid"], timestamp))
+        except (KeyError, TypeError):
+            self._logger.error(f"Ignoring malformed {self.topic} event: {event}")
+
+    async def assign(self, partitions: Set[int]) -> None:
+        await self.recover(partitions, len(self._consumer.partitions_for_topic(self.topic) or ()))
+
+    def forget(self, partitions: Set[int]) -> None:
+        """Stop following the accounts of partitions this worker lost; their new owner picks the orders up."""
+        partition_count = len(self._consumer.partitions_for_topic(self.topic) or ()) if self._consumer is not None else 0
+        if partition_count:
+            for account in [account for account in self.pending if partition_for(account, partition_count) in partitions]:
+                del self.pending[account]
+
+    async def recover(self, partitions: Optional[Set[int]] = None, partition_count: int = 0) -> None:
+        """
+        Follow the open orders stored in MongoDB, only those of accounts whose events go to `partitions` if given.
+        The partition of an account is the producer's hash, which MongoDB cannot evaluate: the open orders are
+        read off the cursor in batches and filtered here, so that only this worker's share is held in memory.
+        """
+        async for batch in self._repository_factory().stream_open():
+            for document in batch:
+                if "userId" not in document or "symbol" not in document:
+                    continue
+                account = (str(document["userId"]), document["exchange"])
+                if partitions is not None and partition_count and partition_for(account, partition_count) not in partitions:
+                    continue
+                created = document.get("createdAt")
+                # createdAt is stored as naive UTC
+                placed_at = int(created.replace(tzinfo=timezone.utc).timestamp() * 1000) if created else int(time.time() * 1000)
+                self.track(account, document["symbol"],
+                           PendingOrder(document.get("id"), document["clientOrderId"], placed_at, document.get("filled") or 0.0))
+
+    async def reconcile_once(self) -> int:
+        """Check every pending order with the exchange and write what changed; returns the number of orders written."""
+        accounts = list(self.pending)
+        results = await asyncio.gather(*(self._reconcile_account(account) for account in accounts), return_exceptions=True)
+        changes = []
+        for account, result in zip(accounts, results):
+            if isinstance(result, BaseException):
+                self._logger.error(f"Error reconciling the orders of {account[0]} on {account[1]}: {result!r}")
+            else:
+                changes.extend(result)
+
+        updates = {pending.client_order_id: fields for _, _, pending, fields in changes if fields is not None}
+        await self._repository_factory().update_statuses(updates)
+        # Fills and status changes are pushed to the users' open /stream connections
+        await update_hub.publish_many((account[0], "order", dict(fields, id=pending.order_id, clientOrderId=pending.client_order_id,
+                                                                 exchange=account[1], symbol=symbol))
+                                      for account, symbol, pending, fields in changes if fields is not None)
+        # Only once written: orders of a failed write are checked again on the next pass
+        for account, symbol, pending, fields in changes:
+            orders = self.pending.get(account, {}).get(symbol)
+            if orders is None:
+                continue
+            if fields is None:
+                self.abandoned += 1
+                self._logger.warning(f"Order {pending.client_order_id} of {account[0]} on {account[1]} not found, no longer followed")
+                orders.pop(pending.client_order_id, None)
+            elif fields["status"] == OrderStatus.OPEN.value:
+                orders[pending.client_order_id] = pending._replace(filled=fields.get("filled", pending.filled))
+            else:
+                orders.pop(pending.client_order_id, None)
+            if not orders:
+                symbols = self.pending[account]
+                symbols.pop(symbol, None)
+                if not symbols:
+                    del self.pending[account]
+        self.updated += len(updates)
+        return len(updates)
+
+    async def _reconcile_account(self, account: AccountKey) -> List[Tuple[AccountKey, str, PendingOrder, Optional[dict]]]:
+        """(account, symbol, order, fields to write) of the account's orders that changed; fields None to stop following one."""
+        credentials = await self._credentials_for(account)
+        if credentials is None:
+            raise LookupError("no exchange credentials")
+        name = account[1]
+        changes = []
+        cutoff = int(time.time() * 1000) - self.max_age * 1000
+        async with self.pool.limit(name), self.pool.lease(name, credentials.api_key, credentials.api_secret) as exchange:
+            for symbol, orders in list(self.pending.get(account, {}).items()):
+                since = min(order.placed_at for order in orders.values()) - self.since_margin * 1000
+                self.exchange_calls += 1
+                unmatched = self._match(account, symbol, orders, await exchange.fetch_open_orders(symbol, since), changes)
+                if unmatched:
+                    self.exchange_calls += 1
+                    unmatched = self._match(account, symbol, unmatched, await exchange.fetch_closed_orders(symbol, since), changes)
+                changes.extend((account, symbol, order, None) for order in unmatched.values() if order.placed_at < cutoff)
+        return changes
+
+    @staticmethod
+    def _match(account: AccountKey, symbol: str, orders: Dict[str, PendingOrder], reported: List[dict],
+               changes: list) -> Dict[str, PendingOrder]:
+        """Add the changes of the `orders` found in `reported` to `changes`, returns the ones not found."""
+        by_id = {order.get("id"): order for order in reported}
+        by_client_order_id = {order.get("clientOrderId"): order for order in reported}
+        unmatched = {}
+        for client_order_id, pending in orders.items():
+            order = (by_id.get(pending.order_id) if pending.order_id else None) or by_client_order_id.get(client_order_id)
+            if order is None:
+                unmatched[client_order_id] = pending
+                continue
+            fields = order_changes(pending, order)
+            if fields is not None:
+                changes.append((account, symbol, pending, fields))
+        return unmatched
+
+    async def _credentials_for(self, account: AccountKey) -> Optional[ExchangeCredentials]:
+        """
+        The account's credentials. Those of the users this worker follows orders of are reloaded every
+        `credentials_refresh` seconds; in between a user seen for the first time is loaded on its own, and an
+        account still missing then is not looked up again until the next scheduled reload.
+        """
+        # The accounts of a pass are reconciled concurrently, one of them loads for all
+        async with self._credentials_lock:
+            now = time.monotonic()
+            scheduled = self._credentials_loaded_at is None or now - self._credentials_loaded_at >= self.credentials_refresh
+            if scheduled:
+                user_ids = {user_id for user_id, _ in self.pending} | {account[0]}
+                self._credentials = {(credentials.user_id, credentials.name.value): credentials
+                                     for credentials in await self._credentials_loader(user_ids)}
+                self._credentials_loaded_at = now
+                self._missing_credentials.clear()
+            elif account not in self._credentials and account not in self._missing_credentials:
+                for credentials in await self._credentials_loader([account[0]]):
+                    self._credentials[(credentials.user_id, credentials.name.value)] = credentials
+            credentials = self._credentials.get(account)
+            if credentials is None:
+                self._missing_credentials.add(account)
+            return credentials
+
+    async def _consume(self) -> None:
+        while True:
+            try:
+                batches = await self._consumer.getmany(timeout_ms=1000, max_records=self.max_records)
+                for records in batches.values():
+                    for record in records:
+                        self.track_event(record.value, record.timestamp)
+                if batches:
+                    await self._consumer.commit()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.error(f"Error consuming {self.topic}: {traceback.format_exc()}")
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    async def _reconcile_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reconcile_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._logger.error(f"Error reconciling orders: {traceback.format_exc()}")
+
+
+order_reconciler = OrderReconciler()
+
+
+async def run() -> None:
+    """Run the reconciler as a process of its own: python -m app.exchanges.reconciler"""
+    await order_reconciler.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await order_reconciler.stop()
+        await exchange_pool.close()
+        await AsyncMongoDBService.close_instance()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -1,27 +1,165 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.api.endpoints import auth, order, position
-from app.core.logging import AsyncLogger
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from app.api.endpoints import auth, order, position, stream
+from app.core.logging import AsyncLogger, RequestLoggingMiddleware
+from app.auth.password import password_hasher
+from app.db.indexes import ensure_indexes
+from app.db.services.mongodbservice import AsyncMongoDBService
 from app.db.services.redisservice import AsyncRedisService
 from app.db.services.kafkaproducer import KafkaProducer
+from app.db.services.usercache import user_cache
+from app.db.services.tokencache import token_cache
+from app.db.services.outboxrelay import outbox_relay
+from app.db.services.idempotency import idempotency_store
+from app.db.services.updatehub import update_hub
+from app.db.models import Exchange
+from app.exchanges.pool import exchange_pool
+from app.exchanges.positionsync import position_sync
+from app.exchanges.reconciler import order_reconciler
+from app.exchanges.markets import market_rules
+from app.exchanges.ratelimit import rate_limiter
+from app.core.retrytemplate import breaker_stats
+from app.core.metrics import REGISTRY
+from app.core import config
+from app.core.lifecycle import InFlightMiddleware, ResourceContainer, in_flight_requests, shutdown_signal
 
-app = FastAPI()
+EXCHANGES = [exchange.value for exchange in Exchange]
+
+# Set once the master process did the startup work its workers inherit, see preload()
+_preloaded = False
+
+
+async def _ensure_indexes() -> None:
+    try:
+        await ensure_indexes(AsyncMongoDBService.get_instance())
+    except Exception as e:
+        AsyncLogger().get_logger().error("Error while ensuring MongoDB indexes: {}".format(e))
+
+async def _stop_kafka() -> None:
+    # Every buffered message is delivered before the producer goes away
+    await KafkaProducer().flush()
+    await KafkaProducer().stop()
+
+def build_resources() -> ResourceContainer:
+    """The resources of a worker in startup order; they are stopped in reverse order."""
+    resources = ResourceContainer()
+    resources.add("logging", stop=AsyncLogger().flush)
+    resources.add("password_hasher", stop=password_hasher.shutdown)
+    resources.add("redis", start=AsyncRedisService().warm_up, stop=AsyncRedisService().close)
+    # One MongoDB client (and connection pool) per worker; the indexes only need ensuring once
+    resources.add("mongodb", start=None if _preloaded else _ensure_indexes, stop=AsyncMongoDBService.close_instance)
+    # Market metadata is loaded once per exchange and shared by every pooled client
+    resources.add("exchange_pool", start=lambda: exchange_pool.preload_markets(EXCHANGES), stop=exchange_pool.close)
+    # Market rules follow the pool's market snapshots, which are reloaded periodically
+    resources.add("market_rules", start=lambda: market_rules.start(EXCHANGES), stop=market_rules.stop)
+    resources.add("user_cache", start=user_cache.start, stop=user_cache.stop)
+    resources.add("token_cache", start=token_cache.start, stop=token_cache.stop)
+    resources.add("kafka", start=KafkaProducer().start, stop=_stop_kafka)
+    # Stopped before the producer, so that the events stored by the last requests go out
+    resources.add("outbox_relay", start=outbox_relay.start, stop=outbox_relay.stop)
+    if config.POSITION_SYNC_ENABLED:
+        # Keeps the Redis position cache used by has_open_position current. Every worker would poll every account,
+        # so it normally runs as a single process of its own, see app.exchanges.positionsync
+        resources.add("position_sync", start=position_sync.start, stop=position_sync.stop)
+    if config.RECONCILER_ENABLED:
+        # Otherwise run as its own process, see app.exchanges.reconciler
+        resources.add("reconciler", start=order_reconciler.start, stop=order_reconciler.stop)
+    return resources
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Runs in each worker once it serves requests, i.e. after the fork when the master preloaded the app, so that
+    every pool, client and background task belongs to the worker's own process and event loop.
+
+    uvicorn runs the shutdown half only after every connection closed. The /stream connections are therefore ended,
+    and new requests refused, on the exit signal already (see ShutdownSignal); requests still running are waited
+    for by uvicorn, bounded by its --timeout-graceful-shutdown, which should be set (e.g. to SHUTDOWN_DRAIN_TIMEOUT).
+    """
+    logger_instance = AsyncLogger().get_logger()
+    logger_instance.info("Starting up the application...")
+    in_flight_requests.reset()
+    update_hub.reset()
+    shutdown_signal.reset()
+    shutdown_signal.install()
+    resources = build_resources()
+    await resources.start()
+    app.state.resources = resources
+    yield
+    logger_instance.info("Shutting down the application...")
+    # Already done on the exit signal under uvicorn, not with servers that run the lifespan shutdown first
+    await update_hub.stop()
+    remaining = await in_flight_requests.drain(config.SHUTDOWN_DRAIN_TIMEOUT)
+    if remaining:
+        logger_instance.warning(f"Shutting down with {remaining} requests still in flight")
+    # Updates published by the last requests go out before Redis is closed
+    await update_hub.flush()
+    await resources.stop()
+
+
+def preload() -> None:
+    """
+    Startup work done once by the master process when it preloads the app (PRELOAD with gunicorn --preload)
+    instead of by every worker: ensuring the MongoDB indexes and loading the exchanges' market metadata, which the
+    forked workers inherit. Clients opened for it are closed before the fork.
+    """
+    global _preloaded
+
+    async def _preload():
+        await _ensure_indexes()
+        await AsyncMongoDBService.close_instance()
+        await exchange_pool.preload_markets(EXCHANGES)
+        await exchange_pool.close(keep_markets=True)
+
+    asyncio.run(_preload())
+    _preloaded = True
+
+
+# Open /stream connections never finish on their own, and would keep the server waiting for them
+shutdown_signal.on_shutdown(update_hub.close_streams)
+shutdown_signal.on_shutdown(in_flight_requests.stop_accepting)
+
+
+# orjson instead of the stdlib json module for every response an endpoint does not build itself
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.add_middleware(InFlightMiddleware, requests=in_flight_requests)
+app.add_middleware(RequestLoggingMiddleware)
 
 app.include_router(auth.router, prefix="/auth", tags=["authentication"])
 app.include_router(order.router, prefix="/order", tags=["orders"])
 app.include_router(position.router, prefix="/position", tags=["positions"])
+app.include_router(stream.router, tags=["stream"])
 
 
-@app.on_event("startup")
-async def startup_event():
-    logger_instance = AsyncLogger()
-    logger_instance.info("Starting up the application...")
+@app.get("/health", tags=["health"])
+async def health():
+    return {"mongodb": AsyncMongoDBService.get_instance().pool_stats(),
+            "mongodb_writes": AsyncMongoDBService.get_instance().write_stats(),
+            "exchanges": exchange_pool.stats(),
+            "user_cache": user_cache.stats(),
+            "token_cache": token_cache.stats(),
+            "password_hasher": password_hasher.stats(),
+            "kafka": KafkaProducer().stats(),
+            "outbox": outbox_relay.stats(),
+            "position_sync": position_sync.stats(),
+            "reconciler": order_reconciler.stats(),
+            "rate_limiter": rate_limiter.stats(),
+            "circuit_breakers": breaker_stats(),
+            "market_rules": market_rules.stats(),
+            "idempotency": idempotency_store.stats(),
+            "stream": update_hub.stats(),
+            "requests": in_flight_requests.stats(),
+            "logging": AsyncLogger().stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["health"])
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
-    await AsyncRedisService().get_connection()    
-    await KafkaProducer().start()
-    
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    AsyncLogger().info("Shutting down the application...")
-    await AsyncRedisService.close()
-    await KafkaProducer().stop()
\ No newline at end of file
+if config.PRELOAD:
+    preload()
@@ -0,0 +1,17 @@
+"""
+Benchmarks of the FastAPI app against in-process stand-ins for MongoDB, Redis, Kafka and the exchanges.
+
+    python -m benchmarks.run --requests 2000 --concurrency 50 --exchange-latency 0.05 --exchange-error-rate 0.01
+
+See `python -m benchmarks.run --help` for the scenarios, latency/error injection and regression checks.
+"""
+import os
+
+# Settings the app requires; the benchmarks never connect to these services
+for _name, _value in {
+    "MONGODB_URI": "mongodb://benchmark", "MONGODB_DB": "benchmark", "SECRET_KEY": "benchmark", "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30", "CACHE_KEY_FORMAT": "positions:{user_id}", "REDIS_MAX_CONNECTIONS": "10",
+    "REDIS_MIN_CONNECTIONS": "1", "REDIS_HOST": "localhost", "REDIS_PORT": "6379",
+    "SERVICE_NAME": "crypto_trading_service", "KAFKA_URI": "localhost:9092", "LOG_LEVEL": "WARNING",
+}.items():
+    os.environ.setdefault(_name, _value)
@@ -0,0 +1,357 @@
+import asyncio
+import random
+from copy import deepcopy
+from typing import Any, Dict, List, NamedTuple, Optional
+from uuid import uuid4
+import ccxt.async_support as ccxt
+from bson import ObjectId
+from app.db.models import OrderStructure, OrderTicket
+from app.db.services.mongodbservice import AsyncMongoDBService
+from app.exchanges.integrations import AbstractExchange
+from app.exchanges.ratelimit import RateLimiter
+
+
+class Latency(NamedTuple):
+    """Simulated service time of a dependency: `mean` seconds +/- `jitter`, failing with probability `error_rate`."""
+    mean: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    async def wait(self) -> None:
+        delay = self.mean + random.uniform(-self.jitter, self.jitter) if self.jitter else self.mean
+        # sleep(0) still yields to the loop, like real I/O would
+        await asyncio.sleep(max(0.0, delay))
+
+    def fails(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+# MongoDB
+
+def _get(document: dict, path: str) -> Any:
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _set(document: dict, path: str, value: Any) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+
+def _unset(document: dict, path: str) -> None:
+    *parents, last = path.split(".")
+    for part in parents:
+        document = document.get(part) or {}
+    document.pop(last, None)
+
+
+def _matches(document: dict, query: dict) -> bool:
+    """Equality on (dotted) fields plus the $or, $in, $lt and $gt operators used by the repositories."""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(_matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = _get(document, field)
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            for operator, operand in condition.items():
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$lt" and not (value is not None and value < operand):
+                    return False
+                if operator == "$gt" and not (value is not None and value > operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return deepcopy(document)
+    included = {field for field, flag in projection.items() if flag}
+    if projection.get("_id", 1):
+        included.add("_id")
+    return {field: deepcopy(value) for field, value in document.items() if field in included}
+
+
+class FakeMongoDBService(AsyncMongoDBService):
+    """AsyncMongoDBService keeping collections in memory, with the queries and updates the repositories issue."""
+
+    def __init__(self, latency: Latency = Latency()):
+        self.latency = latency
+        self.collections: Dict[str, List[dict]] = {}
+
+    def pool_stats(self) -> Dict[str, int]:
+        return {}
+
+    def write_stats(self) -> Dict[str, Any]:
+        return {}
+
+    async def insert_one(self, collection_name: str, data: Dict[str, Any], write_concern=None) -> Any:
+        await self.latency.wait()
+        document = dict(deepcopy(data), _id=data.get("_id", ObjectId()))
+        self.collections.setdefault(collection_name, []).append(document)
+        return document["_id"]
+
+    async def find_one(self, collection_name: str, filter: Dict[str, Any], projection: Dict[str, Any] = None) -> Dict[str, Any]:
+        documents = await self.find(collection_name, filter, projection, length=1)
+        return documents[0] if documents else None
+
+    async def find(self, collection_name: str, filter: Dict[str, Any], projection: Dict[str, Any] = None, length: Optional[int] = None,
+                   sort: Optional[List] = None) -> List[Dict[str, Any]]:
+        await self.latency.wait()
+        documents = [document for document in self.collections.get(collection_name, []) if _matches(document, filter)]
+        for field, direction in reversed(sort or []):
+            documents.sort(key=lambda document: _get(document, field), reverse=direction < 0)
+        return [_project(document, projection) for document in documents[:length]]
+
+    async def aggregate(self, collection_name: str, pipeline: List[Dict[str, Any]], length: Optional[int] = None) -> List[Dict[str, Any]]:
+        await self.latency.wait()
+        documents = list(self.collections.get(collection_name, []))
+        for stage in pipeline:
+            if "$match" in stage:
+                documents = [document for document in documents if _matches(document, stage["$match"])]
+            elif "$limit" in stage:
+                documents = documents[:stage["$limit"]]
+            elif "$lookup" in stage:
+                lookup = stage["$lookup"]
+                projection = next((inner["$project"] for inner in lookup.get("pipeline", []) if "$project" in inner), None)
+                foreign = self.collections.get(lookup["from"], [])
+                documents = [dict(document, **{lookup["as"]: [
+                    _project(other, projection) for other in foreign if other.get(lookup["foreignField"]) == document.get(lookup["localField"])
+                ]}) for document in documents]
+            elif "$project" in stage:
+                documents = [_project(document, stage["$project"]) for document in documents]
+        return documents[:length]
+
+    async def update_one(self, collection_name: str, filter: Dict[str, Any], update: Dict[str, Any]) -> None:
+        await self._update(collection_name, filter, update, many=False)
+
+    async def update_many(self, collection_name: str, filter: Dict[str, Any], update: Dict[str, Any]) -> int:
+        return await self._update(collection_name, filter, update, many=True)
+
+    async def delete_one(self, collection_name: str, filter: Dict[str, Any]) -> None:
+        await self.latency.wait()
+        documents = self.collections.get(collection_name, [])
+        for index, document in enumerate(documents):
+            if _matches(document, filter):
+                del documents[index]
+                return
+
+    async def close(self) -> None:
+        pass
+
+    async def _update(self, collection_name: str, filter: Dict[str, Any], update: Dict[str, Any], many: bool) -> int:
+        await self.latency.wait()
+        modified = 0
+        for document in self.collections.get(collection_name, []):
+            if _matches(document, filter):
+                for path, value in update.get("$set", {}).items():
+                    _set(document, path, value)
+                for path in update.get("$unset", {}):
+                    _unset(document, path)
+                modified += 1
+                if not many:
+                    break
+        return modified
+
+
+# Redis
+
+class _FakePipeline:
+    def __init__(self, redis: "FakeRedis"):
+        self._redis = redis
+        self._commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self._commands.append((getattr(self._redis, "_" + name), args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        await self._redis.latency.wait()
+        return [command(*args, **kwargs) for command, args, kwargs in self._commands]
+
+
+class FakeRedis:
+    """In-memory redis.asyncio.Redis stand-in for the string, hash and pub/sub commands the app uses."""
+
+    def __init__(self, latency: Latency = Latency()):
+        self.latency = latency
+        self.strings: Dict[str, bytes] = {}
+        self.hashes: Dict[str, Dict[str, bytes]] = {}
+
+    def pipeline(self, transaction: bool = True) -> _FakePipeline:
+        return _FakePipeline(self)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        command = getattr(self, "_" + name)
+
+        async def call(*args, **kwargs):
+            await self.latency.wait()
+            return command(*args, **kwargs)
+        return call
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _get(self, key):
+        return self.strings.get(key)
+
+    def _set(self, key, value, ex=None, nx=False):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = self._encode(value)
+        return True
+
+    def _eval(self, script, numkeys, key, value):
+        # The only script evaluated with EVAL is the compare-and-delete of AsyncRedisService
+        if self.strings.get(key) == self._encode(value):
+            del self.strings[key]
+            return 1
+        return 0
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        values = self.hashes.setdefault(key, {})
+        for name, item in (mapping or {field: value}).items():
+            values[name] = self._encode(item)
+
+    def _hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def _hmget(self, key, fields):
+        return [self._hget(key, field) for field in fields]
+
+    def _hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+    def _hvals(self, key):
+        return list(self.hashes.get(key, {}).values())
+
+    def _publish(self, channel, message):
+        return 0
+
+
+# Kafka
+
+class FakeKafkaBroker:
+    """Stands in for AIOKafkaProducer: send() buffers the message and returns a future acknowledged after `latency`."""
+
+    def __init__(self, latency: Latency = Latency()):
+        self.latency = latency
+        self.messages: List[tuple] = []
+        self._pending = set()
+
+    async def send(self, topic: str, value: Any = None, key: Any = None) -> asyncio.Future:
+        delivery = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._acknowledge(delivery, (topic, key, value)))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return delivery
+
+    async def flush(self) -> None:
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        await self.flush()
+
+    async def _acknowledge(self, delivery: asyncio.Future, message: tuple) -> None:
+        await self.latency.wait()
+        if self.latency.fails():
+            delivery.set_exception(ConnectionError("simulated broker error"))
+        else:
+            self.messages.append(message)
+            delivery.set_result(len(self.messages))
+
+
+# Exchange
+
+class SimulatedExchangeBook:
+    """Orders accepted by the simulated exchange, shared by every client like the real exchange's records."""
+
+    def __init__(self):
+        self.orders: Dict[str, dict] = {}
+
+
+class SimulatedExchange(AbstractExchange):
+    """
+    Exchange client answering after `latency`. Injected errors are network timeouts, half of them after the
+    order was accepted (a lost response), which exercises the retry and clientOrderId lookup path.
+    """
+    name = "bitget"
+
+    def __init__(self, api_key: str, api_secret: str, session=None, latency: Latency = Latency(),
+                 book: SimulatedExchangeBook = None):
+        # The shared limiter is Redis-based; the simulated exchange has no limits to enforce
+        super().__init__(api_key, api_secret, session=session, rate_limiter=RateLimiter(limits={}))
+        self.latency = latency
+        self.book = book if book is not None else SimulatedExchangeBook()
+
+    @property
+    def markets_loaded(self) -> bool:
+        return False
+
+    async def load_markets(self, reload: bool = False) -> dict:
+        return {}
+
+    async def close(self) -> None:
+        pass
+
+    async def find_order(self, symbol: str, client_order_id: str) -> Optional[dict]:
+        await self.latency.wait()
+        return self.book.orders.get(client_order_id)
+
+    async def _create(self, order: OrderTicket) -> dict:
+        await self.latency.wait()
+        failure = self.latency.fails()
+        if failure and random.random() < 0.5:
+            raise ccxt.RequestTimeout("simulated timeout before the order reached the exchange")
+        created = {"id": uuid4().hex, "clientOrderId": order.clientOrderId, "symbol": order.symbol, "type": order.type.value,
+                   "side": order.side.value, "amount": order.amount, "price": order.price, "status": "open"}
+        self.book.orders[order.clientOrderId] = created
+        if failure:
+            raise ccxt.RequestTimeout("simulated timeout after the order was accepted")
+        return created
+
+    async def place_market_order(self, order: OrderTicket) -> OrderStructure:
+        return await self._create(order)
+
+    async def place_limit_order(self, order: OrderTicket) -> OrderStructure:
+        return await self._create(order)
+
+    async def place_stop_limit_order(self, order: OrderTicket) -> OrderStructure:
+        return await self._create(order)
+
+    async def place_stop_market_order(self, order: OrderTicket) -> OrderStructure:
+        return await self._create(order)
+
+    async def place_tpsl_order(self, order: OrderTicket) -> OrderStructure:
+        return await self._create(order)
+
+    async def get_balance(self) -> dict:
+        return {}
+
+    async def set_leverage(self, leverage: int) -> dict:
+        return {}
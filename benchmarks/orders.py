@@ -0,0 +1,101 @@
+"""
+Per-order CPU time and allocations of turning a request body into the order that is sent to the exchange, the way
+it was done before (the body validated by the endpoint and each dependency declaring it, with a `mode='before'`
+validator, then rounded with model_copy) against the current path (validated once into an OrderTicket, rounded
+with _replace).
+
+    python -m benchmarks.orders --number 20000
+"""
+import argparse
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import benchmarks  # noqa: F401  (sets the environment the app reads at import)
+from pydantic import model_validator
+from app.db.models import OrderTicket, OrderType, PlaceOrderBase
+
+# place_order: the endpoint, get_exchange_credentials and get_exchange each declared the body
+VALIDATIONS_BEFORE = 3
+
+
+class BeforeValidatedOrder(PlaceOrderBase):
+    """PlaceOrderBase with the validator it had before, run on the raw input."""
+
+    @model_validator(mode='before')
+    def check_order_validations(cls, values):
+        order_type = values.get("type")
+        amount = values.get("amount")
+        price = values.get("price")
+        trigger_price = values.get("triggerPrice")
+        take_profit = values.get("takeProfit")
+        stop_loss = values.get("stopLoss")
+        if order_type == OrderType.LIMIT and (amount is None or price is None):
+            raise ValueError("For LIMIT order type, both amount and price must be provided.")
+        if order_type == OrderType.MARKET and price is not None:
+            raise ValueError("For MARKET order type, price should not be provided.")
+        if order_type == OrderType.STOP_LIMIT and (amount is None or price is None or trigger_price is None):
+            raise ValueError("For STOP_LIMIT or STOP_MARKET order types, amount, price, and trigger price must all be provided.")
+        if order_type == OrderType.STOP_MARKET and (amount is None or trigger_price is None):
+            raise ValueError("For STOP_MARKET order type, amount and trigger price must be provided.")
+        if order_type == OrderType.TAKE_PROFIT_STOP_LOSS and (take_profit is None and stop_loss is None):
+            raise ValueError("For TAKE_PROFIT_STOP_LOSS order type, takeProfit or stopLoss must be provided.")
+        return values
+
+
+BODY = {"symbol": "BTC/USDT:USDT", "type": "limit", "side": "buy", "amount": 0.0129, "positionAction": "open", "exchange": "bitget",
+        "price": 35000.3, "clientOrderId": "3f5c8bd0a4e84d2f9b9d2c1e0f4a7b6c", "timeInForce": "GTC"}
+ROUNDED = {"amount": 0.012, "price": 35000.5}
+
+
+def before() -> PlaceOrderBase:
+    for _ in range(VALIDATIONS_BEFORE - 1):
+        BeforeValidatedOrder(**BODY)
+    return BeforeValidatedOrder(**BODY).model_copy(update=ROUNDED)
+
+
+def after() -> OrderTicket:
+    return OrderTicket.from_order(PlaceOrderBase(**BODY))._replace(**ROUNDED)
+
+
+class Measurement(NamedTuple):
+    microseconds: float
+    allocated_bytes: float
+
+
+def measure_one(fn: Callable[[], object], number: int, repeat: int = 5) -> Measurement:
+    microseconds = min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+    # Peak memory allocated while building one order, traced separately so that tracing does not distort the timing
+    calls = max(1, number // 10)
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - baseline
+    finally:
+        tracemalloc.stop()
+    return Measurement(microseconds, total / calls)
+
+
+def measure(number: int) -> Dict[str, Tuple[Measurement, Measurement]]:
+    return {"limit_order": (measure_one(before, number), measure_one(after, number))}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the per-order validation cost before and after the order ticket.")
+    parser.add_argument("--number", type=int, default=20000, help="orders per measurement")
+    args = parser.parse_args(argv)
+
+    print(f"{'order':<14}{'before us':>11}{'after us':>11}{'before B':>11}{'after B':>11}")
+    for name, (previous, current) in measure(args.number).items():
+        print(f"{name:<14}{previous.microseconds:>11.2f}{current.microseconds:>11.2f}"
+              f"{previous.allocated_bytes:>11.0f}{current.allocated_bytes:>11.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
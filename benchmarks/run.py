@@ -0,0 +1,241 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional
+from uuid import uuid4
+import benchmarks  # noqa: F401  (sets the environment the app reads at import)
+from bson import ObjectId
+from httpx import AsyncClient, Response
+from app.auth.jwt import create_access_token
+from app.auth.password import get_password_hash
+from app.core import retrytemplate
+from app.db.services.kafkaproducer import KafkaProducer
+from app.db.services.mongodbservice import AsyncMongoDBService
+from app.db.services.outboxrelay import outbox_relay
+from app.db.services.redisservice import AsyncRedisService
+from app.db.services.usercache import user_cache
+from app.db.services.tokencache import token_cache
+from app.exchanges.pool import exchange_pool
+from app.main import app
+from benchmarks.fakes import FakeKafkaBroker, FakeMongoDBService, FakeRedis, Latency, SimulatedExchange, SimulatedExchangeBook
+
+SCENARIOS = ("login", "place_order", "close_position", "tpsl_order")
+PASSWORD = "benchmark-password"
+SYMBOL = "BTCUSDT"
+
+
+class BenchmarkSettings(NamedTuple):
+    requests: int = 1000
+    concurrency: int = 50
+    users: int = 100
+    exchange_latency: Latency = Latency(0.05, 0.02)
+    db_latency: Latency = Latency(0.002, 0.001)
+    redis_latency: Latency = Latency(0.0005)
+    kafka_latency: Latency = Latency(0.005)
+
+
+class ScenarioResult(NamedTuple):
+    scenario: str
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+
+    def row(self) -> str:
+        return (f"{self.scenario:<16}{self.requests:>9}{self.errors:>8}{self.throughput:>12.1f}"
+                f"{self.p50 * 1000:>10.2f}{self.p95 * 1000:>10.2f}{self.p99 * 1000:>10.2f}")
+
+
+HEADER = f"{'scenario':<16}{'requests':>9}{'errors':>8}{'req/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted latencies."""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, max(0, int(round(fraction * len(latencies))) - 1))]
+
+
+class Environment:
+    """The fakes installed in place of the app's dependencies, plus the seeded accounts."""
+
+    def __init__(self, settings: BenchmarkSettings):
+        self.mongo = FakeMongoDBService(settings.db_latency)
+        self.redis = FakeRedis(settings.redis_latency)
+        self.kafka = FakeKafkaBroker(settings.kafka_latency)
+        self.book = SimulatedExchangeBook()
+        self.usernames: List[str] = []
+        self.tokens: Dict[str, str] = {}
+
+    def seed(self, users: int) -> None:
+        # One hash for everyone: hashing is what the login scenario measures, not what seeding should cost
+        hashed_password = get_password_hash(PASSWORD)
+        for index in range(users):
+            user_id = ObjectId()
+            username = f"bench_user_{index}"
+            self.mongo.collections.setdefault("users", []).append(
+                {"_id": user_id, "username": username, "hashed_password": hashed_password, "api_key": "key", "api_secret": "secret"})
+            self.mongo.collections.setdefault("exchange_credentials", []).append(
+                {"_id": ObjectId(), "user_id": user_id, "name": "bitget", "api_key": f"key_{index}", "api_secret": f"secret_{index}"})
+            # An open long on every account, for the position endpoints
+            self.redis.hashes[f"positions:{user_id}"] = {
+                f"bitget:{SYMBOL}:buy": json.dumps({"exchange": "bitget", "symbol": SYMBOL, "side": "buy", "contracts": 1}).encode()}
+            self.usernames.append(username)
+            self.tokens[username] = create_access_token(data={"sub": username})
+
+
+@asynccontextmanager
+async def simulated_environment(settings: BenchmarkSettings) -> AsyncIterator[Environment]:
+    """Swap MongoDB, Redis, Kafka and the exchanges for in-process fakes, and restore the real ones afterwards."""
+    environment = Environment(settings)
+    environment.seed(settings.users)
+    producer = KafkaProducer()
+    saved = (AsyncMongoDBService._shared, AsyncRedisService._connection, producer.producer, exchange_pool._factory,
+             retrytemplate._breakers)
+    # Injected exchange errors can open circuit breakers, which must not outlive the run
+    retrytemplate._breakers = {}
+    AsyncMongoDBService._shared = environment.mongo
+    AsyncRedisService._connection = environment.redis
+    producer.producer = environment.kafka
+    exchange_pool._factory = lambda name, api_key, api_secret, session=None: SimulatedExchange(
+        api_key, api_secret, latency=settings.exchange_latency, book=environment.book)
+    user_cache.clear()
+    token_cache.clear()
+    await outbox_relay.start()
+    try:
+        yield environment
+    finally:
+        await outbox_relay.stop()
+        await environment.kafka.flush()
+        await exchange_pool.close()
+        user_cache.clear()
+        token_cache.clear()
+        (AsyncMongoDBService._shared, AsyncRedisService._connection, producer.producer, exchange_pool._factory,
+         retrytemplate._breakers) = saved
+
+
+def order_payload(order_type: str = "limit", **fields) -> dict:
+    payload = {"symbol": SYMBOL, "type": order_type, "side": "buy", "amount": 0.1, "positionAction": "open", "exchange": "bitget",
+               "price": 35000.0, "clientOrderId": uuid4().hex, "timeInForce": "GTC"}
+    payload.update(fields)
+    return payload
+
+
+def make_request(scenario: str, client: AsyncClient, environment: Environment, index: int) -> Awaitable[Response]:
+    username = environment.usernames[index % len(environment.usernames)]
+    headers = {"Authorization": f"Bearer {environment.tokens[username]}"}
+    if scenario == "login":
+        return client.post("/auth/token", data={"username": username, "password": PASSWORD})
+    if scenario == "place_order":
+        return client.post("/order/place_order/", json=order_payload(), headers=headers)
+    if scenario == "close_position":
+        return client.post("/position/close_position/", json=order_payload(positionAction="close"), headers=headers)
+    if scenario == "tpsl_order":
+        return client.post("/position/tpsl_order/", json=order_payload("tpsl_market", price=None, takeProfit=38000.0, stopLoss=33000.0),
+                           headers=headers)
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+async def run_scenario(scenario: str, client: AsyncClient, environment: Environment, settings: BenchmarkSettings) -> ScenarioResult:
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < settings.requests:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                response = await make_request(scenario, client, environment, index)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(settings.concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return ScenarioResult(scenario, len(latencies), errors, elapsed, len(latencies) / elapsed if elapsed else 0.0,
+                          percentile(latencies, 0.50), percentile(latencies, 0.95), percentile(latencies, 0.99))
+
+
+async def run(settings: BenchmarkSettings, scenarios=SCENARIOS,
+              report: Callable[[ScenarioResult], None] = None) -> List[ScenarioResult]:
+    results = []
+    async with simulated_environment(settings) as environment:
+        async with AsyncClient(app=app, base_url="http://benchmark") as client:
+            for scenario in scenarios:
+                result = await run_scenario(scenario, client, environment, settings)
+                results.append(result)
+                if report is not None:
+                    report(result)
+    return results
+
+
+def regressions(results: List[ScenarioResult], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Scenarios whose p95 or throughput is more than `tolerance` worse than in the baseline."""
+    found = []
+    for result in results:
+        previous = baseline.get(result.scenario)
+        if previous is None:
+            continue
+        if result.p95 > previous["p95"] * (1 + tolerance):
+            found.append(f"{result.scenario}: p95 {result.p95 * 1000:.2f}ms vs {previous['p95'] * 1000:.2f}ms")
+        if result.throughput < previous["throughput"] * (1 - tolerance):
+            found.append(f"{result.scenario}: {result.throughput:.1f} req/s vs {previous['throughput']:.1f} req/s")
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the API against in-process fakes of its dependencies.")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run, repeatable (default: all)")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="requests in flight")
+    parser.add_argument("--users", type=int, default=100, help="accounts the requests are spread over")
+    parser.add_argument("--exchange-latency", type=float, default=0.05, help="seconds per exchange call")
+    parser.add_argument("--exchange-jitter", type=float, default=0.02, help="+/- seconds per exchange call")
+    parser.add_argument("--exchange-error-rate", type=float, default=0.0, help="fraction of exchange calls timing out")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="seconds per MongoDB call")
+    parser.add_argument("--redis-latency", type=float, default=0.0005, help="seconds per Redis command or pipeline")
+    parser.add_argument("--kafka-latency", type=float, default=0.005, help="seconds until the broker acknowledges")
+    parser.add_argument("--seed", type=int, help="random seed for jitter and error injection")
+    parser.add_argument("--json", dest="json_path", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression against the baseline")
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        import random
+        random.seed(args.seed)
+    settings = BenchmarkSettings(
+        requests=args.requests, concurrency=args.concurrency, users=args.users,
+        exchange_latency=Latency(args.exchange_latency, args.exchange_jitter, args.exchange_error_rate),
+        db_latency=Latency(args.db_latency), redis_latency=Latency(args.redis_latency), kafka_latency=Latency(args.kafka_latency))
+
+    print(HEADER)
+    results = asyncio.run(run(settings, args.scenario or SCENARIOS, report=lambda result: print(result.row(), flush=True)))
+
+    if args.json_path:
+        with open(args.json_path, "w") as file:
+            json.dump({result.scenario: result._asdict() for result in results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""
+Per-order serialization cost of the response and cache paths, the way they were built before (dicts run through
+jsonable_encoder and the stdlib json module) against the current one (pydantic-core / orjson straight to bytes).
+
+    python -m benchmarks.serialization --number 20000
+"""
+import argparse
+import json
+import sys
+import timeit
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import benchmarks  # noqa: F401  (sets the environment the app reads at import)
+import orjson
+from fastapi.encoders import jsonable_encoder
+from app.db.models import (ORDER_JSON, ORDER_RESULTS_JSON, POSITION_JSON, Exchange, OrderResult, OrderResultStatus, OrderStructure,
+                           PositionStructure)
+
+
+def sample_order() -> OrderStructure:
+    return OrderStructure(id="1098394857", clientOrderId="3f5c8bd0a4e84d2f9b9d2c1e0f4a7b6c", datetime="2023-10-01T12:00:00.000Z",
+                          timestamp=1696161600000, status="open", symbol="BTC/USDT:USDT", type="limit", timeInForce="GTC",
+                          side="buy", price=35000.0, amount=0.1, filled=0.0, remaining=0.1,
+                          info={"orderId": "1098394857", "clientOid": "3f5c8bd0a4e84d2f9b9d2c1e0f4a7b6c", "state": "new"})
+
+
+def sample_position() -> PositionStructure:
+    return PositionStructure(exchange=Exchange.BITGET, info={"marginCoin": "USDT", "holdSide": "long"}, id="BTCUSDT_UMCBL:long",
+                             symbol="BTC/USDT:USDT", timestamp=1696161600000, datetime="2023-10-01T12:00:00.000Z", isolated=False,
+                             hedged=True, side="long", contracts=1, contractSize=1, entryPrice=35000.0, markPrice=35100.0,
+                             notional=35100.0, leverage=10.0, collateral=3500.0, initialMargin=3500.0, maintenanceMargin=175.0,
+                             initialMarginPercentage=0.1, maintenanceMarginPercentage=0.005, unrealizedPnl=100.0,
+                             liquidationPrice=31800.0, marginMode="crossed", percentage=2.86)
+
+
+def sample_results(size: int = 10) -> List[OrderResult]:
+    return [OrderResult(clientOrderId=f"order-{index}", status=OrderResultStatus.PLACED, id=str(index)) for index in range(size)]
+
+
+class Case(NamedTuple):
+    name: str
+    before: Callable[[], bytes]
+    after: Callable[[], bytes]
+
+
+def cases() -> List[Case]:
+    order, position, results = sample_order(), sample_position(), sample_results()
+    return [
+        Case("order", lambda: json.dumps(jsonable_encoder(order.model_dump(exclude_none=True))).encode(),
+             lambda: ORDER_JSON.dump_json(order, exclude_none=True)),
+        Case("position", lambda: orjson.dumps(position.model_dump(mode="json")),
+             lambda: POSITION_JSON.dump_json(position)),
+        Case("order_results[10]", lambda: json.dumps(jsonable_encoder([result.model_dump(mode="json") for result in results])).encode(),
+             lambda: ORDER_RESULTS_JSON.dump_json(results)),
+        Case("order_ack", lambda: json.dumps(jsonable_encoder({"status": "open"})).encode(),
+             lambda: b'{"status":"open"}'),
+    ]
+
+
+def measure(number: int, repeat: int = 5) -> Dict[str, Tuple[float, float]]:
+    """Best-of-`repeat` microseconds per call of each case, before and after."""
+    timings = {}
+    for case in cases():
+        before = min(timeit.repeat(case.before, number=number, repeat=repeat)) / number * 1e6
+        after = min(timeit.repeat(case.after, number=number, repeat=repeat)) / number * 1e6
+        timings[case.name] = (before, after)
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the per-order serialization cost before and after the fast path.")
+    parser.add_argument("--number", type=int, default=20000, help="calls per measurement")
+    args = parser.parse_args(argv)
+
+    print(f"{'payload':<20}{'before us':>12}{'after us':>12}{'speedup':>10}")
+    for name, (before, after) in measure(args.number).items():
+        print(f"{name:<20}{before:>12.2f}{after:>12.2f}{before / after:>9.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,9 +12,20 @@ from app.db.services.kafkaproducer import KafkaProducer
 from app.db.repositories.userrepository import UserRepository
 from app.db.repositories.orderrepository import OrderRepository
 from app.exchanges.integrations import AbstractExchange
+from app.exchanges.pool import exchange_pool
+from app.db.services.usercache import user_cache
+from app.db.services.tokencache import token_cache
 import json
 
 
+@pytest.fixture(autouse=True)
+def clear_user_cache():
+    user_cache.clear()
+    token_cache.clear()
+    yield
+    user_cache.clear()
+    token_cache.clear()
+
 @pytest.fixture
 def app() -> FastAPI:
     return fastapi_app
@@ -23,6 +34,7 @@ def app() -> FastAPI:
 async def client(app: FastAPI):
     async with AsyncClient(app=app, base_url="http://test") as client:
         yield client
+    await exchange_pool.close()
 
 @pytest.fixture
 def test_user() -> UserInDB:
@@ -44,7 +56,7 @@ def mock_db_service(monkeypatch, test_user:UserInDB) -> AsyncMongoDBService:
     # Mock AsyncIOMotorClient instantiation
     mock_client = MagicMock()
     mock_client.__getitem__.return_value = MagicMock()  # mock database retrieval using indexing
-    monkeypatch.setattr('app.db.services.mongodbservice.AsyncIOMotorClient', lambda x: mock_client)
+    monkeypatch.setattr('app.db.services.mongodbservice.AsyncIOMotorClient', lambda *args, **kwargs: mock_client)
     # monkeypatch.setattr(AsyncMongoDBService, "find_one", _mock_find_one)
     mock_service = AsyncMongoDBService(uri="mock://mockdb", database_name="mockdb")
 
@@ -72,7 +84,7 @@ def mock_create_user(monkeypatch, mock_db_service: AsyncMongoDBService):
 
 @pytest.fixture
 def mock_order_repository_create(monkeypatch, mock_db_service: AsyncMongoDBService):
-    async def _mock_create(order: OrderStructure):
+    async def _mock_create(order: OrderStructure, account: ExchangeCredentials = None, event=None, defaults=None):
         return "mocked_id"
     
     with patch('app.db.repositories.orderrepository.OrderRepository.create', new_callable=AsyncMock, side_effect=_mock_create) as _mocked:
@@ -80,7 +92,7 @@ def mock_order_repository_create(monkeypatch, mock_db_service: AsyncMongoDBServi
 
 @pytest.fixture
 def mock_kafka_producer():
-     async def _mock_send_order(topic: str, order_id: str, client_oid: str):
+     async def _mock_send_order(topic: str, order_id: str, client_oid: str, key: str = None, wait: bool = False):
         return None
      
      with patch('app.db.services.kafkaproducer.KafkaProducer.send_order', new_callable=AsyncMock, side_effect=_mock_send_order) as _mocked:
@@ -193,4 +205,93 @@ def mock_bitget_tpsl_order() -> json:
         "stopLoss": 36000.00,
         "clientOrderId": "test_order_123",
         "timeInForce": TimeInForce.GoodTillCancel            
-    }
\ No newline at end of file
+    }
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        return [getattr(self.redis, "_" + name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakeRedis:
+    """Minimal in-memory stand-in for the commands used by AsyncRedisService."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.strings = {}
+        self.published = []
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def _hset(self, key, field=None, value=None, mapping=None):
+        values = self.hashes.setdefault(key, {})
+        values.update(mapping or {field: value})
+
+    def _hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def _hmget(self, key, fields):
+        return [self._hget(key, field) for field in fields]
+
+    def _hdel(self, key, *fields):
+        for field in fields:
+            self.hashes.get(key, {}).pop(field, None)
+
+    def _hvals(self, key):
+        return list(self.hashes.get(key, {}).values())
+
+    def _get(self, key):
+        return self.strings.get(key)
+
+    def _set(self, key, value, ex=None, nx=False):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value if isinstance(value, bytes) else str(value).encode()
+        return True
+
+    def _eval(self, script, numkeys, key, value):
+        # Only DELETE_IF_EQUALS_SCRIPT is evaluated
+        if self.strings.get(key) == value:
+            del self.strings[key]
+            return 1
+        return 0
+
+    def _publish(self, channel, message):
+        self.published.append((channel, message))
+        return 0
+
+    def __getattr__(self, name):
+        # Commands are the underscored methods; anything else is missing rather than looked up again
+        if name.startswith("_"):
+            raise AttributeError(name)
+        command = getattr(self, "_" + name)
+        async def call(*args, **kwargs):
+            self.round_trips += 1
+            return command(*args, **kwargs)
+        return call
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(AsyncRedisService, "_connection", fake)
+    return fake
@@ -1,6 +1,41 @@
 from app.auth.jwt import verify_password
+from app.auth.password import PasswordHasher, PasswordHasherBusy
+from app.db.models import UserInDB
+from httpx import AsyncClient
+from .conftest import client, mock_get_user
 import pytest
 
+PASSWORD_HASH = "$2b$12$6J66JipbF6ok37vj3LRm.OWsOmomz0v1uuQbawDEOTv/3O4bH1yzK"
+
 def test_verify_password():
-    assert verify_password("password", "$2b$12$6J66JipbF6ok37vj3LRm.OWsOmomz0v1uuQbawDEOTv/3O4bH1yzK")
-    assert not verify_password("wrong_password", "$2b$12$Kb6vlfMV36Qg1T0DDZJP2uGZyHDUxSjtZJN.MEKEYE3iS1wBxM7Ae")
\ No newline at end of file
+    assert verify_password("password", PASSWORD_HASH)
+    assert not verify_password("wrong_password", "$2b$12$Kb6vlfMV36Qg1T0DDZJP2uGZyHDUxSjtZJN.MEKEYE3iS1wBxM7Ae")
+
+@pytest.mark.asyncio
+async def test_password_hasher_verifies_off_loop():
+    hasher = PasswordHasher(workers=2, max_queue=4)
+    try:
+        assert await hasher.verify("password", PASSWORD_HASH)
+        assert not await hasher.verify("wrong_password", PASSWORD_HASH)
+        assert hasher.stats()["completed"] == 2
+        assert hasher.stats()["in_flight"] == 0
+    finally:
+        hasher.shutdown()
+
+@pytest.mark.asyncio
+async def test_password_hasher_rejects_when_queue_full():
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    hasher.pending = 1
+    with pytest.raises(PasswordHasherBusy):
+        await hasher.verify("password", PASSWORD_HASH)
+    assert hasher.rejected == 1
+
+@pytest.mark.asyncio
+async def test_login(client: AsyncClient, test_user: UserInDB, mock_get_user):
+    test_user.hashed_password = PASSWORD_HASH
+    response = await client.post("/auth/token", data={"username": "testuser", "password": "password"})
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "bearer"
+
+    response = await client.post("/auth/token", data={"username": "testuser", "password": "wrong_password"})
+    assert response.status_code == 400
@@ -0,0 +1,55 @@
+import json
+import pytest
+from httpx import AsyncClient
+from app.main import app
+from benchmarks.fakes import Latency
+from benchmarks.run import BenchmarkSettings, ScenarioResult, percentile, regressions, run_scenario, simulated_environment
+
+SETTINGS = BenchmarkSettings(requests=6, concurrency=3, users=2, exchange_latency=Latency(), db_latency=Latency(),
+                             redis_latency=Latency(), kafka_latency=Latency())
+
+
+@pytest.mark.asyncio
+async def test_order_scenarios_run_against_fakes():
+    async with simulated_environment(SETTINGS) as environment:
+        async with AsyncClient(app=app, base_url="http://benchmark") as client:
+            for scenario in ("place_order", "close_position", "tpsl_order"):
+                result = await run_scenario(scenario, client, environment, SETTINGS)
+                assert (result.requests, result.errors) == (6, 0), scenario
+    # The outbox relay drained every stored order to the fake broker on the way out
+    assert len(environment.kafka.messages) == 6
+    assert len(environment.book.orders) == 18
+
+
+@pytest.mark.asyncio
+async def test_exchange_timeouts_do_not_duplicate_orders():
+    settings = SETTINGS._replace(exchange_latency=Latency(error_rate=0.5))
+    async with simulated_environment(settings) as environment:
+        async with AsyncClient(app=app, base_url="http://benchmark") as client:
+            result = await run_scenario("place_order", client, environment, settings)
+    stored = environment.mongo.collections.get("orders", [])
+    assert len({order["clientOrderId"] for order in stored}) == len(stored)
+    # Every order the exchange accepted is recorded at most once, whatever the retries did
+    assert len(stored) <= len(environment.book.orders)
+    assert result.requests == 6
+
+
+def test_percentiles_and_regressions():
+    assert percentile([0.1, 0.2, 0.3, 0.4], 0.5) == 0.2
+    assert percentile([0.1, 0.2, 0.3, 0.4], 0.99) == 0.4
+    result = ScenarioResult("place_order", 100, 0, 1.0, 100.0, 0.01, 0.05, 0.08)
+    assert regressions([result], {"place_order": {"p95": 0.05, "throughput": 100.0}}, 0.2) == []
+    assert len(regressions([result], {"place_order": {"p95": 0.02, "throughput": 200.0}}, 0.2)) == 2
+
+
+def test_fast_serialization_matches_the_previous_output():
+    from benchmarks.serialization import cases, measure
+    for case in cases():
+        assert json.loads(case.before()) == json.loads(case.after()), case.name
+    assert set(measure(number=10, repeat=1)) == {case.name for case in cases()}
+
+
+def test_order_ticket_path_matches_the_previous_one():
+    from benchmarks.orders import after, before, measure
+    assert after()._asdict() == before().model_dump()
+    assert set(measure(number=10)) == {"limit_order"}
@@ -1,8 +1,10 @@
 import pytest
+from unittest.mock import AsyncMock, patch
 from httpx import AsyncClient
 from .conftest import client, mock_redis_no_position, mock_redis_with_position, test_user_token, \
 mock_get_user, mock_bitget_close_position_order, mock_bitget_place_order_response
 from app.db.models import OrderStructure, PlaceOrderBase
+from app.exchanges.ratelimit import RateLimitExceeded
 import json
 
 @pytest.mark.asyncio
@@ -25,3 +27,11 @@ async def test_close_position_unauthenticated(client: AsyncClient, mock_redis_wi
     response = await client.post("/position/close_position/", json=mock_bitget_close_position_order)
     assert response.status_code == 401    
 
+
+@pytest.mark.asyncio
+async def test_close_position_rate_limited(client: AsyncClient, test_user_token:str, mock_get_user, mock_bitget_close_position_order: json, mock_redis_with_position: json):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    with patch('app.exchanges.integrations.BitgetExchange.place_order', new_callable=AsyncMock, side_effect=RateLimitExceeded("bitget", 1.2)):
+        response = await client.post("/position/close_position/", json=mock_bitget_close_position_order, headers=headers)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
@@ -0,0 +1,111 @@
+import pytest
+from unittest.mock import patch
+from app.exchanges.pool import ExchangePool
+
+
+class FakeExchange:
+    def __init__(self, name, api_key, api_secret, session=None):
+        self.name = name
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.session = session
+        self.markets = None
+        self.closed = False
+
+    @property
+    def markets_loaded(self):
+        return bool(self.markets)
+
+    def export_markets(self):
+        return {"markets": self.markets}
+
+    def import_markets(self, markets):
+        self.markets = markets["markets"]
+
+    async def load_markets(self):
+        self.markets = {"BTC/USDT:USDT": {}}
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+async def pool():
+    pool = ExchangePool(max_size=2, idle_ttl=60, factory=FakeExchange)
+    yield pool
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_lease_reuses_client(pool: ExchangePool):
+    async with pool.lease("bitget", "key", "secret") as first:
+        pass
+    async with pool.lease("bitget", "key", "secret") as second:
+        pass
+    assert first is second
+    assert len(pool) == 1
+
+@pytest.mark.asyncio
+async def test_clients_of_an_exchange_share_session(pool: ExchangePool):
+    async with pool.lease("bitget", "key1", "secret") as first, pool.lease("bitget", "key2", "secret") as second:
+        assert first is not second
+        assert first.session is second.session
+
+@pytest.mark.asyncio
+async def test_rotated_secret_replaces_client(pool: ExchangePool):
+    async with pool.lease("bitget", "key", "old") as old:
+        pass
+    async with pool.lease("bitget", "key", "new") as new:
+        pass
+    assert old is not new
+    assert old.closed
+
+@pytest.mark.asyncio
+async def test_lru_eviction(pool: ExchangePool):
+    async with pool.lease("bitget", "key1", "secret") as first:
+        pass
+    async with pool.lease("bitget", "key2", "secret"):
+        pass
+    async with pool.lease("bitget", "key1", "secret"):
+        pass
+    async with pool.lease("bitget", "key3", "secret"):
+        pass
+    # key2 was the least recently used
+    assert ("bitget", "key2") not in pool._clients
+    assert ("bitget", "key1") in pool._clients
+    assert not first.closed
+
+@pytest.mark.asyncio
+async def test_evicted_client_closed_after_release(pool: ExchangePool):
+    async with pool.lease("bitget", "key1", "secret") as leased:
+        async with pool.lease("bitget", "key2", "secret"):
+            pass
+        async with pool.lease("bitget", "key3", "secret"):
+            pass
+        assert not leased.closed
+    assert leased.closed
+
+@pytest.mark.asyncio
+async def test_idle_clients_expire(pool: ExchangePool):
+    with patch("app.exchanges.pool.time.monotonic", return_value=1000):
+        async with pool.lease("bitget", "key1", "secret") as idle:
+            pass
+    with patch("app.exchanges.pool.time.monotonic", return_value=1000 + pool.idle_ttl + 1):
+        async with pool.lease("bitget", "key2", "secret"):
+            pass
+    assert idle.closed
+    assert len(pool) == 1
+
+@pytest.mark.asyncio
+async def test_markets_are_shared(pool: ExchangePool):
+    await pool.preload_markets(["bitget"])
+    async with pool.lease("bitget", "key", "secret") as client:
+        assert client.markets == {"BTC/USDT:USDT": {}}
+
+@pytest.mark.asyncio
+async def test_markets_are_loaded_once_unless_reloaded(pool: ExchangePool):
+    with patch.object(FakeExchange, "load_markets", autospec=True, side_effect=FakeExchange.load_markets) as load_markets:
+        await pool.preload_markets(["bitget"])
+        await pool.preload_markets(["bitget"])
+        assert load_markets.call_count == 1
+        await pool.preload_markets(["bitget"], reload=True)
+        assert load_markets.call_count == 2
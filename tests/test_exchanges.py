@@ -1,8 +1,8 @@
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from app.exchanges.integrations import AbstractExchange, BitgetExchange, BybitExchange, \
-PlaceOrderBase, OrderType, OrderStructure
-from app.db.models import OrderSide, PositionAction, Exchange, TimeInForce
+OrderType, OrderStructure
+from app.db.models import PlaceOrderBase, OrderSide, PositionAction, Exchange, TimeInForce
 
 def test_create_exchange():
     # Test creation of BitgetExchangey
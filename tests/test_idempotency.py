@@ -0,0 +1,75 @@
+import asyncio
+import json
+import pytest
+from httpx import AsyncClient
+from app.db.models import Exchange, ExchangeCredentials, OrderStructure
+from app.db.services.idempotency import DuplicateRequestInProgress, IdempotencyStore
+from .conftest import client, limit_order, test_user_token, mock_get_user, mock_bitget_place_order_response, mock_order_repository_create, mock_kafka_producer, fake_redis, FakeRedis
+
+ACCOUNT = ExchangeCredentials(user_id="test_id", name=Exchange.BITGET, api_key="key", api_secret="secret")
+ORDER = OrderStructure(id="1", clientOrderId="abc")
+
+@pytest.mark.asyncio
+async def test_completed_submission_is_replayed(fake_redis: FakeRedis):
+    store = IdempotencyStore()
+    key = store.key(ACCOUNT, "abc")
+    claim = await store.claim(key)
+    assert claim.owned
+    await store.complete(claim, ORDER)
+
+    duplicate = await store.claim(key)
+    assert duplicate.replayed and not duplicate.owned
+    assert duplicate.result == ORDER
+    assert store.stats()["replayed"] == 1
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicate_waits_for_the_first(fake_redis: FakeRedis):
+    store = IdempotencyStore()
+    key = store.key(ACCOUNT, "abc")
+    first = await store.claim(key)
+    duplicate = asyncio.create_task(store.claim(key))
+    await asyncio.sleep(0)
+    assert not duplicate.done()
+    await store.complete(first, ORDER)
+    assert (await duplicate).result == ORDER
+
+@pytest.mark.asyncio
+async def test_released_claim_can_be_retried(fake_redis: FakeRedis):
+    store = IdempotencyStore()
+    key = store.key(ACCOUNT, "abc")
+    first = await store.claim(key)
+    duplicate = asyncio.create_task(store.claim(key))
+    await asyncio.sleep(0)
+    await store.release(first)
+    retry = await duplicate
+    assert retry.owned and retry.token != first.token
+
+@pytest.mark.asyncio
+async def test_submission_in_flight_on_another_worker(fake_redis: FakeRedis):
+    store = IdempotencyStore(wait_timeout=0.1)
+    key = store.key(ACCOUNT, "abc")
+    fake_redis.strings[key] = IdempotencyStore.PENDING + b"other_worker"
+    with pytest.raises(DuplicateRequestInProgress):
+        await store.claim(key)
+
+@pytest.mark.asyncio
+async def test_duplicate_place_order_reaches_the_exchange_once(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    responses = await asyncio.gather(*(client.post("/order/place_order/", json=limit_order, headers=headers) for _ in range(3)))
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert mock_bitget_place_order_response.call_count == 1
+    assert mock_order_repository_create.call_count == 1
+
+@pytest.mark.asyncio
+async def test_order_that_was_not_stored_is_not_replayed(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure, fake_redis: FakeRedis):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    mock_order_repository_create.side_effect = ConnectionError("mongodb down")
+    with pytest.raises(ConnectionError):
+        await client.post("/order/place_order/", json=limit_order, headers=headers)
+    assert fake_redis.strings == {}
+
+    mock_order_repository_create.side_effect = None
+    response = await client.post("/order/place_order/", json=limit_order, headers=headers)
+    assert response.status_code == 200
+    assert mock_bitget_place_order_response.call_count == 2
+    assert mock_order_repository_create.call_count == 2
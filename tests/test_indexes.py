@@ -0,0 +1,40 @@
+import pytest
+from unittest.mock import AsyncMock
+from app.db.indexes import ensure_indexes, declared_indexes
+from app.db.services.mongodbservice import AsyncMongoDBService
+
+
+def test_declared_indexes():
+    indexes = {collection: [model.document for model in models] for collection, models in declared_indexes().items()}
+    assert indexes["users"][0]["unique"]
+    assert list(indexes["exchange_credentials"][0]["key"]) == ["user_id", "name"]
+    assert indexes["orders"][0]["unique"]
+
+@pytest.mark.asyncio
+async def test_ensure_indexes_creates_missing_and_reports_unused():
+    existing = {
+        "users": {"_id_": {}, "username_unique": {}, "legacy_email": {}},
+        "exchange_credentials": {"_id_": {}},
+        "orders": {"_id_": {}, "clientOrderId_unique": {}, "outbox_pending": {}, "status_open": {},
+                   "user_history": {}},
+    }
+    stats = {
+        "users": [{"name": "_id_", "accesses": {"ops": 0}}, {"name": "username_unique", "accesses": {"ops": 10}},
+                  {"name": "legacy_email", "accesses": {"ops": 0}}],
+        "exchange_credentials": [],
+        "orders": [{"name": "clientOrderId_unique", "accesses": {"ops": 3}}, {"name": "outbox_pending", "accesses": {"ops": 3}},
+                   {"name": "status_open", "accesses": {"ops": 3}}, {"name": "user_history", "accesses": {"ops": 3}}],
+    }
+    mock_service = AsyncMock(spec=AsyncMongoDBService)
+    mock_service.index_information.side_effect = lambda collection: existing[collection]
+    mock_service.aggregate.side_effect = lambda collection, pipeline: stats[collection]
+    mock_service.create_indexes.side_effect = lambda collection, models: [model.document["name"] for model in models]
+
+    report = await ensure_indexes(mock_service)
+
+    mock_service.create_indexes.assert_called_once()
+    assert report["exchange_credentials"].created == ["user_id_name"]
+    assert report["users"].created == []
+    assert report["users"].undeclared == ["legacy_email"]
+    assert report["users"].unused == ["legacy_email"]
+    assert report["orders"].unused == []
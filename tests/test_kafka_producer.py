@@ -0,0 +1,55 @@
+import asyncio
+import orjson
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app.db.services.kafkaproducer import KafkaProducer
+
+
+@pytest.fixture
+def producer(monkeypatch):
+    mock_aiokafka = MagicMock()
+    monkeypatch.setattr('app.db.services.kafkaproducer.AIOKafkaProducer', mock_aiokafka)
+    monkeypatch.setattr(KafkaProducer, "_instance", None)
+    producer = KafkaProducer()
+    # Normally created by start(), in the worker's event loop
+    producer.producer = producer.create_producer()
+    producer.producer.flush = AsyncMock()
+    yield producer, mock_aiokafka
+
+def test_producer_batches_and_serializes_with_orjson(producer):
+    _, mock_aiokafka = producer
+    kwargs = mock_aiokafka.call_args.kwargs
+    assert kwargs["linger_ms"] >= 0
+    assert kwargs["max_batch_size"] > 0
+    assert kwargs["value_serializer"] is orjson.dumps
+    assert kwargs["key_serializer"]("user:bitget") == b"user:bitget"
+
+@pytest.mark.asyncio
+async def test_send_order_returns_before_delivery(producer):
+    kafka_producer, _ = producer
+    delivery = asyncio.get_running_loop().create_future()
+    kafka_producer.producer.send = AsyncMock(return_value=delivery)
+
+    result = await kafka_producer.send_order("orders_submitted", "id1", "cid1", key="user:bitget", wait=False)
+
+    assert result is delivery
+    kafka_producer.producer.send.assert_called_once_with("orders_submitted", value={"orderId": "id1", "clientOid": "cid1"}, key="user:bitget")
+    assert kafka_producer.stats()["pending"] == 1
+
+    delivery.set_result(MagicMock())
+    await asyncio.sleep(0)
+    assert kafka_producer.stats()["pending"] == 0
+    assert kafka_producer.stats()["delivered"] == 1
+
+@pytest.mark.asyncio
+async def test_failed_delivery_is_counted(producer):
+    kafka_producer, _ = producer
+    delivery = asyncio.get_running_loop().create_future()
+    kafka_producer.producer.send = AsyncMock(return_value=delivery)
+
+    await kafka_producer.send_order("orders_submitted", "id1", "cid1", wait=False)
+    delivery.set_exception(ConnectionError("broker down"))
+    await asyncio.sleep(0)
+
+    assert kafka_producer.stats()["failed"] == 1
+    delivery.exception()
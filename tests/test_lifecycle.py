@@ -0,0 +1,109 @@
+import asyncio
+import os
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from httpx import AsyncClient
+from uvicorn import Config, Server
+from app.core.lifecycle import InFlightMiddleware, InFlightRequests, ResourceContainer, ShutdownSignal, in_flight_requests
+from app.db.services.kafkaproducer import KafkaProducer
+from app.db.services.redisservice import AsyncRedisService
+from app.exchanges.pool import exchange_pool
+import app.main as main
+
+
+def recording_container(calls: list, failing_start: str = None, failing_stop: str = None) -> ResourceContainer:
+    def step(name: str, action: str, fails: bool):
+        async def _step():
+            calls.append(f"{action} {name}")
+            if fails:
+                raise RuntimeError(f"{name} failed")
+        return _step
+
+    container = ResourceContainer()
+    for name in ("redis", "mongodb", "kafka"):
+        container.add(name, start=step(name, "start", name == failing_start), stop=step(name, "stop", name == failing_stop))
+    return container
+
+@pytest.mark.asyncio
+async def test_resources_stop_in_reverse_order_despite_errors():
+    calls = []
+    container = recording_container(calls, failing_stop="mongodb")
+    await container.start()
+    assert container.stats() == {"started": ["redis", "mongodb", "kafka"]}
+    await container.stop()
+    assert calls == ["start redis", "start mongodb", "start kafka", "stop kafka", "stop mongodb", "stop redis"]
+    assert container.stats() == {"started": []}
+
+@pytest.mark.asyncio
+async def test_failed_start_stops_what_was_started():
+    calls = []
+    container = recording_container(calls, failing_start="kafka")
+    with pytest.raises(RuntimeError):
+        await container.start()
+    assert calls == ["start redis", "start mongodb", "start kafka", "stop mongodb", "stop redis"]
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_requests_in_flight():
+    requests = InFlightRequests()
+    requests.enter()
+    asyncio.get_running_loop().call_later(0.01, requests.exit)
+    assert await requests.drain(timeout=1) == 0
+    requests.enter()
+    assert await requests.drain(timeout=0.01) == 1
+
+@pytest.mark.asyncio
+async def test_requests_are_refused_while_draining():
+    requests = InFlightRequests()
+    app = FastAPI()
+    app.add_middleware(InFlightMiddleware, requests=requests)
+
+    @app.get("/ping")
+    async def ping():
+        return {"in_flight": requests.count}
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        assert (await client.get("/ping")).json() == {"in_flight": 1}
+        await requests.drain(timeout=0)
+        response = await client.get("/ping")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert requests.stats() == {"in_flight": 0, "draining": True, "refused": 1}
+
+def test_shutdown_signal_fires_on_the_server_exit_signal(monkeypatch):
+    calls = []
+    signal = ShutdownSignal()
+    signal.on_shutdown(lambda: calls.append("close streams"))
+    signal.on_shutdown(lambda: calls.append("stop accepting"))
+    monkeypatch.setattr(Server, "handle_exit", Server.handle_exit)
+    signal.install()
+    signal.install()
+    server = Server(Config(app=FastAPI()))
+    server.handle_exit(15, None)
+    server.handle_exit(15, None)
+    assert server.should_exit
+    assert calls == ["close streams", "stop accepting"]
+
+def test_lifespan_starts_resources_then_drains_and_stops_them(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "build_resources", lambda: recording_container(calls))
+    with TestClient(main.app):
+        assert calls == ["start redis", "start mongodb", "start kafka"]
+    assert calls[3:] == ["stop kafka", "stop mongodb", "stop redis"]
+    assert in_flight_requests.draining
+    in_flight_requests.reset()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_worker_does_not_inherit_clients_of_the_master(monkeypatch):
+    monkeypatch.setattr(AsyncRedisService, "_connection", object())
+    producer = KafkaProducer()
+    monkeypatch.setattr(producer, "producer", object())
+    monkeypatch.setitem(exchange_pool._markets, "bitget", {"BTC/USDT:USDT": {}})
+    monkeypatch.setitem(exchange_pool._sessions, "bitget", object())
+
+    pid = os.fork()
+    if pid == 0:
+        inherited = (AsyncRedisService._connection is not None or KafkaProducer().producer is not None
+                     or "bitget" in exchange_pool._sessions or "bitget" not in exchange_pool._markets)
+        os._exit(1 if inherited else 0)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
@@ -1,8 +1,108 @@
+import io
+import logging
+import time
+import orjson
 import pytest
-from app.core.logging import AsyncLogger
+from httpx import AsyncClient
+from app.core.logging import AsyncLogger, AsyncLogHandler, JSONFormatter, log_context
+from .conftest import client
 
 def test_singleton_logger():
     # Test that the logger is a singleton
     logger1 = AsyncLogger().get_logger()
     logger2 = AsyncLogger().get_logger()
-    assert logger1 == logger2
\ No newline at end of file
+    assert logger1 == logger2
+
+def make_logger(handler: AsyncLogHandler, name: str) -> logging.Logger:
+    handler.setFormatter(JSONFormatter())
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    return logger
+
+def test_records_are_written_in_batches_as_json():
+    stream = io.BytesIO()
+    handler = AsyncLogHandler(stream=stream, batch_size=100, flush_interval=0.01)
+    logger = make_logger(handler, "test_batches")
+    for i in range(5):
+        logger.info("order %s placed", i, extra={"exchange": "bitget", "latency_ms": 1.5})
+    handler.flush()
+    handler.close()
+
+    entries = [orjson.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry["message"] for entry in entries] == [f"order {i} placed" for i in range(5)]
+    assert entries[0]["exchange"] == "bitget"
+    assert entries[0]["latency_ms"] == 1.5
+    assert handler.stats()["written"] == 5
+
+def test_request_context_is_attached():
+    stream = io.BytesIO()
+    handler = AsyncLogHandler(stream=stream)
+    logger = make_logger(handler, "test_context")
+    token = log_context.set({"request_id": "abc", "user": "testuser"})
+    try:
+        logger.warning("slow order")
+    finally:
+        log_context.reset(token)
+    handler.flush()
+    handler.close()
+
+    entry = orjson.loads(stream.getvalue())
+    assert entry["request_id"] == "abc"
+    assert entry["user"] == "testuser"
+
+def test_backpressure_samples_then_drops():
+    handler = AsyncLogHandler(stream=io.BytesIO(), maxsize=10, sample_rate=2)
+    logger = make_logger(handler, "test_backpressure")
+    handler._start_writer()
+    # Stop the writer so that the queue fills up
+    handler._queue.put(None)
+    handler._writer.join()
+    for _ in range(30):
+        logger.info("burst")
+
+    stats = handler.stats()
+    assert stats["sampled_out"] > 0
+    assert stats["dropped"] > 0
+    assert stats["queued"] == 10
+
+@pytest.mark.asyncio
+async def test_request_id_header(client: AsyncClient):
+    response = await client.get("/health", headers={"X-Request-ID": "req-1"})
+    assert response.headers["x-request-id"] == "req-1"
+
+def test_exceptions_are_rendered_by_the_writer():
+    stream = io.BytesIO()
+    handler = AsyncLogHandler(stream=stream)
+    logger = make_logger(handler, "test_exception")
+    try:
+        raise ValueError("rejected")
+    except ValueError:
+        logger.exception("order %s failed", 1)
+    handler.flush()
+    handler.close()
+
+    entry = orjson.loads(stream.getvalue())
+    assert entry["message"] == "order 1 failed"
+    assert "ValueError: rejected" in entry["exception"]
+
+def test_flush_gives_up_on_a_stuck_stream():
+    class StuckStream(io.BytesIO):
+        def write(self, data):
+            time.sleep(1)
+            return super().write(data)
+
+    handler = AsyncLogHandler(stream=StuckStream(), flush_interval=0)
+    logger = make_logger(handler, "test_stuck")
+    logger.info("order placed")
+    started = time.monotonic()
+    handler.flush(timeout=0.05)
+    assert time.monotonic() - started < 0.5
+    handler.close()
+
+def test_json_formatter_returns_str():
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "order %s placed", (1,), None)
+    formatted = JSONFormatter().format(record)
+    assert isinstance(formatted, str)
+    assert orjson.loads(formatted)["message"] == "order 1 placed"
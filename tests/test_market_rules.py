@@ -0,0 +1,71 @@
+import json
+import pytest
+from httpx import AsyncClient
+from app.db.models import Exchange, OrderSide, OrderStructure, OrderType, OrderTicket, PlaceOrderBase, PositionAction
+from app.exchanges.markets import MarketRuleViolation, MarketRulesIndex
+from app.exchanges.pool import exchange_pool
+from .conftest import client, limit_order, test_user_token, mock_get_user, mock_bitget_place_order_response, mock_order_repository_create, mock_kafka_producer
+
+def market_snapshot(**limits) -> dict:
+    market = {
+        "id": "BTCUSDT_UMCBL", "symbol": "BTC/USDT:USDT", "active": True, "contractSize": 1,
+        "precision": {"amount": 0.001, "price": 0.5},
+        "limits": {"amount": {"min": 0.001, "max": 100}, "price": {"min": 1, "max": 1000000}, "cost": {"min": 5}},
+    }
+    market["limits"].update(limits)
+    return {"markets": {"BTC/USDT:USDT": market}}
+
+class FakePool:
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+
+    def get_markets(self, name):
+        return self.snapshot
+
+def order(**fields) -> OrderTicket:
+    values = dict(symbol="BTC/USDT:USDT", type=OrderType.LIMIT, side=OrderSide.BUY, amount=0.0129, price=35000.3,
+                  positionAction=PositionAction.OPEN, exchange=Exchange.BITGET)
+    values.update(fields)
+    return OrderTicket.from_order(PlaceOrderBase(**values))
+
+def test_order_is_rounded_to_market_precision():
+    index = MarketRulesIndex(pool=FakePool(market_snapshot()))
+    rounded = index.apply(order(stopLoss=33000.26))
+    assert rounded.amount == 0.012
+    assert rounded.price == 35000.5
+    assert rounded.stopLoss == 33000.5
+
+@pytest.mark.parametrize("fields, message", [
+    ({"symbol": "ETH/USDT:USDT"}, "Unknown symbol"),
+    ({"amount": 0.0004}, "below the minimum"),
+    ({"amount": 150}, "above the maximum"),
+    ({"price": 0.2}, "outside the price range"),
+    ({"amount": 0.001, "price": 1000}, "Order value"),
+])
+def test_invalid_orders_are_rejected(fields, message):
+    index = MarketRulesIndex(pool=FakePool(market_snapshot()))
+    with pytest.raises(MarketRuleViolation, match=message):
+        index.apply(order(**fields))
+    assert index.stats()["rejected"] == 1
+
+def test_exchange_ids_and_new_snapshots():
+    pool = FakePool(market_snapshot())
+    index = MarketRulesIndex(pool=pool)
+    assert index.get("bitget", "BTCUSDT_UMCBL") is index.get("bitget", "BTC/USDT:USDT")
+    pool.snapshot = market_snapshot(amount={"min": 1})
+    assert index.get("bitget", "BTC/USDT:USDT").min_amount == 1
+    assert index.stats()["markets"] == {"bitget": 1}
+
+def test_orders_pass_unchecked_without_markets():
+    index = MarketRulesIndex(pool=FakePool())
+    unchecked = order(symbol="ANYTHING")
+    assert index.apply(unchecked) is unchecked
+
+@pytest.mark.asyncio
+async def test_place_order_rejected_locally(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure):
+    exchange_pool._markets["bitget"] = market_snapshot()
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    response = await client.post("/order/place_order/", json=dict(limit_order, symbol="BTCUSDT_UMCBL", amount=0.0001), headers=headers)
+    assert response.status_code == 400
+    assert "below the minimum" in response.json()["detail"]
+    mock_bitget_place_order_response.assert_not_called()
@@ -0,0 +1,47 @@
+import json
+import pytest
+from httpx import AsyncClient
+from app.core.logging import log_context
+from app.core.metrics import STAGE_LATENCY, Histogram, Registry, observe_stage, timed
+from app.db.models import OrderStructure
+from .conftest import client, limit_order, test_user_token, mock_get_user, mock_bitget_place_order_response, mock_order_repository_create, mock_kafka_producer
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(Histogram("latency_seconds", "Latency.", ("stage",), buckets=(0.1, 1.0)))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, "exchange_call")
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP latency_seconds Latency.", "# TYPE latency_seconds histogram"]
+    assert 'latency_seconds_bucket{stage="exchange_call",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="exchange_call",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{stage="exchange_call",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{stage="exchange_call"} 6.05' in lines
+    assert 'latency_seconds_count{stage="exchange_call"} 4' in lines
+
+@pytest.mark.asyncio
+async def test_stages_are_labelled_from_the_request_context():
+    @timed("test_stage")
+    async def stage():
+        return "done"
+
+    token = log_context.set({"exchange": "bitget", "order_type": "limit"})
+    try:
+        before = STAGE_LATENCY.count("test_stage", "bitget", "limit")
+        assert await stage() == "done"
+    finally:
+        log_context.reset(token)
+    observe_stage("test_stage", 0.01)
+    assert STAGE_LATENCY.count("test_stage", "bitget", "limit") == before + 1
+    assert STAGE_LATENCY.count("test_stage", "", "") >= 1
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    await client.post("/order/place_order/", json=limit_order, headers=headers)
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    # Authentication runs before the order's exchange is known
+    assert 'stage_latency_seconds_count{stage="jwt_decode",exchange="",order_type=""}' in response.text
+    assert 'stage_latency_seconds_count{stage="redis_set",exchange="bitget",order_type="limit"}' in response.text
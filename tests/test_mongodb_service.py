@@ -0,0 +1,48 @@
+import pytest
+from unittest.mock import MagicMock
+from app.db.services.mongodbservice import AsyncMongoDBService, PoolStatsListener
+
+
+@pytest.fixture
+def mock_motor_client(monkeypatch):
+    created = []
+
+    def _mock_client(*args, **kwargs):
+        client = MagicMock()
+        client.kwargs = kwargs
+        created.append(client)
+        return client
+
+    monkeypatch.setattr('app.db.services.mongodbservice.AsyncIOMotorClient', _mock_client)
+    monkeypatch.setattr(AsyncMongoDBService, "_shared", None)
+    return created
+
+def test_shared_instance_creates_one_client(mock_motor_client):
+    assert AsyncMongoDBService.get_instance() is AsyncMongoDBService.get_instance()
+    assert len(mock_motor_client) == 1
+
+def test_client_uses_pool_settings(mock_motor_client):
+    AsyncMongoDBService.get_instance()
+    kwargs = mock_motor_client[0].kwargs
+    assert {"minPoolSize", "maxPoolSize", "maxIdleTimeMS", "serverSelectionTimeoutMS"} <= kwargs.keys()
+    assert isinstance(kwargs["event_listeners"][0], PoolStatsListener)
+
+@pytest.mark.asyncio
+async def test_close_instance_closes_client(mock_motor_client):
+    AsyncMongoDBService.get_instance()
+    await AsyncMongoDBService.close_instance()
+    mock_motor_client[0].close.assert_called_once()
+    assert AsyncMongoDBService._shared is None
+
+def test_pool_stats_listener():
+    listener = PoolStatsListener()
+    for _ in range(3):
+        listener.connection_created(None)
+    listener.connection_checked_out(None)
+    listener.connection_checked_out(None)
+    listener.connection_checked_in(None)
+    listener.connection_closed(None)
+
+    stats = listener.stats()
+    assert stats["open"] == 2
+    assert stats["in_use"] == 1
@@ -1,7 +1,10 @@
 from httpx import AsyncClient
-from .conftest import client, limit_order, test_user_token, mock_get_user, mock_bitget_place_order_response, mock_order_repository_create, mock_kafka_producer
+from .conftest import client, limit_order, test_user_token, mock_get_user, mock_bitget_place_order_response, mock_order_repository_create, mock_kafka_producer, \
+    fake_redis, FakeRedis, test_user
 
-from app.db.models import PlaceOrderBase, OrderStructure
+from unittest.mock import patch
+from app.db.models import OrderTicket, PlaceOrderBase, OrderStructure
+from app.db.services.updatehub import update_hub
 import pytest
 import json
 
@@ -15,3 +18,69 @@ async def test_place_order_authenticated(client: AsyncClient, test_user_token: s
     headers = {"Authorization": f"Bearer {test_user_token}"}
     response = await client.post("/order/place_order/", data=json.dumps(limit_order), headers=headers)    
     assert response.status_code == 200  # Or whatever status code you expect for a successful order placement
+
+@pytest.mark.asyncio
+async def test_placed_order_is_published_to_the_stream(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure, fake_redis: FakeRedis, test_user):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    publish_errors = update_hub.stats()["publish_errors"]
+    response = await client.post("/order/place_order/", json=limit_order, headers=headers)
+    assert response.status_code == 200
+    await update_hub.flush()
+    [(channel, message)] = fake_redis.published
+    assert channel == update_hub.channel(test_user.id)
+    assert json.loads(message) == {"type": "order", "data": {"id": "mock_id", "clientOrderId": "mock_client_order_id", "exchange": "bitget",
+                                                             "symbol": limit_order["symbol"], "status": "open"}}
+    assert update_hub.stats()["publish_errors"] == publish_errors
+
+@pytest.mark.asyncio
+async def test_place_orders_batch(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    orders = [dict(limit_order, clientOrderId=f"leg_{i}") for i in range(5)]
+    response = await client.post("/order/place_orders/", json=orders, headers=headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["clientOrderId"] for result in results] == [order["clientOrderId"] for order in orders]
+    assert all(result["status"] == "placed" for result in results)
+    assert mock_bitget_place_order_response.call_count == 5
+
+@pytest.mark.asyncio
+async def test_place_orders_partial_failure(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    placed = mock_bitget_place_order_response.side_effect
+
+    async def _fail_second_leg(order, *args, **kwargs):
+        if order.clientOrderId == "leg_1":
+            raise ConnectionError("exchange unavailable")
+        return await placed(order, *args, **kwargs)
+    mock_bitget_place_order_response.side_effect = _fail_second_leg
+
+    orders = [dict(limit_order, clientOrderId=f"leg_{i}") for i in range(3)]
+    response = await client.post("/order/place_orders/", json=orders, headers=headers)
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()] == ["placed", "failed", "placed"]
+    assert response.json()[1]["error"] == "exchange unavailable"
+
+@pytest.mark.asyncio
+async def test_place_orders_validates_whole_batch(client: AsyncClient, test_user_token: str, mock_get_user, limit_order: json, mock_bitget_place_order_response: OrderStructure):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    # Duplicate clientOrderId
+    response = await client.post("/order/place_orders/", json=[limit_order, limit_order], headers=headers)
+    assert response.status_code == 400
+    # No credentials for bybit
+    response = await client.post("/order/place_orders/", json=[limit_order, dict(limit_order, clientOrderId="other", exchange="bybit")], headers=headers)
+    assert response.status_code == 404
+    # One invalid order rejects the batch
+    response = await client.post("/order/place_orders/", json=[limit_order, dict(limit_order, clientOrderId="other", price=None)], headers=headers)
+    assert response.status_code == 422
+    mock_bitget_place_order_response.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_place_order_builds_the_ticket_once(client: AsyncClient, test_user_token: str, mock_get_user, mock_order_repository_create, mock_kafka_producer, limit_order: json, mock_bitget_place_order_response: OrderStructure):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    with patch("app.dependencies.OrderTicket.from_order", side_effect=OrderTicket.from_order) as from_order:
+        response = await client.post("/order/place_order/", json=limit_order, headers=headers)
+    assert response.status_code == 200
+    # The endpoint and its dependencies all share one validated order
+    assert from_order.call_count == 1
+    placed = mock_bitget_place_order_response.call_args.args[0]
+    assert isinstance(placed, OrderTicket) and placed.clientOrderId == limit_order["clientOrderId"]
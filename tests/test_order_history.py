@@ -0,0 +1,72 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+from bson import ObjectId
+from httpx import AsyncClient
+from unittest.mock import AsyncMock, patch
+from .conftest import client, test_user_token, mock_get_user
+from app.db.repositories.orderrepository import OrderRepository, decode_cursor, encode_cursor
+
+
+def stored_orders(count: int) -> list:
+    created = datetime(2023, 11, 14, 12)
+    return [{"_id": ObjectId(), "id": f"id{number}", "clientOrderId": f"coid{number}", "symbol": "BTCUSDT", "status": "open",
+             "exchange": "bitget", "createdAt": created - timedelta(minutes=number)} for number in range(count)]
+
+
+def test_cursor_round_trip():
+    document = stored_orders(1)[0]
+    assert decode_cursor(encode_cursor(document)) == (document["createdAt"], document["_id"])
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
+
+def test_history_filter_continues_after_the_cursor():
+    created_at, last_id = datetime(2023, 11, 14), ObjectId()
+    query = OrderRepository.history_filter("user1", symbol="BTCUSDT", end=datetime(2023, 11, 15), after=(created_at, last_id))
+    assert query["userId"] == "user1" and query["symbol"] == "BTCUSDT"
+    assert query["createdAt"] == {"$lt": datetime(2023, 11, 15)}
+    assert query["$or"] == [{"createdAt": {"$lt": created_at}}, {"createdAt": created_at, "_id": {"$lt": last_id}}]
+
+@pytest.mark.asyncio
+async def test_history_page(client: AsyncClient, test_user_token: str, mock_get_user):
+    documents = stored_orders(3)
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    with patch('app.db.services.mongodbservice.AsyncMongoDBService.find', new_callable=AsyncMock,
+               return_value=[dict(document) for document in documents]) as find:
+        response = await client.get("/order/history", params={"limit": 2, "symbol": "BTCUSDT", "fields": "id,status"}, headers=headers)
+    assert response.status_code == 200
+    page = response.json()
+    # Paging fields the client did not ask for are dropped
+    assert [order["id"] for order in page["orders"]] == ["id0", "id1"]
+    assert not any("_id" in order or "createdAt" in order for order in page["orders"])
+    assert decode_cursor(page["next_cursor"]) == (documents[1]["createdAt"], documents[1]["_id"])
+    _, query, projection = find.await_args.args
+    assert query == {"userId": "test_id", "symbol": "BTCUSDT"}
+    assert projection == {"id": 1, "status": 1, "createdAt": 1}
+    assert find.await_args.kwargs["length"] == 3
+
+@pytest.mark.asyncio
+async def test_history_rejects_unknown_fields_and_bad_cursors(client: AsyncClient, test_user_token: str, mock_get_user):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    with patch('app.db.services.mongodbservice.AsyncMongoDBService.find', new_callable=AsyncMock) as find:
+        assert (await client.get("/order/history", params={"fields": "id,api_secret"}, headers=headers)).status_code == 400
+        assert (await client.get("/order/history", params={"cursor": "garbage"}, headers=headers)).status_code == 400
+    find.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_history_streams_ndjson(client: AsyncClient, test_user_token: str, mock_get_user):
+    documents = stored_orders(5)
+
+    async def _iterate(collection_name, filter, projection=None, sort=None, batch_size=500):
+        for start in range(0, len(documents), 2):
+            yield documents[start:start + 2]
+
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    with patch('app.db.services.mongodbservice.AsyncMongoDBService.iterate', side_effect=_iterate):
+        response = await client.get("/order/history", params={"format": "ndjson"}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["clientOrderId"] for line in lines] == [f"coid{number}" for number in range(5)]
+    assert lines[0]["createdAt"] == "2023-11-14T12:00:00+00:00"
+    assert "_id" not in lines[0]
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from app.db.models import ORDER_JSON, OrderStructure, ExchangeCredentials, Exchange, OutboxEvent
+from app.db.repositories.orderrepository import OrderRepository
+from app.db.services.kafkaproducer import KafkaProducer
+from app.db.services.mongodbservice import AsyncMongoDBService
+from app.db.services.outboxrelay import OutboxRelay
+
+
+@pytest.mark.asyncio
+async def test_create_writes_order_and_event_in_one_insert():
+    mock_service = AsyncMock(spec=AsyncMongoDBService)
+    repository = OrderRepository(mock_service)
+    account = ExchangeCredentials(user_id="user1", name=Exchange.BITGET, api_key="key", api_secret="secret")
+    event = OutboxEvent(topic="orders_submitted", key="user1:bitget", payload={"orderId": "1"})
+
+    await repository.create(OrderStructure(id="1", clientOrderId="cid1", symbol="BTCUSDT"), account=account, event=event)
+
+    mock_service.insert_one.assert_called_once()
+    collection, document = mock_service.insert_one.call_args.args
+    assert collection == OrderRepository.ORDER_COLLECTION_NAME
+    assert document["clientOrderId"] == "cid1"
+    assert document["userId"] == "user1"
+    assert document["outbox"]["published"] is False
+    assert document["outbox"]["payload"] == {"orderId": "1"}
+    assert mock_service.insert_one.call_args.kwargs["write_concern"].document["w"] == "majority"
+
+
+@pytest.fixture
+def mock_producer(monkeypatch):
+    producer = MagicMock()
+    monkeypatch.setattr(KafkaProducer, "_instance", producer)
+    return producer
+
+@pytest.mark.asyncio
+async def test_relay_publishes_batch_and_marks_delivered(mock_producer):
+    loop = asyncio.get_running_loop()
+    delivered, failed = loop.create_future(), loop.create_future()
+    delivered.set_result(None)
+    failed.set_exception(ConnectionError("broker down"))
+    mock_producer.send = AsyncMock(side_effect=[delivered, failed])
+
+    repository = AsyncMock(spec=OrderRepository)
+    repository.claim_outbox.return_value = [
+        {"_id": 1, "outbox": {"topic": "orders_submitted", "key": "a", "payload": {"orderId": "1"}}},
+        {"_id": 2, "outbox": {"topic": "orders_submitted", "key": "b", "payload": {"orderId": "2"}}},
+    ]
+    relay = OutboxRelay(repository_factory=lambda: repository, batch_size=10)
+
+    assert await relay.relay_once() == 2
+
+    mock_producer.send.assert_any_call("orders_submitted", {"orderId": "1"}, key="a", wait=False)
+    repository.mark_published.assert_called_once_with([1])
+    assert relay.stats() == {"published": 1, "failed": 1}
+
+@pytest.mark.asyncio
+async def test_relay_without_pending_events(mock_producer):
+    repository = AsyncMock(spec=OrderRepository)
+    repository.claim_outbox.return_value = []
+    relay = OutboxRelay(repository_factory=lambda: repository)
+
+    assert await relay.relay_once() == 0
+    repository.mark_published.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_order_document_is_built_by_the_shared_serializer():
+    db_service = AsyncMock()
+    order = OrderStructure(id="id1", clientOrderId="coid1")
+    account = ExchangeCredentials(user_id="user1", name=Exchange.BITGET, api_key="key", api_secret="secret")
+    with patch.object(ORDER_JSON, "dump_python", wraps=ORDER_JSON.dump_python) as dump_python:
+        await OrderRepository(db_service).create(order, account=account, defaults={"symbol": "BTCUSDT", "status": "open"})
+    dump_python.assert_called_once_with(order, exclude_none=True)
+    document = db_service.insert_one.await_args.args[1]
+    assert document["id"] == "id1" and document["symbol"] == "BTCUSDT" and document["userId"] == "user1"
+    assert "price" not in document
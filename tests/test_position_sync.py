@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from typing import AsyncIterator, List
+from app.db.models import ExchangeCredentials, Exchange
+from app.exchanges.positionsync import PositionFeed, PositionSyncEngine, normalize_position
+from .conftest import FakeRedis, fake_redis
+
+
+class LocalPositionFeed(PositionFeed):
+    """Stand-in for an exchange feed, replays the snapshots pushed onto its queue."""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def snapshots(self) -> AsyncIterator[List[dict]]:
+        while True:
+            yield await self.queue.get()
+            self.queue.task_done()
+
+
+def ccxt_position(symbol: str, side: str = "long", contracts: float = 1, mark_price: float = 36000.0) -> dict:
+    return {"info": {}, "id": None, "symbol": symbol, "side": side, "contracts": contracts, "contractSize": 1,
+            "entryPrice": 35000.0, "markPrice": mark_price, "marginMode": "cross", "unrealizedPnl": 10.0}
+
+account = ExchangeCredentials(user_id="user1", name=Exchange.BITGET, api_key="key", api_secret="secret")
+
+def test_normalize_position():
+    position = normalize_position("bitget", ccxt_position("BTC/USDT:USDT", side="short"))
+    assert position["side"] == "sell"
+    assert position["exchange"] == "bitget"
+    assert normalize_position("bitget", ccxt_position("BTC/USDT:USDT", contracts=0)) is None
+
+@pytest.mark.asyncio
+async def test_engine_streams_feed_into_redis(fake_redis: FakeRedis):
+    feed = LocalPositionFeed()
+
+    async def load_accounts():
+        return [account]
+    engine = PositionSyncEngine(feed_factory=lambda _: feed, accounts_loader=load_accounts)
+    await engine.start()
+    try:
+        await feed.queue.put([ccxt_position("BTC/USDT:USDT"), ccxt_position("ETH/USDT:USDT", side="short")])
+        await feed.queue.join()
+        assert set(fake_redis.hashes["positions:user1"]) == {"bitget:BTC/USDT:USDT:buy", "bitget:ETH/USDT:USDT:sell"}
+
+        writes = fake_redis.round_trips
+        # Unchanged snapshot: nothing is written
+        await feed.queue.put([ccxt_position("BTC/USDT:USDT"), ccxt_position("ETH/USDT:USDT", side="short")])
+        await feed.queue.join()
+        assert fake_redis.round_trips == writes
+
+        # One position moved, the other was closed
+        await feed.queue.put([ccxt_position("BTC/USDT:USDT", mark_price=37000.0)])
+        await feed.queue.join()
+        assert list(fake_redis.hashes["positions:user1"]) == ["bitget:BTC/USDT:USDT:buy"]
+        assert engine.stats()["accounts"] == 1
+    finally:
+        await engine.stop()
+
+@pytest.mark.asyncio
+async def test_first_snapshot_removes_stale_positions(fake_redis: FakeRedis):
+    engine = PositionSyncEngine(feed_factory=lambda _: LocalPositionFeed())
+    await engine.apply(account, [ccxt_position("BTC/USDT:USDT")])
+
+    # A new engine (e.g. after a restart) sees that the position was closed in the meantime
+    await PositionSyncEngine(feed_factory=lambda _: LocalPositionFeed()).apply(account, [])
+    assert fake_redis.hashes["positions:user1"] == {}
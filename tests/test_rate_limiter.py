@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.db.models import Exchange, OrderSide, OrderType, PlaceOrderBase, PositionAction, TimeInForce
+from app.exchanges.integrations import BitgetExchange
+from app.exchanges.ratelimit import Limit, RateLimiter, RateLimitExceeded
+
+LIMITS = {"bitget": {"order": {"account": Limit(10, 10), "exchange": Limit(20, 20)}, "public": {"exchange": Limit(20, 20)}}}
+
+def make_limiter(replies, **kwargs) -> RateLimiter:
+    limiter = RateLimiter(limits=LIMITS, **kwargs)
+    limiter._take = AsyncMock(side_effect=replies)
+    return limiter
+
+def test_buckets_are_keyed_per_account_and_exchange():
+    limiter = RateLimiter(limits=LIMITS, prefix="rl")
+    buckets = limiter.buckets("bitget", "order", "my_api_key")
+    assert [limit for _, limit in buckets] == [Limit(10, 10), Limit(20, 20)]
+    assert buckets[0][0].startswith("rl:bitget:order:") and "my_api_key" not in buckets[0][0]
+    assert buckets[1][0] == "rl:bitget:order"
+    # Public endpoints only have an exchange-wide bucket
+    assert [key for key, _ in limiter.buckets("bitget", "public", "my_api_key")] == ["rl:bitget:public"]
+    assert limiter.buckets("unknown", "order", "my_api_key") == []
+
+@pytest.mark.asyncio
+async def test_waits_for_tokens():
+    limiter = make_limiter([20, 0], wait=True, max_wait=1.0)
+    waited = await limiter.acquire("bitget", "order", "my_api_key")
+    assert waited >= 0.02
+    assert limiter._take.await_count == 2
+    assert limiter.stats()["throttled"] == 1 and limiter.stats()["granted"] == 1
+
+@pytest.mark.asyncio
+async def test_fails_fast():
+    limiter = make_limiter([250], wait=False)
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await limiter.acquire("bitget", "order", "my_api_key")
+    assert exc_info.value.retry_after == 0.25
+    assert limiter.stats()["rejected"] == 1
+
+@pytest.mark.asyncio
+async def test_gives_up_beyond_max_wait():
+    limiter = make_limiter([5000], wait=True, max_wait=1.0)
+    with pytest.raises(RateLimitExceeded):
+        await limiter.acquire("bitget", "order", "my_api_key")
+
+@pytest.mark.asyncio
+async def test_lets_calls_through_when_redis_is_down():
+    limiter = make_limiter(ConnectionError("redis down"))
+    assert await limiter.acquire("bitget", "order", "my_api_key") >= 0
+    assert limiter.stats()["errors"] == 1
+
+@pytest.mark.asyncio
+async def test_exchange_takes_a_token_before_placing_an_order():
+    limiter = make_limiter([0])
+    bitget = BitgetExchange("test_key", "test_secret", rate_limiter=limiter)
+    assert bitget.exchange.enableRateLimit is False
+    order = PlaceOrderBase(symbol="BTCUSDT", type=OrderType.MARKET, side=OrderSide.BUY, amount=1, clientOrderId="test123",
+                           exchange=Exchange.BITGET, positionAction=PositionAction.OPEN, timeInForce=TimeInForce.GoodTillCancel)
+    with patch("app.exchanges.integrations.ccxt.bitget.create_order", new_callable=AsyncMock,
+               return_value={"id": "1", "clientOrderId": "test123"}):
+        await bitget.place_order(order)
+    keys = limiter._take.await_args.args[0]
+    assert keys[1] == "ratelimit:bitget:order"
@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+from contextlib import asynccontextmanager
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+from app.db.models import Exchange, ExchangeCredentials
+from app.exchanges.reconciler import OrderReconciler, PendingOrder, order_changes, partition_for
+
+account = ExchangeCredentials(user_id="user1", name=Exchange.BITGET, api_key="key", api_secret="secret")
+
+
+class FakePool:
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def limit(self, name):
+        return asyncio.Semaphore(10)
+
+    @asynccontextmanager
+    async def lease(self, name, api_key, api_secret):
+        yield self.exchange
+
+
+def ccxt_order(order_id: str, client_order_id: str, status: str = "open", filled: float = 0.0) -> dict:
+    return {"id": order_id, "clientOrderId": client_order_id, "symbol": "BTC/USDT:USDT", "status": status, "filled": filled,
+            "remaining": 1.0 - filled, "average": 35000.0 if filled else None}
+
+
+def event(number: int, symbol: str = "BTCUSDT") -> dict:
+    return {"orderId": f"id{number}", "clientOid": f"coid{number}", "userId": "user1", "exchange": "bitget", "symbol": symbol}
+
+
+def reconciler(exchange, repository) -> OrderReconciler:
+    async def load_credentials(user_ids):
+        return [account]
+    return OrderReconciler(pool=FakePool(exchange), repository_factory=lambda: repository, credentials_loader=load_credentials)
+
+
+def test_order_changes():
+    pending = PendingOrder("id1", "coid1", 0)
+    assert order_changes(pending, ccxt_order("id1", "coid1")) is None
+    assert order_changes(pending, ccxt_order("id1", "coid1", filled=0.5))["filled"] == 0.5
+    assert order_changes(pending, ccxt_order("id1", "coid1", status="canceled"))["status"] == "cancelled"
+
+@pytest.mark.asyncio
+async def test_orders_of_a_symbol_are_reconciled_with_one_call_per_status():
+    exchange = MagicMock()
+    exchange.fetch_open_orders = AsyncMock(return_value=[ccxt_order("id1", "coid1"), ccxt_order("id2", "coid2", filled=0.4)])
+    exchange.fetch_closed_orders = AsyncMock(return_value=[ccxt_order("id3", "coid3", status="closed", filled=1.0)])
+    repository = MagicMock()
+    repository.update_statuses = AsyncMock(return_value=2)
+    engine = reconciler(exchange, repository)
+    for number in (1, 2, 3):
+        engine.track_event(event(number), timestamp=1_700_000_000_000 + number)
+
+    assert await engine.reconcile_once() == 2
+
+    exchange.fetch_open_orders.assert_awaited_once_with("BTCUSDT", 1_700_000_000_001 - engine.since_margin * 1000)
+    exchange.fetch_closed_orders.assert_awaited_once()
+    updates = repository.update_statuses.await_args.args[0]
+    assert set(updates) == {"coid2", "coid3"}
+    assert updates["coid3"]["status"] == "closed"
+    # The closed order is no longer followed, the partly filled one is with its new fill
+    assert engine.pending[("user1", "bitget")]["BTCUSDT"].keys() == {"coid1", "coid2"}
+    assert engine.pending[("user1", "bitget")]["BTCUSDT"]["coid2"].filled == 0.4
+
+    # Nothing changed since: no write, and no closed orders lookup
+    exchange.fetch_open_orders.return_value = [ccxt_order("id1", "coid1"), ccxt_order("id2", "coid2", filled=0.4)]
+    assert await engine.reconcile_once() == 0
+    assert exchange.fetch_closed_orders.await_count == 1
+    assert engine.stats()["exchange_calls"] == 3
+
+@pytest.mark.asyncio
+async def test_failed_write_keeps_orders_pending():
+    exchange = MagicMock()
+    exchange.fetch_open_orders = AsyncMock(return_value=[])
+    exchange.fetch_closed_orders = AsyncMock(return_value=[ccxt_order("id1", "coid1", status="closed", filled=1.0)])
+    repository = MagicMock()
+    repository.update_statuses = AsyncMock(side_effect=ConnectionError("mongo down"))
+    engine = reconciler(exchange, repository)
+    engine.track_event(event(1), timestamp=1_700_000_000_000)
+
+    with pytest.raises(ConnectionError):
+        await engine.reconcile_once()
+    assert engine.stats()["orders"] == 1
+
+@pytest.mark.asyncio
+async def test_recover_only_takes_accounts_of_assigned_partitions():
+    documents = [{"id": f"id{user}", "clientOrderId": f"coid{user}", "userId": f"user{user}", "exchange": "bitget",
+                  "symbol": "BTCUSDT", "createdAt": datetime(2023, 11, 14)} for user in range(20)]
+    async def stream_open():
+        # Read off the cursor in batches
+        for start in range(0, len(documents), 8):
+            yield documents[start:start + 8]
+
+    repository = MagicMock()
+    repository.stream_open = stream_open
+    engine = reconciler(MagicMock(), repository)
+
+    await engine.recover({0}, partition_count=3)
+
+    assert engine.pending
+    assert all(partition_for(key, 3) == 0 for key in engine.pending)
+    assert len(engine.pending) == sum(1 for user in range(20) if partition_for((f"user{user}", "bitget"), 3) == 0)
+
+@pytest.mark.asyncio
+async def test_missing_credentials_are_not_reloaded_until_the_next_refresh():
+    loader = AsyncMock(return_value=[account])
+    engine = OrderReconciler(pool=FakePool(MagicMock()), repository_factory=MagicMock, credentials_loader=loader, credentials_refresh=60)
+    for _ in range(3):
+        assert await engine._credentials_for(("user1", "bitget")) == account
+        assert await engine._credentials_for(("deleted", "bitget")) is None
+    assert loader.await_count == 2
+    # Only the missing user is looked up on its own
+    assert set(loader.await_args_list[1].args[0]) == {"deleted"}
+
+    engine.pending[("user1", "bitget")] = {}
+    engine._credentials_loaded_at -= 60
+    assert await engine._credentials_for(("deleted", "bitget")) is None
+    assert loader.await_count == 3
+    assert set(loader.await_args.args[0]) == {"user1", "deleted"}
@@ -0,0 +1,39 @@
+import pytest
+from app.db.models import PositionStructure
+from app.db.services.redisservice import AsyncRedisService
+from .conftest import test_position_data, FakeRedis, fake_redis
+
+
+def test_position_key_uses_cache_key_format():
+    assert AsyncRedisService.position_key("user1") == "positions:user1"
+
+@pytest.mark.asyncio
+async def test_set_and_get_position(fake_redis: FakeRedis):
+    service = AsyncRedisService()
+    await service.set_position("user1", PositionStructure(**test_position_data))
+
+    assert list(fake_redis.hashes["positions:user1"]) == ["bitget:BTCUSDT:buy"]
+    position = await service.get_position("user1", "bitget", "BTCUSDT", "buy")
+    assert position["entryPrice"] == 35000.00
+    assert await service.get_position("user1", "bitget", "BTCUSDT", "sell") is None
+
+@pytest.mark.asyncio
+async def test_positions_are_read_and_written_in_one_round_trip(fake_redis: FakeRedis):
+    service = AsyncRedisService()
+    eth = dict(test_position_data, symbol="ETHUSDT")
+    await service.set_positions([("user1", test_position_data), ("user1", eth), ("user2", test_position_data)])
+    assert fake_redis.round_trips == 1
+
+    positions = await service.get_positions([("user1", "bitget", "ETHUSDT", "buy"),
+                                             ("user2", "bitget", "BTCUSDT", "buy"),
+                                             ("user2", "bitget", "ETHUSDT", "buy"),
+                                             ("user1", "bitget", "BTCUSDT", "buy")])
+    assert fake_redis.round_trips == 2
+    assert [position and position["symbol"] for position in positions] == ["ETHUSDT", "BTCUSDT", None, "BTCUSDT"]
+
+@pytest.mark.asyncio
+async def test_set_positions_removes_closed_positions(fake_redis: FakeRedis):
+    service = AsyncRedisService()
+    await service.set_positions([("user1", test_position_data)])
+    await service.set_positions([], removed=[("user1", "bitget", "BTCUSDT", "buy")])
+    assert await service.get_account_positions("user1") == []
@@ -0,0 +1,82 @@
+import pytest
+import ccxt.async_support as ccxt
+from unittest.mock import AsyncMock, patch
+from app.core import retrytemplate
+from app.core.retrytemplate import CircuitBreaker, CircuitOpen, RetryPolicy, retry_call
+from app.db.models import Exchange, OrderSide, OrderType, PlaceOrderBase, PositionAction, TimeInForce
+from app.exchanges.integrations import BitgetExchange
+
+FAST = RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.001, deadline=1.0)
+
+@pytest.fixture(autouse=True)
+def clear_breakers(monkeypatch):
+    monkeypatch.setattr(retrytemplate, "_breakers", {})
+
+def market_order() -> PlaceOrderBase:
+    return PlaceOrderBase(symbol="BTCUSDT", type=OrderType.MARKET, side=OrderSide.BUY, amount=1, clientOrderId="test123",
+                          exchange=Exchange.BITGET, positionAction=PositionAction.OPEN, timeInForce=TimeInForce.GoodTillCancel)
+
+@pytest.mark.asyncio
+async def test_breaker_opens_then_half_opens():
+    breaker = CircuitBreaker("test", fail_max=2, reset_timeout=0, failure_on=(ConnectionError,))
+    failing = AsyncMock(side_effect=ConnectionError())
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await breaker.call(failing)
+    assert breaker.opened == 1
+    # reset_timeout elapsed: one trial call goes through and closes the circuit
+    assert await breaker.call(AsyncMock(return_value="ok")) == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+@pytest.mark.asyncio
+async def test_open_breaker_fails_fast():
+    breaker = CircuitBreaker("test", fail_max=1, reset_timeout=60, failure_on=(ConnectionError,))
+    with pytest.raises(ConnectionError):
+        await breaker.call(AsyncMock(side_effect=ConnectionError()))
+    fn = AsyncMock()
+    with pytest.raises(CircuitOpen):
+        await breaker.call(fn)
+    fn.assert_not_awaited()
+    assert breaker.stats() == {"state": "open", "failures": 1, "opened": 1, "rejected": 1}
+
+@pytest.mark.asyncio
+async def test_errors_reported_by_the_target_do_not_trip_the_breaker():
+    breaker = CircuitBreaker("test", fail_max=1, failure_on=(ConnectionError,))
+    with pytest.raises(ValueError):
+        await breaker.call(AsyncMock(side_effect=ValueError()))
+    assert breaker.state == CircuitBreaker.CLOSED
+
+@pytest.mark.asyncio
+async def test_retry_until_success():
+    fn = AsyncMock(side_effect=[ConnectionError(), ConnectionError(), "ok"])
+    assert await retry_call(fn, FAST, retry_on=(ConnectionError,)) == "ok"
+    assert fn.await_count == 3
+
+@pytest.mark.asyncio
+async def test_no_retry_past_deadline():
+    fn = AsyncMock(side_effect=ConnectionError())
+    with pytest.raises(ConnectionError):
+        await retry_call(fn, RetryPolicy(attempts=5, base_delay=10, max_delay=10, deadline=0), retry_on=(ConnectionError,))
+    assert fn.await_count == 1
+
+@pytest.mark.asyncio
+async def test_order_found_by_client_order_id_is_not_placed_again(monkeypatch):
+    monkeypatch.setattr(retrytemplate, "backoff", lambda policy, attempt: 0)
+    bitget = BitgetExchange("test_key", "test_secret", rate_limiter=AsyncMock())
+    with patch("app.exchanges.integrations.ccxt.bitget.create_order", new_callable=AsyncMock,
+               side_effect=ccxt.RequestTimeout("timed out")) as create_order, \
+            patch("app.exchanges.integrations.ccxt.bitget.fetch_open_orders", new_callable=AsyncMock,
+                  return_value=[{"id": "1", "clientOrderId": "test123"}]):
+        result = await bitget.place_order(market_order())
+    assert result.id == "1"
+    create_order.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_order_without_client_order_id_is_not_retried():
+    bitget = BitgetExchange("test_key", "test_secret", rate_limiter=AsyncMock())
+    with patch("app.exchanges.integrations.ccxt.bitget.create_order", new_callable=AsyncMock,
+               side_effect=ccxt.RequestTimeout("timed out")) as create_order:
+        with pytest.raises(ccxt.RequestTimeout):
+            await bitget.place_order(market_order().model_copy(update={"clientOrderId": None}))
+    create_order.assert_awaited_once()
+    assert retrytemplate.breaker_stats()["bitget:place_order"]["failures"] == 1
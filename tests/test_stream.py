@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from unittest.mock import AsyncMock, patch
+from .conftest import app, test_user_token, mock_get_user
+from app.api.endpoints.stream import SSE_KEEP_ALIVE, sse_events
+from app.db.services.updatehub import TooManySubscribers, UpdateHub, update_hub
+
+ORDER_UPDATE = b'{"type":"order","data":{"clientOrderId":"coid1","status":"closed"}}'
+
+
+@pytest.fixture
+def no_listener():
+    # The hub never subscribes to Redis in these tests, messages are dispatched by hand
+    with patch.object(UpdateHub, "start", new_callable=AsyncMock) as _mocked:
+        yield _mocked
+
+@pytest.mark.asyncio
+async def test_updates_reach_only_the_connections_of_their_user(no_listener):
+    hub = UpdateHub(prefix="updates:", queue_size=10, max_connections=10)
+    async with hub.subscribe("user1") as first, hub.subscribe("user1") as second, hub.subscribe("user2") as other:
+        hub.dispatch(b"updates:user1", ORDER_UPDATE)
+        assert await first.get() == ORDER_UPDATE
+        assert await second.get() == ORDER_UPDATE
+        assert other._queue.empty()
+        assert hub.stats()["connections"] == 3 and hub.stats()["users"] == 2
+    assert hub.stats()["connections"] == 0 and hub.stats()["delivered"] == 2
+
+@pytest.mark.asyncio
+async def test_slow_consumer_is_dropped(no_listener):
+    hub = UpdateHub(prefix="updates:", queue_size=2, max_connections=1)
+    async with hub.subscribe("user1") as subscription:
+        with pytest.raises(TooManySubscribers):
+            async with hub.subscribe("user1"):
+                pass
+        for _ in range(3):
+            hub.dispatch(b"updates:user1", ORDER_UPDATE)
+        assert subscription.dropped
+        assert [await subscription.get() for _ in range(3)] == [ORDER_UPDATE, ORDER_UPDATE, None]
+        assert hub.stats()["dropped"] == 1 and hub.stats()["connections"] == 0
+        # No longer receives anything
+        hub.dispatch(b"updates:user1", ORDER_UPDATE)
+        assert subscription._queue.empty()
+
+@pytest.mark.asyncio
+async def test_publish_many_is_best_effort():
+    hub = UpdateHub(prefix="updates:")
+    with patch('app.db.services.redisservice.AsyncRedisService.publish_many', new_callable=AsyncMock) as publish_many:
+        await hub.publish_many([("user1", "order", {"status": "closed"}), ("user2", "position_closed", {"symbol": "BTCUSDT"})])
+        assert publish_many.await_args.args[0] == [("updates:user1", b'{"type":"order","data":{"status":"closed"}}'),
+                                                   ("updates:user2", b'{"type":"position_closed","data":{"symbol":"BTCUSDT"}}')]
+        publish_many.side_effect = ConnectionError("redis down")
+        await hub.publish("user1", "order", {})
+    assert hub.stats()["publish_errors"] == 1
+
+@pytest.mark.asyncio
+async def test_server_sent_events(no_listener):
+    events = sse_events("user1", heartbeat=0.01)
+    assert await events.__anext__() == SSE_KEEP_ALIVE
+    update_hub.dispatch(b"updates:user1", ORDER_UPDATE)
+    assert await events.__anext__() == b"data: " + ORDER_UPDATE + b"\n\n"
+    await events.aclose()
+    assert update_hub.stats()["connections"] == 0
+
+@pytest.mark.asyncio
+async def test_streams_end_when_the_hub_closes(no_listener):
+    hub = UpdateHub(prefix="updates:", queue_size=10, max_connections=10)
+    with patch("app.api.endpoints.stream.update_hub", hub):
+        events = sse_events("user1", heartbeat=1)
+        pending = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0)
+        hub.close_streams()
+        with pytest.raises(StopAsyncIteration):
+            await pending
+        with pytest.raises(TooManySubscribers):
+            async with hub.subscribe("user1"):
+                pass
+    assert hub.stats()["connections"] == 0
+
+def test_websocket_requires_a_token(app):
+    with pytest.raises(WebSocketDisconnect) as disconnect:
+        with TestClient(app).websocket_connect("/stream") as websocket:
+            websocket.receive_text()
+    assert disconnect.value.code == 1008
+
+def test_websocket_pushes_updates(app, test_user_token: str, mock_get_user):
+    async def _start(hub):
+        # Delivered as soon as the connection is subscribed
+        asyncio.get_running_loop().call_soon(hub.dispatch, b"updates:test_id", ORDER_UPDATE)
+
+    with patch.object(UpdateHub, "start", _start):
+        with TestClient(app).websocket_connect(f"/stream?token={test_user_token}") as websocket:
+            assert websocket.receive_text() == ORDER_UPDATE.decode()
@@ -1,7 +1,9 @@
 import pytest
+from unittest.mock import AsyncMock, patch
 from httpx import AsyncClient
 from .conftest import client, mock_redis_no_position, mock_redis_with_position, test_user_token, \
 mock_get_user, mock_bitget_tpsl_order, mock_bitget_place_order_response, mock_bitget_close_position_order
+from app.core.retrytemplate import CircuitOpen
 from app.db.models import OrderStructure, OrderType
 import json
 
@@ -25,3 +27,11 @@ async def test_tpsl_incorrect_order_type(client: AsyncClient, test_user_token:st
     assert response.status_code == 400
     assert response.json() == {"detail": "Order type is not a TP/SL order"}
 
+
+@pytest.mark.asyncio
+async def test_tpsl_exchange_unavailable(client: AsyncClient, test_user_token:str, mock_get_user, mock_bitget_tpsl_order: json, mock_redis_with_position: json):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    with patch('app.exchanges.integrations.BitgetExchange.place_order', new_callable=AsyncMock, side_effect=CircuitOpen("bitget", 3)):
+        response = await client.post("/position/tpsl_order/", json=mock_bitget_tpsl_order, headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
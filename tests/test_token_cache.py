@@ -0,0 +1,99 @@
+import time
+import pytest
+from datetime import timedelta
+from unittest.mock import AsyncMock, patch
+from httpx import AsyncClient
+from jose import JWTError
+from app.auth.jwt import create_access_token
+from app.db.services.redisservice import AsyncRedisService
+from app.db.services.tokencache import TokenCache, TokenRevoked, token_cache
+from .conftest import client, test_user_token, mock_get_user
+
+
+@pytest.fixture
+def redis_revocations(monkeypatch):
+    """Redis keys and publications of the revocations, in memory."""
+    keys = {}
+    published = []
+
+    async def _set(key, value, ttl=None, only_if_absent=False):
+        keys[key] = value
+        return True
+
+    async def _publish(channel, message):
+        published.append((channel, message))
+        return 1
+
+    monkeypatch.setattr(AsyncRedisService, "get", AsyncMock(side_effect=lambda key: keys.get(key)))
+    monkeypatch.setattr(AsyncRedisService, "set", AsyncMock(side_effect=_set))
+    monkeypatch.setattr(AsyncRedisService, "publish", AsyncMock(side_effect=_publish))
+    return keys, published
+
+@pytest.mark.asyncio
+async def test_token_is_verified_once_until_it_expires(redis_revocations):
+    cache = TokenCache(maxsize=10, prefix="revoked:", channel="revocations")
+    token = create_access_token(data={"sub": "testuser"}, expires_delta=timedelta(minutes=5))
+    with patch.object(TokenCache, "decode", side_effect=TokenCache.decode) as decode:
+        assert await cache.verify(token) == "testuser"
+        assert await cache.verify(token) == "testuser"
+    decode.assert_called_once()
+    expires_at, _ = cache._verified._data[cache.token_id(token)]
+    assert 290 < expires_at - time.monotonic() <= 300
+    assert cache.stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_invalid_tokens_are_not_cached(redis_revocations):
+    cache = TokenCache(maxsize=10, prefix="revoked:", channel="revocations")
+    with pytest.raises(JWTError):
+        await cache.verify("not.a.token")
+    with pytest.raises(JWTError):
+        await cache.verify(create_access_token(data={"sub": "testuser"}, expires_delta=timedelta(seconds=-1)))
+    assert cache.stats()["size"] == 0
+
+@pytest.mark.asyncio
+async def test_revoked_token_is_rejected_by_every_worker(redis_revocations):
+    keys, published = redis_revocations
+    worker, other_worker = (TokenCache(maxsize=10, prefix="revoked:", channel="revocations") for _ in range(2))
+    token = create_access_token(data={"sub": "testuser"}, expires_delta=timedelta(minutes=5))
+    assert await worker.verify(token) == "testuser"
+
+    await worker.revoke(token)
+
+    token_id = worker.token_id(token)
+    assert keys == {f"revoked:{token_id}": b"1"} and published == [("revocations", token_id)]
+    with pytest.raises(TokenRevoked):
+        await worker.verify(token)
+    # A worker that never cached the token finds the revocation in Redis
+    with pytest.raises(TokenRevoked):
+        await other_worker.verify(token)
+
+@pytest.mark.asyncio
+async def test_unavailable_redis_does_not_fail_authentication(monkeypatch):
+    monkeypatch.setattr(AsyncRedisService, "get", AsyncMock(side_effect=ConnectionError("redis down")))
+    cache = TokenCache(maxsize=10, prefix="revoked:", channel="revocations")
+    assert await cache.verify(create_access_token(data={"sub": "testuser"})) == "testuser"
+    assert cache.stats()["revocation_errors"] == 1
+
+@pytest.mark.asyncio
+async def test_logout_revokes_the_token(client: AsyncClient, test_user_token: str, mock_get_user, redis_revocations):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    response = await client.post("/auth/logout", headers=headers)
+    assert response.status_code == 204
+    response = await client.post("/auth/logout", headers=headers)
+    assert response.status_code == 401
+    assert token_cache.stats()["revoked"] == 1
+
+@pytest.mark.asyncio
+async def test_revocation_received_while_reading_redis_is_not_missed(monkeypatch):
+    cache = TokenCache(maxsize=10, prefix="revoked:", channel="revocations")
+    token = create_access_token(data={"sub": "testuser"}, expires_delta=timedelta(minutes=5))
+
+    async def _get(key):
+        # Another worker revokes the token after this read was answered
+        cache.revoked_elsewhere(cache.token_id(token))
+        return None
+
+    monkeypatch.setattr(AsyncRedisService, "get", AsyncMock(side_effect=_get))
+    with pytest.raises(TokenRevoked):
+        await cache.verify(token)
+    assert cache.stats()["size"] == 0
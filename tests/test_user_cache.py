@@ -0,0 +1,52 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from httpx import AsyncClient
+from app.core.cache import TTLCache
+from app.db.models import UserInDB
+from app.db.services.redisservice import AsyncRedisService
+from app.db.services.usercache import UserCache, user_cache
+from .conftest import client, test_user_token, mock_get_user, mock_redis_with_position, \
+mock_bitget_close_position_order, mock_bitget_place_order_response
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=60)
+    with patch("app.core.cache.time.monotonic", return_value=1000):
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=5)
+    with patch("app.core.cache.time.monotonic", return_value=1010):
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+
+@pytest.mark.asyncio
+async def test_invalidate_evicts_and_publishes(test_user: UserInDB, monkeypatch):
+    mock_publish = AsyncMock(return_value=1)
+    monkeypatch.setattr(AsyncRedisService, "publish", mock_publish)
+    cache = UserCache(maxsize=10, ttl=60, channel="test_channel")
+    cache.set(test_user)
+    assert cache.get(test_user.username) is test_user
+
+    await cache.invalidate(test_user.username)
+
+    assert cache.get(test_user.username) is None
+    mock_publish.assert_called_once_with("test_channel", test_user.username)
+
+@pytest.mark.asyncio
+async def test_authenticated_requests_hit_cache(client: AsyncClient, test_user_token: str, mock_get_user, mock_bitget_close_position_order,
+                                                mock_bitget_place_order_response, mock_redis_with_position):
+    headers = {"Authorization": f"Bearer {test_user_token}"}
+    for _ in range(3):
+        response = await client.post("/position/close_position/", json=mock_bitget_close_position_order, headers=headers)
+        assert response.status_code == 200
+    mock_get_user.assert_called_once()
+    assert user_cache.get("testuser") is not None
@@ -31,3 +31,69 @@ async def test_get_exchange_credentials(mock_db_service):
     assert credentials == sample_credentials
     mock_db_service.find_one.assert_called_once_with(UserRepository.EXCHANGE_COLLECTION_NAME, {"user_id": sample_user_id, "name": sample_exchange_name})
 
+
+
+@pytest.mark.asyncio
+async def test_get_loads_user_and_credentials_in_one_query():
+    from bson import ObjectId
+    user_id = ObjectId()
+    mock_service = AsyncMock(spec=AsyncMongoDBService)
+    mock_service.aggregate.return_value = [{
+        "_id": user_id,
+        "username": "testuser",
+        "hashed_password": "hashed",
+        "api_key": "key",
+        "api_secret": "secret",
+        "exchanges": [{"name": "bitget", "api_key": "bitget_key", "api_secret": "bitget_secret"}],
+    }]
+    user_repo = UserRepository(mock_service)
+
+    user = await user_repo.get("testuser")
+
+    assert user.id == str(user_id)
+    assert user.exchanges[0].user_id == str(user_id)
+    assert user.exchanges[0].api_key == "bitget_key"
+    mock_service.aggregate.assert_called_once()
+    mock_service.find_one.assert_not_called()
+    pipeline = mock_service.aggregate.call_args.args[1]
+    assert pipeline[0] == {"$match": {"username": "testuser"}}
+    assert pipeline[2]["$lookup"]["from"] == UserRepository.EXCHANGE_COLLECTION_NAME
+
+@pytest.mark.asyncio
+async def test_get_unknown_user():
+    mock_service = AsyncMock(spec=AsyncMongoDBService)
+    mock_service.aggregate.return_value = []
+    assert await UserRepository(mock_service).get("nobody") is None
+
+@pytest.mark.asyncio
+async def test_credential_writes_invalidate_the_cached_user(monkeypatch):
+    from bson import ObjectId
+    from app.db.models import Exchange, ExchangeCredentials
+    from app.db.services.usercache import user_cache
+    invalidate = AsyncMock()
+    monkeypatch.setattr(user_cache, "invalidate", invalidate)
+    mock_service = AsyncMock(spec=AsyncMongoDBService)
+    user_repo = UserRepository(mock_service)
+    credentials = ExchangeCredentials(user_id=str(ObjectId()), name=Exchange.BITGET, api_key="new_key", api_secret="new_secret")
+
+    await user_repo.add_exchange_credentials("testuser", credentials)
+    await user_repo.update_exchange_credentials("testuser", credentials)
+    await user_repo.delete_exchange_credentials("testuser", credentials.user_id, "bitget")
+
+    assert invalidate.await_count == 3
+    assert all(call.args == ("testuser",) for call in invalidate.await_args_list)
+    filter = mock_service.update_one.call_args.args[1]
+    assert filter == {"user_id": ObjectId(credentials.user_id), "name": "bitget"}
+
+@pytest.mark.asyncio
+async def test_credentials_are_listed_for_the_given_users_only():
+    from bson import ObjectId
+    user_id = ObjectId()
+    mock_service = AsyncMock(spec=AsyncMongoDBService)
+    mock_service.find.return_value = [{"user_id": user_id, "name": "bitget", "api_key": "key", "api_secret": "secret"}]
+    user_repo = UserRepository(mock_service)
+
+    credentials = await user_repo.list_exchange_credentials([str(user_id)])
+
+    assert credentials[0].user_id == str(user_id)
+    assert mock_service.find.call_args.args[1] == {"user_id": {"$in": [user_id]}}
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.write_concern import WriteConcern
+from app.db.services.mongodbservice import AsyncMongoDBService, WRITE_BATCH_SIZE, WriteCoalescer, parse_write_concerns
+
+
+class FakeCollection:
+    def __init__(self, duplicates=()):
+        self.duplicates = set(duplicates)
+        self.inserted = []
+        self.batches = []
+
+    async def insert_many(self, documents, ordered=True):
+        assert ordered is False
+        self.batches.append(len(documents))
+        errors = []
+        for index, document in enumerate(documents):
+            document.setdefault("_id", f"id-{document['clientOrderId']}")
+            if document["clientOrderId"] in self.duplicates:
+                errors.append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key"})
+            else:
+                self.inserted.append(document)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_inserts_go_out_as_one_batch():
+    collection = FakeCollection(duplicates={"order2"})
+    concerns = []
+    coalescer = WriteCoalescer(lambda name, write_concern: concerns.append(write_concern) or collection, max_batch=100, max_delay=0.01)
+    batches = WRITE_BATCH_SIZE.count("orders", "insert")
+
+    results = await asyncio.gather(*(coalescer.insert("orders", {"clientOrderId": f"order{number}"}) for number in range(5)),
+                                   return_exceptions=True)
+
+    assert collection.batches == [5]
+    assert results[0] == "id-order0"
+    # Only the duplicate fails, the rest of the batch is written
+    assert isinstance(results[2], DuplicateKeyError)
+    assert len(collection.inserted) == 4
+    assert coalescer.stats()["errors"] == 1
+    assert WRITE_BATCH_SIZE.count("orders", "insert") == batches + 1
+
+@pytest.mark.asyncio
+async def test_full_batches_are_sent_right_away_and_split_by_write_concern():
+    collection = FakeCollection()
+    concerns = []
+    coalescer = WriteCoalescer(lambda name, write_concern: concerns.append(write_concern) or collection, max_batch=2, max_delay=10)
+    majority = WriteConcern(w="majority")
+
+    await asyncio.wait_for(asyncio.gather(coalescer.insert("orders", {"clientOrderId": "a"}, majority),
+                                          coalescer.insert("orders", {"clientOrderId": "b"}, WriteConcern(w="majority"))), 1)
+    pending = coalescer.insert("orders", {"clientOrderId": "c"})
+    await coalescer.flush()
+
+    assert collection.batches == [2, 1]
+    assert concerns == [majority, None]
+    assert pending.result() == "id-c"
+
+@pytest.mark.asyncio
+async def test_service_coalesces_configured_collections(monkeypatch):
+    collection = MagicMock()
+    collection.bulk_write = AsyncMock()
+    database = MagicMock()
+    database.__getitem__.return_value = collection
+    client = MagicMock()
+    client.__getitem__.return_value = database
+    monkeypatch.setattr("app.db.services.mongodbservice.AsyncIOMotorClient", lambda *args, **kwargs: client)
+    service = AsyncMongoDBService(uri="mock://mockdb", database_name="mockdb")
+
+    await asyncio.gather(service.update_one("orders", {"clientOrderId": "a"}, {"$set": {"status": "closed"}}),
+                         service.update_one("orders", {"clientOrderId": "b"}, {"$set": {"status": "closed"}}))
+
+    collection.bulk_write.assert_awaited_once()
+    operations = collection.bulk_write.await_args.args[0]
+    assert [operation._filter for operation in operations] == [{"clientOrderId": "a"}, {"clientOrderId": "b"}]
+
+def test_parse_write_concerns():
+    concerns = parse_write_concerns({"orders": "majority", "events": "1"})
+    assert concerns["orders"].document == {"w": "majority"}
+    assert concerns["events"].document == {"w": 1}